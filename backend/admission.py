@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+I decide at the door whether a new stylize run gets in.
+
+The scheduler (backend/scheduler.py) already caps how many runs execute at once, but its
+waiting line is unbounded: under a burst every request queues, and all of them time out
+together. I keep a bounded line per style instead. A style may have at most
+ARTIFY_QUEUE_PER_STYLE runs admitted (queued or running); past that a request is refused
+straight away with 429 and a Retry-After, so the admitted ones keep their latency.
+
+Cache hits and requests that join an identical run in flight cost nothing and skip me.
+
+I also keep the last few run durations per (style, mode), which give
+- the ETA handed to admitted requests (queue ahead of them ÷ threads, plus their own run), and
+- the Retry-After for refused ones (when the first of the style's runs should finish).
+
+Settings (env vars):
+  ARTIFY_QUEUE_PER_STYLE  runs admitted per style, queued or running (default 8, 0 = no limit)
+  ARTIFY_ETA_WINDOW       recent durations kept per style and mode (default 20)
+"""
+from __future__ import annotations
+import os, math, time, threading, collections
+from concurrent.futures import Future
+from typing import Deque, Dict, List, Tuple
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+# Rough guesses (seconds) until a style/mode has durations of its own.
+DEFAULT_RUN_S = {"preview": 15.0, "full": 45.0}
+
+
+class QueueFull(Exception):
+    def __init__(self, style: str, retry_after_s: int):
+        super().__init__(f"Too many '{style}' runs waiting; retry in about {retry_after_s} s")
+        self.style = style
+        self.retry_after_s = retry_after_s
+
+
+class Admission:
+    def __init__(self, per_style: int, window: int):
+        self.per_style = max(0, per_style)
+        self.window = max(1, window)
+        self._lock = threading.Lock()
+        self._admitted: Dict[str, List[Tuple[str, Future]]] = collections.defaultdict(list)
+        self._durations: Dict[Tuple[str, str], Deque[float]] = {}
+        self.stats = {"admitted": 0, "rejected": 0}
+
+    def typical_s(self, style: str, mode: str) -> float:
+        # I use the median of recent runs: one cold start shouldn't move every estimate.
+        with self._lock:
+            recent = sorted(self._durations.get((style, mode), ()))
+        if not recent:
+            return DEFAULT_RUN_S.get(mode, DEFAULT_RUN_S["full"])
+        return recent[len(recent) // 2]
+
+    def _retry_after(self, style: str) -> int:
+        # When should the first of this style's runs be done? Queued ones count from now.
+        with self._lock:
+            admitted = list(self._admitted[style])
+        now = time.time()
+        left = [self.typical_s(style, mode) - (now - getattr(fut, "started_at", now)) for mode, fut in admitted]
+        return max(1, math.ceil(min(left, default=1)))
+
+    def admit(self, style: str, mode: str, start) -> Future:
+        """
+        I call `start()` (which must return the run's future) if `style` has room, and track
+        the run until it's done. Raises QueueFull otherwise.
+        """
+        with self._lock:
+            full = self.per_style and len(self._admitted[style]) >= self.per_style
+            if full:
+                self.stats["rejected"] += 1
+            else:
+                # Starting under the lock keeps a burst from slipping past the limit together.
+                fut = start()
+                entry = (mode, fut)
+                self._admitted[style].append(entry)
+                self.stats["admitted"] += 1
+        if full:
+            raise QueueFull(style, self._retry_after(style))
+
+        def _done(f: Future) -> None:
+            with self._lock:
+                self._admitted[style].remove(entry)
+            started = getattr(f, "started_at", None)
+            if started and not f.cancelled() and f.exception() is None:
+                self.record(style, mode, time.time() - started)
+
+        fut.add_done_callback(_done)
+        return fut
+
+    def record(self, style: str, mode: str, seconds: float) -> None:
+        # Only finished runs count; failures and cancellations say nothing about run time.
+        with self._lock:
+            self._durations.setdefault((style, mode), collections.deque(maxlen=self.window)).append(seconds)
+
+    def eta_s(self, style: str, mode: str, queued_ahead: int, threads: int) -> float:
+        # Everything queued ahead shares the threads, then my own run.
+        return self.typical_s(style, mode) * (1 + queued_ahead / max(1, threads))
+
+    def status(self) -> dict:
+        with self._lock:
+            admitted = {s: len(v) for s, v in self._admitted.items() if v}
+            keys = list(self._durations)
+        return {
+            "perStyle": self.per_style,
+            "admitted": admitted,
+            "typicalS": {f"{s}/{m}": round(self.typical_s(s, m), 2) for s, m in keys},
+            **self.stats,
+        }
+
+
+GATE = Admission(
+    per_style=_env_int("ARTIFY_QUEUE_PER_STYLE", 8),
+    window=_env_int("ARTIFY_ETA_WINDOW", 20),
+)
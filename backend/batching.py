@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+I merge concurrent, compatible resident-mode runs into one batched pipeline call.
+
+Two runs are compatible when they go to the same script with the same flags apart from
+--seed (same style, subject, control, strength, steps and size bucket — all of those are
+flags). The first run to arrive opens a group and waits up to ARTIFY_BATCH_WINDOW_MS for
+company; then it calls the script's `stylize_batch(images, args_list)` once for the whole
+group and hands each caller its own image back. Each item keeps its own seed/generator.
+
+The batch runs on the first run's thread, but it belongs to every member: each member's
+progress sink gets the batch's step events, each member gets the batch's stage recording for
+its own trace, and the batch is only interrupted once every member's cancel token has tripped.
+A member whose token trips stops waiting at once and fails with `Cancelled`; if the batch
+hasn't started yet it is dropped from it, otherwise its image is simply thrown away.
+
+Only resident mode batches (the pipelines live in this process) and only scripts that
+provide `stylize_batch`; everything else runs one by one as before.
+
+Note: a waiting run holds one of the scheduler's stylize threads, so a batch can never be
+larger than ARTIFY_JOB_CONCURRENCY. Raise it together with ARTIFY_BATCH_MAX when batching;
+GPU work is still serialized per pipeline by `scripts/pipeline_cache.py`.
+
+Settings (env vars):
+  ARTIFY_BATCH_WINDOW_MS  how long the first run waits for others (default 0 = off)
+  ARTIFY_BATCH_MAX        largest batch (default 4)
+"""
+from __future__ import annotations
+import os, threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from PIL import Image
+
+from backend.cancellation import Cancelled
+
+# call(images, args_list, report, should_stop) -> (images, stage recording); report and
+# should_stop are None when no member listens for progress / can be cancelled.
+BatchCall = Callable[[List[Image.Image], List[Any], Optional[Callable[[dict], None]],
+                      Optional[Callable[[], bool]]], Tuple[List[Image.Image], Optional[dict]]]
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def window_s() -> float:
+    # I read the settings per call, like the exec mode, so they can be flipped without a restart.
+    return max(0, _env_int("ARTIFY_BATCH_WINDOW_MS", 0)) / 1000.0
+
+
+def max_batch() -> int:
+    return max(1, _env_int("ARTIFY_BATCH_MAX", 4))
+
+
+def batch_key(script: str, flags: List[str]) -> Tuple[str, ...]:
+    # I drop the seed (it's per item); every other flag must match exactly.
+    out, skip = [script], False
+    for f in flags:
+        if skip:
+            skip = False
+        elif f == "--seed":
+            skip = True
+        else:
+            out.append(f)
+    return tuple(out)
+
+
+class _Member:
+    def __init__(self, image: Image.Image, args, sink, token):
+        self.image, self.args, self.sink, self.token = image, args, sink, token
+        self.left = False           # stopped waiting (its token tripped); gets no more events
+        self.result: Optional[Image.Image] = None
+
+    def reason(self) -> Optional[str]:
+        return self.token.reason() if self.token is not None else None
+
+
+class _Group:
+    def __init__(self):
+        self.items: List[_Member] = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.started = False
+        self.rec: Optional[dict] = None
+        self.error: Optional[BaseException] = None
+
+
+_OPEN: Dict[Tuple[str, ...], _Group] = {}
+_LOCK = threading.Lock()
+_STATS = {"batches": 0, "items": 0}
+
+
+def _leave(key: Tuple[str, ...], group: _Group, me: _Member, reason: str) -> None:
+    # I stop waiting for the batch: out of it if it hasn't started, otherwise just deaf to it.
+    with _LOCK:
+        me.left = True
+        if not group.started:
+            group.items.remove(me)
+            if not group.items and _OPEN.get(key) is group:
+                del _OPEN[key]
+    raise Cancelled(reason)
+
+
+def _report(members: List[_Member]):
+    # One step event of the batch goes to every member still waiting for it.
+    sinks = [m for m in members if m.sink is not None]
+    if not sinks:
+        return None
+
+    def report(event: dict) -> None:
+        for m in sinks:
+            if not m.left:
+                m.sink(event)
+    return report
+
+
+def _should_stop(members: List[_Member]):
+    # The batch stops only when nobody wants any of its images any more.
+    if any(m.token is None for m in members):
+        return None
+    return lambda: all(m.left or m.reason() is not None for m in members)
+
+
+def _lead(key: Tuple[str, ...], group: _Group, me: _Member, call: BatchCall) -> None:
+    group.full.wait(window_s())
+    with _LOCK:
+        if _OPEN.get(key) is group:
+            del _OPEN[key]
+        group.started = True
+        # Members whose token tripped during the window are left out of the call.
+        for m in group.items:
+            if m is not me and m.reason() is not None:
+                m.left = True
+        members = [m for m in group.items if not m.left and (m is not me or m.reason() is None)]
+        _STATS["batches"] += bool(members)
+        _STATS["items"] += len(members)
+    try:
+        if members:
+            images, group.rec = call([m.image for m in members], [m.args for m in members],
+                                     _report(members), _should_stop(members))
+            for m, img in zip(members, images):
+                m.result = img
+    except BaseException as e:
+        group.error = e
+    finally:
+        group.done.set()
+
+
+def run(key: Tuple[str, ...], call: BatchCall, image: Image.Image, args,
+        sink=None, token=None) -> Tuple[Image.Image, Optional[dict]]:
+    """
+    I run `image` through `call` (the script's `stylize_batch` under the caller's hooks) together
+    with any compatible runs arriving in the window, and return (image, the batch's stage recording).
+    `sink` and `token` are this caller's progress sink and cancel token.
+    """
+    limit = max_batch()
+    me = _Member(image, args, sink, token)
+    with _LOCK:
+        group = _OPEN.get(key)
+        leader = group is None
+        if leader:
+            group = _OPEN[key] = _Group()
+        group.items.append(me)
+        if len(group.items) >= limit:
+            _OPEN.pop(key, None)
+            group.full.set()
+
+    if leader:
+        # I run the batch on my thread even if I'm cancelled meanwhile: the others still need it.
+        _lead(key, group, me, call)
+    else:
+        while not group.done.wait(0.25 if token is not None else None):
+            reason = me.reason()
+            if reason:
+                _leave(key, group, me, reason)
+
+    reason = me.reason()
+    if reason:
+        raise Cancelled(reason)
+    if group.error is not None:
+        raise group.error
+    return me.result, group.rec
+
+
+def status() -> dict:
+    with _LOCK:
+        return dict(_STATS)
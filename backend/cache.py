@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+I remember finished stylize results so a repeated deterministic request is answered instantly.
+
+With a fixed `seed` a run is a pure function of the decoded pixels and the request knobs,
+so I key results on a SHA-256 of both (`request_key`). Values are the encoded JPEG bytes
+exactly as they were sent the first time.
+
+- Memory tier: an LRU bounded by ARTIFY_CACHE_MB.
+- Disk tier (optional): one `<key>.jpg` per result under ARTIFY_CACHE_DIR, oldest-used
+  files evicted once the folder grows past ARTIFY_CACHE_DISK_MB. Survives restarts.
+- Single flight: while a key is being computed, identical requests share its future
+  instead of queueing their own run.
+
+Settings (env vars):
+  ARTIFY_CACHE_MB       memory tier size, 0 turns the cache off (default 256)
+  ARTIFY_CACHE_DIR      folder for the disk tier (default: no disk tier)
+  ARTIFY_CACHE_DISK_MB  disk tier size (default 2048)
+"""
+from __future__ import annotations
+import os, json, uuid, hashlib, threading, collections
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from PIL import Image
+
+# I bump this when the stored format or the meaning of a key changes.
+KEY_VERSION = 1
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _hash_image(h, img: Image.Image) -> None:
+    h.update(f"{img.mode}:{img.size[0]}x{img.size[1]}:".encode("ascii"))
+    h.update(img.tobytes())
+
+
+def request_key(src: Image.Image, refs: List[Image.Image], params: Dict[str, Any]) -> str:
+    """I hash the decoded pixels (not the upload bytes, so re-encodes still hit) plus normalized params."""
+    h = hashlib.sha256(f"v{KEY_VERSION}|".encode("ascii"))
+    h.update(json.dumps(params, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8"))
+    _hash_image(h, src)
+    for ref in refs:
+        h.update(b"|ref|")
+        _hash_image(h, ref)
+    return h.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, mem_bytes: int, disk_dir: Optional[str], disk_bytes: int):
+        self.mem_bytes = max(0, mem_bytes)
+        self.disk_dir = disk_dir
+        self.disk_bytes = max(0, disk_bytes)
+        self._mem: "collections.OrderedDict[str, bytes]" = collections.OrderedDict()
+        self._mem_used = 0
+        self._disk_used: Optional[int] = None      # I scan the folder lazily on first use
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "coalesced": 0, "misses": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.mem_bytes > 0
+
+    # ---- memory tier ----
+    def _mem_put(self, key: str, data: bytes) -> None:
+        if len(data) > self.mem_bytes:
+            return
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_used -= len(old)
+        self._mem[key] = data
+        self._mem_used += len(data)
+        while self._mem_used > self.mem_bytes:
+            _, dropped = self._mem.popitem(last=False)
+            self._mem_used -= len(dropped)
+
+    # ---- disk tier ----
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.jpg")
+
+    def _disk_files(self):
+        out = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith(".jpg"):
+                try:
+                    st = os.stat(os.path.join(self.disk_dir, name))
+                except OSError:
+                    continue
+                out.append((st.st_mtime, st.st_size, name))
+        return out
+
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)      # I use mtime as "last used" for eviction
+            return data
+        except OSError:
+            return None
+
+    def _disk_put(self, key: str, data: bytes) -> None:
+        if not self.disk_dir or len(data) > self.disk_bytes:
+            return
+        os.makedirs(self.disk_dir, exist_ok=True)
+        if self._disk_used is None:
+            self._disk_used = sum(size for _, size, _ in self._disk_files())
+        # I write to a temp name and rename, so a crash never leaves a half-written hit behind.
+        tmp = os.path.join(self.disk_dir, f".{key}.{uuid.uuid4().hex[:6]}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(key))
+        self._disk_used += len(data)
+        if self._disk_used > self.disk_bytes:
+            files = sorted(self._disk_files())
+            self._disk_used = sum(size for _, size, _ in files)
+            for _, size, name in files:
+                if self._disk_used <= self.disk_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.disk_dir, name))
+                    self._disk_used -= size
+                except OSError:
+                    pass
+
+    # ---- public ----
+    def get(self, key: str) -> Optional[bytes]:
+        """I return cached JPEG bytes (memory first, then disk) or None."""
+        with self._lock:
+            data = self._mem.get(key)
+            if data is not None:
+                self._mem.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return data
+        data = self._disk_get(key)
+        if data is not None:
+            with self._lock:
+                self._mem_put(key, data)
+                self.stats["disk_hits"] += 1
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        with self._lock:
+            self._mem_put(key, data)
+        # Disk writes get their own lock so memory hits never wait on I/O.
+        with self._disk_lock:
+            try:
+                self._disk_put(key, data)
+            except OSError as e:
+                print(f"[cache] disk write failed: {e}")
+
+    def single_flight(self, key: str, start: Callable[[], Future]) -> Tuple[Future, str]:
+        """
+        I return (future, "miss") after calling `start()`, or (the running future, "coalesced")
+        when the same key is already being computed. `start()`'s future must resolve to the
+        JPEG bytes; I store them once it succeeds.
+        """
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                self.stats["coalesced"] += 1
+                return fut, "coalesced"
+            fut = start()
+            self._inflight[key] = fut
+            self.stats["misses"] += 1
+
+        def _done(f: Future) -> None:
+            with self._lock:
+                self._inflight.pop(key, None)
+            if not f.cancelled() and f.exception() is None:
+                self.put(key, f.result())
+
+        fut.add_done_callback(_done)
+        return fut, "miss"
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._mem),
+                "memoryBytes": self._mem_used,
+                "diskBytes": self._disk_used,
+                **self.stats,
+            }
+
+
+RESULTS = ResultCache(
+    mem_bytes=_env_int("ARTIFY_CACHE_MB", 256) * 1024 * 1024,
+    disk_dir=os.environ.get("ARTIFY_CACHE_DIR") or None,
+    disk_bytes=_env_int("ARTIFY_CACHE_DISK_MB", 2048) * 1024 * 1024,
+)
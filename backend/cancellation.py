@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+I let a stylize run find out that nobody wants its result any more, so it can stop.
+
+Every run the server starts gets a `CancelToken`, hung on its future as `future.token`
+(like `started_at`). The token is shared by everyone waiting on that run (a coalesced
+request joins it), and it trips when
+
+- every waiter has walked away (`release()`: client disconnected, DELETE /api/jobs/{id}), or
+- the run is past its deadline (the latest `deadlineMs` of its waiters; no deadline wins).
+
+The stylize thread runs `with cancellation.watching(token): ...`; the runner picks the token
+up with `current()` and stops the work the way its mode allows: a step-callback interrupt
+in resident mode, a "cancel" frame (or a kill) in worker mode, terminating the script in
+subprocess mode. The run then fails with `Cancelled`.
+"""
+from __future__ import annotations
+import time, threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+
+class Cancelled(Exception):
+    """A run was stopped early. `reason` is "cancelled" or "deadline"."""
+
+    def __init__(self, reason: str):
+        super().__init__("deadline exceeded" if reason == "deadline" else "cancelled")
+        self.reason = reason
+
+
+class CancelToken:
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline            # unix time, or None
+        self._holders = 1
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def join(self, deadline: Optional[float] = None) -> bool:
+        # Another waiter shares the run; False if it was already abandoned (start a new one instead).
+        with self._lock:
+            if self._cancelled:
+                return False
+            self._holders += 1
+            if self.deadline is not None:
+                self.deadline = None if deadline is None else max(self.deadline, deadline)
+            return True
+
+    def release(self) -> bool:
+        # One waiter is gone; I trip (and return True) when it was the last one.
+        with self._lock:
+            self._holders -= 1
+            if self._holders <= 0:
+                self._cancelled = True
+            return self._cancelled
+
+    def reason(self) -> Optional[str]:
+        if self._cancelled:
+            return "cancelled"
+        if self.deadline is not None and time.time() > self.deadline:
+            return "deadline"
+        return None
+
+    def check(self) -> None:
+        reason = self.reason()
+        if reason:
+            raise Cancelled(reason)
+
+
+_LOCAL = threading.local()
+
+
+@contextmanager
+def watching(token: Optional[CancelToken]) -> Iterator[None]:
+    # I make `token` the one stylize work on this thread should honour.
+    prev = getattr(_LOCAL, "token", None)
+    _LOCAL.token = token
+    try:
+        yield
+    finally:
+        _LOCAL.token = prev
+
+
+def current() -> Optional[CancelToken]:
+    return getattr(_LOCAL, "token", None)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+I run stylize work off the HTTP threads and keep track of async jobs.
+
+- Every stylize run (sync `/api/stylize` or async `/api/jobs`) goes through `submit()`,
+  backed by the priority scheduler in `backend/scheduler.py`: a bounded set of threads,
+  so a burst of full renders can't eat FastAPI's whole threadpool and `/healthz` stays
+  snappy, and previews are started ahead of full renders.
+- `/api/jobs` callers get a job id straight away and poll `GET /api/jobs/{id}`; I keep
+  finished jobs around for ARTIFY_JOB_TTL_S seconds so late pollers still see the result.
+- `abandon(future)` is how any waiter (a job, a disconnected client) gives up on a run; the
+  run is cancelled once nobody is left waiting for it (see backend/cancellation.py).
+
+Settings (env vars; see backend/scheduler.py for the concurrency/priority ones):
+  ARTIFY_JOB_TTL_S        how long finished jobs stay queryable (default 3600)
+"""
+from __future__ import annotations
+import os, time, uuid, threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+from backend import scheduler
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+JOB_TTL_S = max(1, _env_int("ARTIFY_JOB_TTL_S", 3600))
+
+_SCHEDULER = scheduler.from_env()
+
+
+def submit(priority: str, fn: Callable[..., Any], *args, **kwargs) -> Future:
+    # I'm the single door into the stylize threads; `priority` is the request mode ("preview"/"full").
+    return _SCHEDULER.submit(priority, fn, *args, **kwargs)
+
+
+def queue_status() -> Dict[str, Any]:
+    return _SCHEDULER.status()
+
+
+def abandon(future: Future) -> None:
+    # I drop one waiter's interest in a run. The last one out trips the run's token,
+    # which stops it if running, and cancelling the future frees its place if still queued.
+    token = getattr(future, "token", None)
+    if token is None or token.release():
+        future.cancel()
+
+
+class Job:
+    """One async stylize request: its state, timestamps and (eventually) result or error."""
+
+    def __init__(self, meta: Dict[str, Any], future: Future):
+        self.id = uuid.uuid4().hex
+        self.meta = meta                      # small, JSON-safe facts (style/mode/traceId)
+        self.future = future                  # the scheduled run (possibly shared with other requests)
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[Dict[str, Any]] = None
+
+    @property
+    def status(self) -> str:
+        # queued → running → done | error | cancelled
+        if self.finished is not None:
+            if self.error is not None:
+                return "cancelled" if self.error.get("code") == "CANCELLED" else "error"
+            return "done"
+        return "running" if self.future.running() or self.future.done() else "queued"
+
+    @property
+    def started(self) -> Optional[float]:
+        return getattr(self.future, "started_at", None)
+
+    def cancel(self) -> bool:
+        # The job is cancelled for its client right away; the run itself stops at its next
+        # checkpoint, unless another request shares it. False if the job had already finished.
+        with _LOCK:
+            if self.finished is not None:
+                return False
+            self.error = {"code": "CANCELLED", "message": "Cancelled by the client."}
+            self.finished = time.time()
+        abandon(self.future)
+        return True
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "jobId": self.id,
+            "status": self.status,
+            **self.meta,
+            "createdAt": self.created,
+            "startedAt": self.started,
+            "finishedAt": self.finished,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+_JOBS: Dict[str, Job] = {}
+_LOCK = threading.Lock()
+
+
+def _prune(now: float) -> None:
+    # I forget finished jobs once they're past their TTL.
+    stale = [jid for jid, j in _JOBS.items() if j.finished and now - j.finished > JOB_TTL_S]
+    for jid in stale:
+        _JOBS.pop(jid, None)
+
+
+def create_job(future: Future, meta: Dict[str, Any],
+               on_done: Callable[[Any], Dict[str, Any]],
+               on_error: Callable[[Exception], Dict[str, Any]]) -> Job:
+    """
+    I register a job for an already-submitted `future`.
+    `on_done` turns its result into the response dict; `on_error` turns an exception
+    into the `error` payload the client will see.
+    """
+    job = Job(meta, future)
+    with _LOCK:
+        _prune(time.time())
+        _JOBS[job.id] = job
+
+    def _finish(f: Future) -> None:
+        if job.finished is not None:
+            return      # cancelled by its client; whatever the run produced is not wanted
+        try:
+            result, error = on_done(f.result()), None
+        except Exception as e:
+            result, error = None, on_error(e)
+        with _LOCK:
+            if job.finished is None:
+                job.result, job.error, job.finished = result, error, time.time()
+
+    future.add_done_callback(_finish)
+    return job
+
+
+def get_job(job_id: str) -> Optional[Job]:
+    with _LOCK:
+        return _JOBS.get(job_id)
@@ -7,35 +7,45 @@ from pydantic import BaseModel, Field, field_validator
 
 # I lock these to known strings so the UI and backend agree.
 Mode = Literal["preview", "full"]
-Style = Literal["cyberpunk", "cinematic", "noir", "anime"]
+Style = Literal["cyberpunk", "cinematic", "noir", "anime", "stub"]   # "stub" needs ARTIFY_STUB_STYLE=1
 Subject = Literal["portrait", "scene"]
 Control = Literal["auto", "hed", "depth", "canny", "none"]
 
 # I cap incoming images to avoid crashes and huge memory spikes.
 MAX_IMAGE_MB = 10
 
-class StylizeRequest(BaseModel):
-    # I keep all knobs the frontend can send for one stylize call.
+def _b64_payload_bytes(v: str) -> int:
+    # I estimate decoded size from base64 length (roughly 3/4 of chars become bytes)
+    # without slicing the string, so a 13 MB payload isn't copied just to measure it.
+    i = v.find("base64,")
+    chars = len(v) - (i + 7 if i >= 0 else 0)
+    return chars * 3 // 4
+
+class StylizeOptions(BaseModel):
+    # I keep all the knobs for one stylize call; the images travel separately
+    # (base64 in StylizeRequest, file parts on /api/stylize/upload).
     mode: Mode
     style: Style
     subject: Subject
-    imageBase64: str
     control: Control = "auto"
     strength: float = 0.3
     guidance: float = 6.5
     steps: int = 30
     maxSide: int = 1024
     seed: Optional[int] = None
-    styleImagesBase64: Optional[List[str]] = None
     extras: Optional[Dict[str, Any]] = None
+    # I give up on the run (504, DEADLINE_EXCEEDED) once it's been this long since the request.
+    deadlineMs: Optional[int] = Field(default=None, gt=0)
+
+class StylizeRequest(StylizeOptions):
+    # I'm the JSON variant: the photo and optional style refs come in as data URIs.
+    imageBase64: str
+    styleImagesBase64: Optional[List[str]] = None
 
     @field_validator("imageBase64")
     @classmethod
     def _size_guard(cls, v: str) -> str:
-        # I estimate size from base64 length (roughly 3/4 of chars become bytes).
-        payload = v.split("base64,", 1)[1] if "base64," in v else v
-        approx_bytes = len(payload) * 3 // 4
-        if approx_bytes > MAX_IMAGE_MB * 1024 * 1024:
+        if _b64_payload_bytes(v) > MAX_IMAGE_MB * 1024 * 1024:
             raise ValueError(f"imageBase64 exceeds {MAX_IMAGE_MB} MB limit")
         return v
 
@@ -46,9 +56,7 @@ class StylizeRequest(BaseModel):
         if not v:
             return v
         for s in v:
-            payload = s.split("base64,", 1)[1] if "base64," in s else s
-            approx_bytes = len(payload) * 3 // 4
-            if approx_bytes > MAX_IMAGE_MB * 1024 * 1024:
+            if _b64_payload_bytes(s) > MAX_IMAGE_MB * 1024 * 1024:
                 raise ValueError(f"One style image exceeds {MAX_IMAGE_MB} MB limit")
         return v
 
@@ -61,18 +69,50 @@ class Metrics(BaseModel):
     # I attach simple run metrics for debugging and grading.
     durationMs: int
     model: str = "sd15"
-    controlNet: Optional[Literal["hed", "depth", "canny"]] = None
+    controlNet: Optional[Literal["hed", "depth", "canny", "lineart"]] = None
+    controlNetModel: Optional[str] = None          # the ControlNet repo the run actually used
     ipAdapter: bool = False
     steps: int
     guidance: float
     strength: float
     seed: Optional[int] = None
     size: Size
+    cache: Optional[Literal["hit", "miss", "coalesced"]] = None   # None when the request wasn't cacheable
+    # I break the time down per stage (see backend/telemetry.py), in ms. A coalesced request
+    # reports the run it joined; a cache hit only its own decode.
+    stagesMs: Dict[str, int] = Field(default_factory=dict)
+    pipelineCache: Optional[Literal["hit", "miss"]] = None     # "miss" if any pipeline had to be built
+    controlMapCache: Optional[Literal["hit", "miss"]] = None   # "miss" if any control map was computed
 
 class StylizeResponse(BaseModel):
     # I send back the result image and the metrics in a single object.
     mode: Mode
-    resultBase64: str
+    resultBase64: Optional[str] = None   # data URI; None when the caller asked for ?result=ref
+    resultId: Optional[str] = None       # set with ?result=ref; fetch via resultUrl
+    resultUrl: Optional[str] = None
     metrics: Metrics
     warnings: List[str] = Field(default_factory=list)
     traceId: str
+
+# I track async jobs with these states: queued → running → done | error | cancelled.
+JobState = Literal["queued", "running", "done", "error", "cancelled"]
+
+class JobAccepted(BaseModel):
+    # I answer POST /api/jobs right away with an id to poll.
+    jobId: str
+    status: JobState
+    traceId: str
+    etaMs: Optional[int] = None   # rough time until the result is ready, from recent run durations
+
+class JobStatusResponse(BaseModel):
+    # I describe one async job; `result` is the usual stylize response once it's done.
+    jobId: str
+    status: JobState
+    mode: Mode
+    style: Style
+    traceId: str
+    createdAt: float
+    startedAt: Optional[float] = None
+    finishedAt: Optional[float] = None
+    result: Optional[StylizeResponse] = None
+    error: Optional[Dict[str, Any]] = None
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+I carry live progress from a stylize run back to whoever is streaming it.
+
+The stylize thread runs `with progress.reporting(sink): ...`; the runner picks the sink up with
+`current()` and hands it to the script side (`scripts/step_hooks.py`): in-process for resident
+mode, over the worker pipe for worker mode. Subprocess mode has no channel back, so it reports
+nothing and the stream only gets the final result.
+
+A sink is called from the stylize thread with {"step", "steps", "preview"}, where preview is
+a small PIL image (a linear latent→RGB projection, 1/8 of the output size) or None.
+
+Settings (env vars):
+  ARTIFY_PREVIEW_EVERY  send a preview every N denoising steps (default 5, 0 = progress only)
+"""
+from __future__ import annotations
+import os, threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+Sink = Callable[[dict], None]
+
+_LOCAL = threading.local()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def preview_every() -> int:
+    return max(0, _env_int("ARTIFY_PREVIEW_EVERY", 5))
+
+
+@contextmanager
+def reporting(sink: Optional[Sink]) -> Iterator[None]:
+    # I make `sink` the progress target for stylize work done on this thread.
+    prev = getattr(_LOCAL, "sink", None)
+    _LOCAL.sink = sink
+    try:
+        yield
+    finally:
+        _LOCAL.sink = prev
+
+
+def current() -> Optional[Sink]:
+    return getattr(_LOCAL, "sink", None)
+
+
+def guarded(sink: Sink) -> Sink:
+    # A broken listener must never fail the render it is watching.
+    def report(event: dict) -> None:
+        try:
+            sink(event)
+        except Exception as e:
+            print(f"[progress] sink failed: {e}")
+    return report
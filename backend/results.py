@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+I keep recent result images so clients can fetch them by id instead of inlining them.
+
+`/api/stylize?result=ref` answers with a short `resultId` / `resultUrl`; the JPEG itself is
+served by `GET /api/results/{id}`. Ids are content hashes, so the bytes behind an id never
+change: they double as the ETag and the response can be cached as immutable.
+
+Storage is an in-memory LRU (the result cache's memory tier, without disk).
+
+Settings (env vars):
+  ARTIFY_RESULTS_MB  memory for stored results (default 256)
+"""
+from __future__ import annotations
+import os, hashlib
+from typing import Optional
+
+from backend.cache import ResultCache
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+STORE = ResultCache(mem_bytes=_env_int("ARTIFY_RESULTS_MB", 256) * 1024 * 1024, disk_dir=None, disk_bytes=0)
+
+
+def put(data: bytes) -> str:
+    rid = hashlib.sha256(data).hexdigest()[:32]
+    STORE.put(rid, data)
+    return rid
+
+
+def get(rid: str) -> Optional[bytes]:
+    return STORE.get(rid)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+I decide which queued stylize run goes next.
+
+Runs are tagged with a priority class — the request `mode` — and I always start the
+waiting run with the best score, where
+
+    score = class priority (preview 0, full 1) − seconds waited / aging_s
+
+Lower wins, ties go first-come-first-served. So an interactive preview jumps ahead of
+full renders that were queued a moment earlier, but a full render that has waited
+`aging_s` seconds counts as much as a brand-new preview and can't starve.
+
+Each class also has its own slot limit, so full renders can never occupy every thread:
+with the defaults one thread is always left for previews.
+
+Settings (env vars):
+  ARTIFY_JOB_CONCURRENCY  total runs executing at once (default 2)
+  ARTIFY_SLOTS_PREVIEW    max preview runs at once (default: all threads)
+  ARTIFY_SLOTS_FULL       max full runs at once (default: all threads but one)
+  ARTIFY_AGING_S          seconds of waiting worth one priority class (default 15)
+"""
+from __future__ import annotations
+import os, time, itertools, threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+PRIORITY = {"preview": 0, "full": 1}
+
+
+class _Entry:
+    __slots__ = ("cls", "seq", "enqueued", "fn", "args", "kwargs", "future")
+
+    def __init__(self, cls, seq, fn, args, kwargs):
+        self.cls = cls
+        self.seq = seq
+        self.enqueued = time.time()
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+        self.future: Future = Future()
+
+
+class PriorityScheduler:
+    def __init__(self, threads: int, slots: Dict[str, int], aging_s: float):
+        self.threads = max(1, threads)
+        self.slots = {c: max(1, min(self.threads, n)) for c, n in slots.items()}
+        self.aging_s = max(0.001, aging_s)
+        self._pending: List[_Entry] = []
+        self._running = {c: 0 for c in PRIORITY}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        for i in range(self.threads):
+            threading.Thread(target=self._loop, name=f"stylize-{i}", daemon=True).start()
+
+    def submit(self, cls: str, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        cls = cls if cls in PRIORITY else "full"
+        entry = _Entry(cls, next(self._seq), fn, args, kwargs)
+        with self._cond:
+            self._pending.append(entry)
+            self._cond.notify()
+        return entry.future
+
+    def _score(self, e: _Entry, now: float):
+        return (PRIORITY[e.cls] - (now - e.enqueued) / self.aging_s, e.seq)
+
+    def _pick(self) -> Optional[_Entry]:
+        # I pick the best-scoring run whose class still has a free slot (caller holds the lock).
+        now = time.time()
+        ready = [e for e in self._pending if self._running[e.cls] < self.slots[e.cls]]
+        if not ready:
+            return None
+        best = min(ready, key=lambda e: self._score(e, now))
+        self._pending.remove(best)
+        return best
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                entry = self._pick()
+                while entry is None:
+                    self._cond.wait()
+                    entry = self._pick()
+                if not entry.future.set_running_or_notify_cancel():
+                    continue    # cancelled while queued
+                entry.future.started_at = time.time()   # job status reports this
+                self._running[entry.cls] += 1
+            try:
+                entry.future.set_result(entry.fn(*entry.args, **entry.kwargs))
+            except BaseException as e:
+                entry.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._running[entry.cls] -= 1
+                    self._cond.notify_all()
+
+    def status(self) -> dict:
+        with self._cond:
+            queued = {c: sum(1 for e in self._pending if e.cls == c) for c in PRIORITY}
+            return {"threads": self.threads, "slots": dict(self.slots),
+                    "running": dict(self._running), "queued": queued}
+
+
+def from_env() -> PriorityScheduler:
+    threads = max(1, _env_int("ARTIFY_JOB_CONCURRENCY", 2))
+    return PriorityScheduler(
+        threads=threads,
+        slots={
+            "preview": _env_int("ARTIFY_SLOTS_PREVIEW", threads),
+            "full": _env_int("ARTIFY_SLOTS_FULL", max(1, threads - 1)),
+        },
+        aging_s=float(_env_int("ARTIFY_AGING_S", 15)),
+    )
@@ -7,11 +7,13 @@ server.py imports:
 
 REGISTRY maps:
   "anime" | "cyberpunk" | "cinematic" | "noir"  -> module with (preload, stylize)
+  "stub"  -> CPU-only load-testing stand-in, only with ARTIFY_STUB_STYLE=1 (see stub.py)
 """
 from __future__ import annotations
+import os
 
 # Import the per-style wrapper modules (these must define preload() and stylize())
-from . import anime, cyberpunk, cinematic, noir
+from . import anime, cyberpunk, cinematic, noir, stub
 
 REGISTRY = {
     "anime": anime,
@@ -20,6 +22,9 @@ REGISTRY = {
     "noir": noir,
 }
 
+if os.environ.get("ARTIFY_STUB_STYLE") == "1":
+    REGISTRY["stub"] = stub
+
 def preload_all():
     """
     Preload all styles at server startup.
@@ -1,10 +1,10 @@
 """
 I use this module as a thin launcher around the external `scripts/anime_stylize_v2.py`.
 My job here is to:
-  1) Save the incoming PIL image to a temp/runtime folder,
-  2) Decide which ControlNet detector the anime script should use (based on `subject` and `control`),
-  3) Build a safe subprocess command (Python exe + script + flags),
-  4) Run it and return the resulting PIL image.
+  1) Decide which ControlNet detector the anime script should use (based on `subject` and `control`),
+  2) Translate the request knobs into the script's CLI flags,
+  3) Hand image + flags to `backend.utils.runner`, which runs the script (subprocess or resident),
+  4) Return the resulting PIL image.
 
 Inputs/Outputs (in my own words):
 - Input: a PIL.Image plus knobs like steps/guidance/strength/max_side, and a few extras.
@@ -13,20 +13,20 @@ Inputs/Outputs (in my own words):
 
 Why I keep this wrapper tiny:
 - I want the heavy ML code to live in the script; this file stays small, testable, and easy to replace.
-- All file IO happens in `runtime/` with unique names so parallel requests won't collide.
+- Subprocess runs do their file IO in `runtime/` through the spool (unique names, deleted after the run).
 """
 
 from __future__ import annotations
-import os, sys, uuid, subprocess
+import os
 from typing import Optional, List, Dict, Any
 from PIL import Image
 
+from backend.utils.runner import run_script, preload_script
+
 # I compute a few important paths once so every call can reuse them.
 HERE = os.path.dirname(__file__)
 ROOT = os.path.dirname(os.path.dirname(HERE))
 SCRIPTS_DIR = os.path.join(ROOT, "scripts")
-RUNTIME_DIR = os.path.join(ROOT, "runtime")
-os.makedirs(RUNTIME_DIR, exist_ok=True)  # I ensure the runtime folder exists for temp PNGs.
 
 # I keep the external script and a short prefix here so they’re easy to tweak in one place.
 SCRIPT = os.path.join(SCRIPTS_DIR, "anime_stylize_v2.py")
@@ -36,14 +36,6 @@ prefix = "anime"
 ANIME_ACCEPTS = {"auto", "lineart_anime", "softedge", "canny", "none"}
 
 
-def _save_png(img: Image.Image, path: str) -> None:
-    """
-    I always write inputs as PNG to avoid JPEG artifacts and keep things deterministic.
-    I also use a modest compression level so writing is fast but files aren’t huge.
-    """
-    img.save(path, format="PNG", compress_level=4)
-
-
 def _resolve_control_for_anime(control: str, subject: str) -> str:
     """
     I map the user-friendly `control` + `subject` to the detector name the anime script expects.
@@ -81,27 +73,18 @@ def stylize(
 ) -> Image.Image:
     """
     I’m the main entry point:
-    - I create unique file names so multiple requests don’t clash.
     - I translate friendly parameters into the CLI flags for `anime_stylize_v2.py`.
-    - I run the subprocess and turn its output back into a PIL.Image.
+    - I let the runner execute the script and turn its output back into a PIL.Image.
 
     Errors:
-    - If the subprocess fails, I raise RuntimeError with the end of stdout/stderr to help me debug.
-    - If the script doesn’t write the expected output file, I raise a clear error.
+    - If the script fails, I raise RuntimeError with the end of its logs to help me debug.
+    - If the script doesn’t produce an output image, I raise a clear error.
     """
-    # I generate short unique ids so temp file names are predictable but non-colliding.
-    tid = uuid.uuid4().hex[:8]
-    in_path  = os.path.join(RUNTIME_DIR, f"{prefix}_in_{tid}.png")
-    out_path = os.path.join(RUNTIME_DIR, f"{prefix}_out_{tid}.png")
-    _save_png(image, in_path)
-
     # I decide the actual detector the script should use.
     ctrl = _resolve_control_for_anime(control, subject)
 
-    # I build the command as a list (not a single string) to avoid shell quoting issues.
-    args = [
-        sys.executable, SCRIPT,
-        "--input", in_path, "--output", out_path,
+    # I build the flags as a list (not a single string) to avoid shell quoting issues.
+    flags = [
         "--control", ctrl,
         "--steps", str(steps),
         "--guidance", str(guidance),
@@ -109,48 +92,26 @@ def stylize(
         "--max-side", str(max_side),
     ]
     if seed is not None:
-        args += ["--seed", str(seed)]
+        flags += ["--seed", str(seed)]
 
     # I pass a few optional extras through to the script if present.
     e = extras or {}
     if e.get("controlScale") is not None:
-        args += ["--control-scale", str(float(e["controlScale"]))]
+        flags += ["--control-scale", str(float(e["controlScale"]))]
     if e.get("model") in ("primary", "trinart", "sd15"):
-        args += ["--model", e["model"]]
+        flags += ["--model", e["model"]]
     if e.get("fastDetector"):
-        args += ["--fast-detector"]
-
-    # I print the final args in a debug-friendly way so I can copy-paste the exact command locally.
-    import shlex
-    print("DEBUG ARGS[anime]:", " ".join(shlex.quote(a) for a in args))
-
-    # I enforce UTF-8 so the child process won’t choke on paths or logs with non-ASCII chars.
-    env = os.environ.copy()
-    env.setdefault("PYTHONIOENCODING", "utf-8")
-    env.setdefault("PYTHONUTF8", "1")
-
-    try:
-        # I capture both stdout and stderr; `check=True` lets me surface non-zero exits as exceptions.
-        subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, text=True, env=env)
-    except subprocess.CalledProcessError as ecp:
-        # I keep only the tail of the combined logs to avoid giant error blobs, but enough to diagnose.
-        tail = ((ecp.stderr or "") + "\n" + (ecp.stdout or ""))[-4000:]
-        raise RuntimeError(f"anime script failed.\n{tail}") from ecp
-
-    # I expect the external script to write the out file; if not, I report it explicitly.
-    if not os.path.isfile(out_path):
-        raise RuntimeError("anime script did not produce an output image.")
+        flags += ["--fast-detector"]
 
-    # I normalize to RGB so downstream code doesn’t have to handle palette/alpha edge cases.
-    return Image.open(out_path).convert("RGB")
+    return run_script(SCRIPT, prefix, image, flags)
 
 
 def preload() -> dict:
     """
     I expose a lightweight preload hook to fit the app’s ‘preload’ contract.
-    For anime, there’s nothing heavy to warm up here, so I just return a success flag.
+    In resident mode I import the script up front; otherwise there’s nothing to warm up.
     """
-    return {"ok": True, "message": "anime preload noop"}
+    return preload_script(SCRIPT, prefix)
 
 
 # I export `run` as an alias so other parts of the app can call this module uniformly.
@@ -1,22 +1,18 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-import os, sys, re, uuid, subprocess
+import os, re
 from typing import Optional, List, Dict, Any
 from PIL import Image
 
+from backend.utils.runner import run_script, preload_script
+
 # I keep paths ready so I don't recompute them for every call.
 HERE = os.path.dirname(__file__)
 ROOT = os.path.dirname(os.path.dirname(HERE))
 SCRIPTS_DIR = os.path.join(ROOT, "scripts")
-RUNTIME_DIR = os.path.join(ROOT, "runtime")
-os.makedirs(RUNTIME_DIR, exist_ok=True)
 
 prefix = "cinematic"
 
-def _save_png(img: Image.Image, path: str) -> None:
-    # I write inputs as PNG for predictable quality and fast saving.
-    img.save(path, format="PNG", compress_level=4)
-
 def _find_script(basename: str) -> str:
     # I pick the newest versioned script (…_vN.py). If none, I fall back to basename.py.
     candidates: List[tuple[int, str]] = []
@@ -47,16 +43,8 @@ def stylize(
     style_refs: Optional[List[Image.Image]] = None,  # kept for API shape; unused here.
     extras: Optional[Dict[str, Any]] = None,
 ) -> Image.Image:
-    # I give each run unique file names so parallel calls don't clash.
-    tid = uuid.uuid4().hex[:8]
-    in_path  = os.path.join(RUNTIME_DIR, f"{prefix}_in_{tid}.png")
-    out_path = os.path.join(RUNTIME_DIR, f"{prefix}_out_{tid}.png")
-    _save_png(image, in_path)
-
-    # I build the CLI for the external cinematic script (v5 has no --control).
-    args = [
-        sys.executable, SCRIPT,
-        "-i", in_path, "-o", out_path,
+    # I build the CLI flags for the external cinematic script (v5 has no --control).
+    flags = [
         "--subject", subject,
         "--steps", str(steps),
         "--guidance", str(guidance),
@@ -64,44 +52,26 @@ def stylize(
         "--max-side", str(max_side),
     ]
     if seed is not None:
-        args += ["--seed", str(seed)]
+        flags += ["--seed", str(seed)]
 
     # I forward optional tweaks only when present.
     e = extras or {}
-    if e.get("controlScale") is not None: args += ["--control-scale", str(e["controlScale"])]
-    if e.get("toneMix")      is not None: args += ["--tone-mix",      str(e["toneMix"])]
-    if e.get("bloom")        is not None: args += ["--bloom",         str(e["bloom"])]
-    if e.get("contrast")     is not None: args += ["--contrast",      str(e["contrast"])]
-    if e.get("saturation")   is not None: args += ["--saturation",    str(e["saturation"])]
+    if e.get("controlScale") is not None: flags += ["--control-scale", str(e["controlScale"])]
+    if e.get("toneMix")      is not None: flags += ["--tone-mix",      str(e["toneMix"])]
+    if e.get("bloom")        is not None: flags += ["--bloom",         str(e["bloom"])]
+    if e.get("contrast")     is not None: flags += ["--contrast",      str(e["contrast"])]
+    if e.get("saturation")   is not None: flags += ["--saturation",    str(e["saturation"])]
 
     # I only pass a scheduler if it’s one of the supported options.
     sched = e.get("scheduler")
     if sched in ("unipc", "dpmpp"):
-        args += ["--scheduler", sched]
-
-    import shlex
-    print("DEBUG ARGS[cinematic]:", " ".join(shlex.quote(a) for a in args))
-
-    # I force UTF-8 so logs and paths behave.
-    env = os.environ.copy()
-    env.setdefault("PYTHONIOENCODING", "utf-8")
-    env.setdefault("PYTHONUTF8", "1")
-
-    try:
-        subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, text=True, env=env)
-    except subprocess.CalledProcessError as ecp:
-        # I surface just the tail of logs to keep errors readable.
-        tail = ((ecp.stderr or "") + "\n" + (ecp.stdout or ""))[-4000:]
-        raise RuntimeError(f"cinematic script failed.\n{tail}") from ecp
+        flags += ["--scheduler", sched]
 
-    # I expect the script to produce the image here; if not, I fail fast.
-    if not os.path.isfile(out_path):
-        raise RuntimeError("cinematic script did not produce an output image.")
-    return Image.open(out_path).convert("RGB")
+    return run_script(SCRIPT, prefix, image, flags)
 
 def preload() -> dict:
-    # I keep a preload hook for symmetry with other modules.
-    return {"ok": True, "message": "preload noop"}
+    # I import the script up front in resident mode; otherwise this stays a noop.
+    return preload_script(SCRIPT, prefix)
 
 # I expose the common entry name used by the caller.
 run = stylize
@@ -1,17 +1,17 @@
 # -*- coding: utf-8 -*-
-# I use this thin wrapper to save the input, call the Noir script, and load the result.
+# I use this thin wrapper to pick Noir flags and hand the input to the runner, which calls the Noir script.
 
 from __future__ import annotations
-import os, sys, uuid, subprocess
+import os
 from typing import Optional, List, Dict, Any
 from PIL import Image
 
+from backend.utils.runner import run_script, preload_script
+
 # I set up common paths once.
 HERE = os.path.dirname(__file__)
 ROOT = os.path.dirname(os.path.dirname(HERE))
 SCRIPTS_DIR = os.path.join(ROOT, "scripts")
-RUNTIME_DIR = os.path.join(ROOT, "runtime")
-os.makedirs(RUNTIME_DIR, exist_ok=True)
 
 SCRIPT = os.path.join(SCRIPTS_DIR, "noir_stylize.py")
 prefix = "noir"
@@ -19,10 +19,6 @@ prefix = "noir"
 # I only accept these control modes.
 NOIR_ACCEPTS = {"auto", "hed", "depth", "canny", "none"}
 
-def _save_png(img: Image.Image, path: str) -> None:
-    # I save as PNG with light compression for speed + lossless quality.
-    img.save(path, format="PNG", compress_level=4)
-
 def _resolve_control_for_noir(control: str, subject: str) -> str:
     # I normalize UI control names to Noir CLI; for "auto" I pick per subject.
     c = (control or "auto").lower()
@@ -46,18 +42,10 @@ def stylize(
     style_refs: Optional[List[Image.Image]] = None,   # unused here (kept for API shape)
     extras: Optional[Dict[str, Any]] = None,
 ) -> str:  # TODO: I actually return a PIL.Image; keeping the annotation as-is to avoid refactors.
-    # I use unique names so parallel runs don't clash.
-    tid = uuid.uuid4().hex[:8]
-    in_path  = os.path.join(RUNTIME_DIR, f"{prefix}_in_{tid}.png")
-    out_path = os.path.join(RUNTIME_DIR, f"{prefix}_out_{tid}.png")
-    _save_png(image, in_path)
-
     ctrl = _resolve_control_for_noir(control, subject)
 
-    # I build the CLI call (Noir supports --control).
-    args = [
-        sys.executable, SCRIPT,
-        "-i", in_path, "-o", out_path,
+    # I build the CLI flags (Noir supports --control).
+    flags = [
         "--subject", subject,
         "--control", ctrl,
         "--steps", str(steps),
@@ -66,43 +54,25 @@ def stylize(
         "--max-side", str(max_side),
     ]
     if seed is not None:
-        args += ["--seed", str(seed)]
+        flags += ["--seed", str(seed)]
 
     # I pass optional tweaks only when present.
     e = extras or {}
-    if e.get("controlScale") is not None: args += ["--control-scale", str(e["controlScale"])]
-    if e.get("filmGrain")    is not None: args += ["--film-grain",    str(e["filmGrain"])]
-    if e.get("vignette")     is not None: args += ["--vignette",      str(e["vignette"])]
-    if e.get("glow")         is not None: args += ["--glow",          str(e["glow"])]
+    if e.get("controlScale") is not None: flags += ["--control-scale", str(e["controlScale"])]
+    if e.get("filmGrain")    is not None: flags += ["--film-grain",    str(e["filmGrain"])]
+    if e.get("vignette")     is not None: flags += ["--vignette",      str(e["vignette"])]
+    if e.get("glow")         is not None: flags += ["--glow",          str(e["glow"])]
 
     # I only forward a scheduler I know about.
     sched = e.get("scheduler")
     if sched in ("unipc", "dpmpp"):
-        args += ["--scheduler", sched]
-
-    # I print the exact command for easy debugging.
-    import shlex
-    print("DEBUG ARGS[noir]:", " ".join(shlex.quote(a) for a in args))
-
-    # I force UTF-8 so logs/paths behave.
-    env = os.environ.copy()
-    env.setdefault("PYTHONIOENCODING", "utf-8")
-    env.setdefault("PYTHONUTF8", "1")
-
-    try:
-        subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, text=True, env=env)
-    except subprocess.CalledProcessError as ecp:
-        tail = ((ecp.stderr or "") + "\n" + (ecp.stdout or ""))[-4000:]
-        raise RuntimeError(f"noir script failed.\n{tail}") from ecp
+        flags += ["--scheduler", sched]
 
-    # I expect an output image here; if missing, I fail fast.
-    if not os.path.isfile(out_path):
-        raise RuntimeError("noir script did not produce an output image.")
-    return Image.open(out_path).convert("RGB")
+    return run_script(SCRIPT, prefix, image, flags)
 
 def preload() -> dict:
-    # I keep a tiny preload hook for symmetry.
-    return {"ok": True, "message": "preload noop"}
+    # I import the script up front in resident mode; otherwise this stays a noop.
+    return preload_script(SCRIPT, prefix)
 
 # I expose a consistent entry point.
 run = stylize
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# I'm the wrapper for the stub style (scripts/stub_stylize.py): a CPU-only stand-in that takes
+# the full server path (scheduler, runner, workers, caches) with simulated inference, so the
+# server can be load-tested without GPUs or model weights (see dev/loadgen.py).
+#
+# Only registered when ARTIFY_STUB_STYLE=1. Costs come from env vars, and a request can override
+# them in `extras` (loadMs, stepMs, memMb) to mix fast and slow runs:
+#   ARTIFY_STUB_LOAD_MS   first-use pipeline build per process (default 2000)
+#   ARTIFY_STUB_STEP_MS   one denoising step at 512×512, scales with pixels (default 40)
+#   ARTIFY_STUB_MEM_MB    memory held while denoising (default 256)
+
+from __future__ import annotations
+import os
+from typing import Optional, List, Dict, Any
+from PIL import Image
+
+from backend.utils.runner import run_script, preload_script
+
+HERE = os.path.dirname(__file__)
+ROOT = os.path.dirname(os.path.dirname(HERE))
+SCRIPTS_DIR = os.path.join(ROOT, "scripts")
+
+SCRIPT = os.path.join(SCRIPTS_DIR, "stub_stylize.py")
+prefix = "stub"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def stylize(
+    image: Image.Image,
+    subject: str,
+    steps: int,
+    guidance: float,
+    strength: float,
+    max_side: int,
+    control: str,
+    seed: Optional[int] = None,
+    style_refs: Optional[List[Image.Image]] = None,   # unused (kept for API shape)
+    extras: Optional[Dict[str, Any]] = None,
+) -> Image.Image:
+    e = extras or {}
+    flags = [
+        "--subject", subject,
+        "--steps", str(steps),
+        "--guidance", str(guidance),
+        "--strength", str(strength),
+        "--max-side", str(max_side),
+        "--load-ms", str(e.get("loadMs", _env_int("ARTIFY_STUB_LOAD_MS", 2000))),
+        "--step-ms", str(e.get("stepMs", _env_int("ARTIFY_STUB_STEP_MS", 40))),
+        "--mem-mb", str(e.get("memMb", _env_int("ARTIFY_STUB_MEM_MB", 256))),
+    ]
+    if seed is not None:
+        flags += ["--seed", str(seed)]
+    return run_script(SCRIPT, prefix, image, flags)
+
+
+def preload() -> dict:
+    return preload_script(SCRIPT, prefix)
+
+
+run = stylize
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+I keep the numbers behind `GET /metrics` (Prometheus text format, version 0.0.4).
+
+A tiny registry of counters, gauges and histograms is enough here, so there's no
+prometheus_client dependency. Label values come from validated request fields
+(style/mode/subject are Literals), so the number of series stays small.
+
+Per-stage latency: every stylize run gets a `Trace` labelled with its style/mode/subject.
+Code that does a piece of the work times it with `trace.stage(name)` (or hands over script
+timings with `trace.add`), and each timing lands in `artify_stage_seconds`. Stages:
+
+  decode       base64/bytes → PIL (server)
+  resize       fitting images to max side (server for style refs, scripts for the input)
+  spool_write  writing input PNGs to runtime/ (subprocess mode)
+  spawn        interpreter start + imports until the script runs (subprocess mode),
+               or starting a fresh worker process (worker mode)
+  model_load   building a diffusers pipeline the first time (scripts/pipeline_cache.py)
+  annotator    computing a ControlNet map, loading its detector if needed
+  denoise      running the diffusion pipeline, VAE decode included
+  grade        the scripts' colour grading / film effects
+  encode       PIL → JPEG/WebP for the response
+
+Some scripts split their work further: cyberpunk times its stage-1 background `inpaint` and the
+`refine` pass apart from the main `denoise`, and CLI runs time `save`.
+
+Script stages come from `scripts/stages.py`; the runner forwards them for every exec mode,
+together with the script's notes (`trace.notes`: the ControlNet it really used, pipeline and
+control-map cache hits, ...). Both end up in the response's `metrics` as well.
+Times are exclusive: a stage nested in another isn't counted twice.
+"""
+from __future__ import annotations
+import time, threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str]):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _head(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0.0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._head() + [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels: str, value: float) -> None:
+        with self._lock:
+            self._values[labels] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], list] = {}   # labels -> [bucket counts..., sum, count]
+
+    def observe(self, *labels: str, value: float) -> None:
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def count(self, *labels: str) -> int:
+        with self._lock:
+            s = self._series.get(labels)
+            return s[-1] if s else 0
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        out = self._head()
+        for k, s in items:
+            for b, n in zip(self.buckets, s):
+                le = 'le="%s"' % _num(b)
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, k, le)} {n}")
+            inf = 'le="+Inf"'
+            out.append(f"{self.name}_bucket{_labels(self.labelnames, k, inf)} {s[-1]}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, k)} {_num(s[-2])}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, k)} {s[-1]}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, m):
+        self._metrics.append(m)
+        return m
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()) -> Gauge:
+        return self._add(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for m in self._metrics:
+            lines += m.render()
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+REGISTRY = Registry()
+_REQ = ("style", "mode", "subject")
+
+REQUESTS = REGISTRY.counter(
+    "artify_requests_total", "Stylize requests by outcome (ok, rejected, error, cancelled, deadline).", _REQ + ("outcome",))
+REQUEST_SECONDS = REGISTRY.histogram(
+    "artify_request_seconds", "Stylize request latency, arrival to response, by result cache outcome.", _REQ + ("cache",))
+STAGE_SECONDS = REGISTRY.histogram(
+    "artify_stage_seconds", "Time spent per stage of a stylize run.", ("stage",) + _REQ)
+SCHEDULER_RUNS = REGISTRY.gauge(
+    "artify_scheduler_runs", "Stylize runs in the scheduler by priority class and state.", ("class", "state"))
+
+
+class Trace:
+    """The stage timings (and script notes) of one stylize run."""
+
+    def __init__(self, style: str, mode: str, subject: str):
+        self.labels = (style, mode, subject)
+        self.stages: Dict[str, float] = {}
+        self.notes: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._open = threading.local()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        STAGE_SECONDS.observe(name, *self.labels, value=seconds)
+
+    def note(self, key: str, value: Any) -> None:
+        with self._lock:
+            self.notes[key] = value
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        # Nested stages are subtracted from the enclosing one, so no time is counted twice.
+        stack = self._open.__dict__.setdefault("stack", [])
+        frame = [0.0]
+        stack.append(frame)
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            stack.pop()
+            if stack:
+                stack[-1][0] += elapsed
+            self.add(name, max(0.0, elapsed - frame[0]))
+
+
+_LOCAL = threading.local()
+
+
+@contextmanager
+def tracing(trace: Optional[Trace]) -> Iterator[None]:
+    # I make `trace` the one that stylize work on this thread reports into.
+    prev = getattr(_LOCAL, "trace", None)
+    _LOCAL.trace = trace
+    try:
+        yield
+    finally:
+        _LOCAL.trace = prev
+
+
+def current() -> Optional[Trace]:
+    return getattr(_LOCAL, "trace", None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    # I time `name` into the current trace, if there is one.
+    trace = current()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield
@@ -2,21 +2,38 @@ from __future__ import annotations
 import base64, io
 from PIL import Image, ImageOps
 
-def decode_data_uri_to_pil(data_uri: str) -> Image.Image:
-    b64 = data_uri.split("base64,", 1)[1] if data_uri.startswith("data:") else data_uri
-    data = base64.b64decode(b64)
+def decode_bytes_to_pil(data: bytes) -> Image.Image:
     img = Image.open(io.BytesIO(data))
     return ImageOps.exif_transpose(img).convert("RGB")
 
-def encode_pil_to_data_uri(img: Image.Image, fmt: str = "JPEG", quality: int = 92) -> str:
+def decode_data_uri_to_pil(data_uri: str) -> Image.Image:
+    b64 = data_uri.split("base64,", 1)[1] if data_uri.startswith("data:") else data_uri
+    return decode_bytes_to_pil(base64.b64decode(b64))
+
+def encode_pil_to_bytes(img: Image.Image, fmt: str = "JPEG", quality: int = 92) -> bytes:
     buf = io.BytesIO()
     w, h = img.size
     w = max(8, (w // 8) * 8); h = max(8, (h // 8) * 8)
     if (w, h) != img.size: img = img.resize((w, h), Image.LANCZOS)
     img.save(buf, format=fmt, quality=quality)
-    b64 = base64.b64encode(buf.getvalue()).decode("ascii")
-    mime = "image/jpeg" if fmt.upper() == "JPEG" else "image/png"
-    return f"data:{mime};base64,{b64}"
+    return buf.getvalue()
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+def bytes_to_data_uri(data: bytes, fmt: str = "JPEG") -> str:
+    b64 = base64.b64encode(data).decode("ascii")
+    return f"data:{MIME_TYPES.get(fmt.upper(), 'image/png')};base64,{b64}"
+
+def transcode(data: bytes, fmt: str, quality: int = 92) -> bytes:
+    # I re-encode an already encoded image (e.g. a cached JPEG for a client that asked for WebP).
+    return encode_pil_to_bytes(Image.open(io.BytesIO(data)).convert("RGB"), fmt=fmt, quality=quality)
+
+def encoded_size(data: bytes) -> tuple:
+    # PIL only parses the header here, so this is cheap even for big images.
+    return Image.open(io.BytesIO(data)).size
+
+def encode_pil_to_data_uri(img: Image.Image, fmt: str = "JPEG", quality: int = 92) -> str:
+    return bytes_to_data_uri(encode_pil_to_bytes(img, fmt, quality), fmt)
 
 def resize_max_side(img: Image.Image, max_side: int) -> Image.Image:
     w, h = img.size
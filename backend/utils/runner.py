@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+I run a stylizer script on behalf of a style wrapper in `backend/styles/`.
+
+Three execution modes (picked with the ARTIFY_EXEC_MODE env var):
+- "subprocess" (default): the original behaviour. I write the input PNG to `runtime/`,
+  spawn `python scripts/<style>.py -i in.png -o out.png <flags>`, and read the output back.
+  The files come from `backend.utils.spool` and are deleted when the run ends.
+  Every call pays interpreter start, torch/diffusers import and model loading.
+- "resident": I import the script once into this server process and call its
+  `stylize_image(image, args)` directly. The script keeps its pipelines in
+  `scripts/pipeline_cache.py`, so weights load on the first request and stay warm.
+  Compatible concurrent runs can be merged into one call (`backend.batching`).
+- "worker": I send the job to a pool of long-lived `scripts/<style>.py --serve` processes
+  (`backend.utils.workers`). Models stay warm like resident mode, but a crashing model only
+  takes down its worker, and inference runs outside the server's GIL. Images cross the
+  pipe as raw RGB, so there's no PNG encode/decode and nothing touches `runtime/`.
+
+Resident and worker runs also report denoising progress to the calling thread's
+`backend.progress` sink, when there is one (subprocess runs have no channel for it).
+Every mode honours the thread's `backend.cancellation` token: resident runs stop at the next
+denoising step, workers are sent "cancel" (and killed if they don't stop), subprocesses are
+terminated. A stopped run raises `Cancelled`.
+Stage timings measured inside the scripts (scripts/stages.py) are forwarded to the thread's
+`backend.telemetry` trace, whatever the mode.
+
+Wrappers only build the script flags; the same flag list drives every mode, so a
+resident or worker run does exactly what the CLI would do for the same request.
+"""
+from __future__ import annotations
+import os, sys, json, time, shlex, importlib, threading, subprocess
+from contextlib import nullcontext
+from typing import Optional, List
+from PIL import Image
+
+from backend import batching, progress, cancellation, telemetry
+from backend.cancellation import Cancelled
+from backend.utils import spool as spool_mod
+
+HERE = os.path.dirname(__file__)
+ROOT = os.path.dirname(os.path.dirname(HERE))
+SCRIPTS_DIR = os.path.join(ROOT, "scripts")
+RUNTIME_DIR = os.path.join(ROOT, "runtime")
+
+EXEC_MODES = ("subprocess", "resident", "worker")
+
+_IMPORT_LOCK = threading.Lock()
+
+
+def exec_mode() -> str:
+    # I read the mode per call so tests and operators can flip it without a restart.
+    mode = os.environ.get("ARTIFY_EXEC_MODE", "subprocess").strip().lower()
+    return mode if mode in EXEC_MODES else "subprocess"
+
+
+def load_script(script: str):
+    """
+    I import `scripts/<name>.py` as a regular module (once per process).
+    scripts/ goes on sys.path so the scripts' sibling helpers (e.g. pipeline_cache) resolve.
+    """
+    name = os.path.splitext(os.path.basename(script))[0]
+    with _IMPORT_LOCK:
+        if SCRIPTS_DIR not in sys.path:
+            sys.path.insert(0, SCRIPTS_DIR)
+        return importlib.import_module(name)
+
+
+def _save_png(img: Image.Image, path: str) -> None:
+    # I write inputs as PNG with light compression: lossless and quick to save.
+    img.save(path, format="PNG", compress_level=4)
+
+
+def _utf8_env() -> dict:
+    # I enforce UTF-8 so the child process won't choke on paths or logs with non-ASCII chars.
+    env = os.environ.copy()
+    env.setdefault("PYTHONIOENCODING", "utf-8")
+    env.setdefault("PYTHONUTF8", "1")
+    return env
+
+
+def _forward_stages(rec: Optional[dict]) -> None:
+    # I hand a script's recording ({"stages", "notes"}, see scripts/stages.py) over to this run's trace.
+    trace = telemetry.current()
+    if trace is None or not rec:
+        return
+    for name, seconds in (rec.get("stages") or {}).items():
+        trace.add(name, float(seconds))
+    for key, value in (rec.get("notes") or {}).items():
+        trace.note(key, value)
+
+
+def _script_stages(stdout: str, launched: float) -> str:
+    # I pick the stages line out of a subprocess' stdout (see scripts/stages.py) and return the rest.
+    marker = load_script("stages").MARKER
+    kept = []
+    for line in (stdout or "").splitlines():
+        if line.startswith(marker):
+            try:
+                info = json.loads(line[len(marker):])
+                _forward_stages({"stages": {"spawn": max(0.0, info["started"] - launched), **info["stages"]},
+                                 "notes": info.get("notes")})
+            except (ValueError, KeyError, TypeError):
+                pass
+        else:
+            kept.append(line)
+    return "\n".join(kept)
+
+
+def spool():
+    return spool_mod.for_dir(RUNTIME_DIR)
+
+
+def _stage_files(scratch, image: Image.Image, style_refs: Optional[List[Image.Image]]):
+    # The spool gives each run unique file names (so parallel calls don't clash) and deletes them afterwards.
+    in_path = scratch.path("in")
+    out_path = scratch.path("out")
+    with telemetry.stage("spool_write"):
+        _save_png(image, in_path)
+        io_flags = ["-i", in_path, "-o", out_path]
+
+        # I pass style reference images as a comma-separated list of PNGs.
+        if style_refs:
+            ref_paths = []
+            for i, ref in enumerate(style_refs):
+                rp = scratch.path(f"ref{i+1}")
+                _save_png(ref, rp)
+                ref_paths.append(rp)
+            io_flags += ["--style-image", ",".join(ref_paths)]
+    return io_flags, out_path
+
+
+def _load_output(prefix: str, out_path: str) -> Image.Image:
+    # I expect the script to write the out file; if not, I report it explicitly.
+    if not os.path.isfile(out_path):
+        raise RuntimeError(f"{prefix} script did not produce an output image.")
+    # I normalize to RGB so downstream code doesn't have to handle palette/alpha edge cases.
+    # convert() loads the pixels, so the file can be deleted right after.
+    with Image.open(out_path) as im:
+        return im.convert("RGB")
+
+
+def _communicate(proc: subprocess.Popen, token):
+    # I wait for the script like subprocess.run would, but terminate it once `token` trips.
+    if token is None:
+        return proc.communicate()
+    while True:
+        try:
+            return proc.communicate(timeout=0.25)
+        except subprocess.TimeoutExpired:
+            reason = token.reason()
+            if not reason:
+                continue
+        proc.terminate()
+        try:
+            proc.communicate(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+        raise Cancelled(reason)
+
+
+def _run_subprocess(script: str, prefix: str, image: Image.Image, flags: List[str],
+                    style_refs: Optional[List[Image.Image]]) -> Image.Image:
+    with spool().scratch(prefix) as scratch:
+        io_flags, out_path = _stage_files(scratch, image, style_refs)
+        args = [sys.executable, script] + io_flags + list(flags)
+
+        # I print the final command so I can copy/paste it when debugging.
+        print(f"DEBUG ARGS[{prefix}]:", " ".join(shlex.quote(a) for a in args))
+
+        # The script reports its stage timings on stdout (ARTIFY_STAGES_STDOUT, see scripts/stages.py).
+        env = dict(_utf8_env(), ARTIFY_STAGES_STDOUT="1")
+        launched = time.time()
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env)
+        stdout, stderr = _communicate(proc, cancellation.current())
+        stdout = _script_stages(stdout, launched)
+        if proc.returncode != 0:
+            # I keep only the tail of the combined logs: enough to diagnose, small enough to read.
+            tail = ((stderr or "") + "\n" + (stdout or ""))[-4000:]
+            raise RuntimeError(f"{prefix} script failed.\n{tail}")
+
+        return _load_output(prefix, out_path)
+
+
+def _run_worker(script: str, prefix: str, image: Image.Image, flags: List[str],
+                style_refs: Optional[List[Image.Image]]) -> Image.Image:
+    from backend.utils import workers
+    # Pixels travel over the worker pipe as raw RGB; "-" is a placeholder like in resident mode.
+    argv = ["-i", "-", "-o", "-"] + list(flags)
+    print(f"DEBUG ARGS[{prefix}/worker]:", " ".join(shlex.quote(a) for a in argv))
+    reply = workers.get_pool(script, prefix).run(argv, images=[image] + list(style_refs or []),
+                                                 on_progress=progress.current(), token=cancellation.current())
+    _forward_stages(reply)
+    return reply["image"]
+
+
+def _batch_call(mod, hooks, stages):
+    # I run a whole batch on the leader's thread with the batch's own hooks (see backend.batching).
+    def call(images, args_list, report, should_stop):
+        with hooks.reporting(report, progress.preview_every()) if report else nullcontext(), \
+                hooks.stopping(should_stop) if should_stop else nullcontext(), \
+                stages.recording() as rec:
+            return mod.stylize_batch(images, args_list), rec
+    return call
+
+
+def _run_resident(script: str, prefix: str, image: Image.Image, flags: List[str],
+                  style_refs: Optional[List[Image.Image]]) -> Image.Image:
+    mod = load_script(script)
+    # The scripts' parsers require -i/-o; images are handed over directly, so "-" is a placeholder.
+    argv = ["-i", "-", "-o", "-"] + list(flags)
+    print(f"DEBUG ARGS[{prefix}/resident]:", " ".join(shlex.quote(a) for a in argv))
+    hooks = load_script("step_hooks")
+    stages = load_script("stages")
+    sink, token = progress.current(), cancellation.current()
+    batched = not style_refs and batching.window_s() > 0 and hasattr(mod, "stylize_batch")
+    try:
+        args = mod.build_parser().parse_args(argv)
+        if batched:
+            # I let compatible runs that arrive together share one pipeline call; the batch
+            # reports to every member's sink and records stages for every member's trace.
+            out, rec = batching.run(batching.batch_key(script, list(flags)), _batch_call(mod, hooks, stages),
+                                    image, args, sink=sink and progress.guarded(sink), token=token)
+            _forward_stages(rec)
+            return out.convert("RGB")
+        # Step events from the pipelines called on this thread go straight to the sink, and a
+        # tripped token interrupts them.
+        with hooks.reporting(sink, progress.preview_every()) if sink else nullcontext(), \
+                hooks.stopping(lambda: token.reason() is not None) if token else nullcontext(), \
+                stages.recording() as rec:
+            try:
+                if style_refs:
+                    out = mod.stylize_image(image, args, style_imgs=style_refs)
+                else:
+                    out = mod.stylize_image(image, args)
+            finally:
+                _forward_stages(rec)
+    except hooks.Interrupted:
+        raise Cancelled(token.reason() or "cancelled")
+    except SystemExit as ex:
+        # The scripts sys.exit() on fatal stage errors; in-process that must not stop the server.
+        raise RuntimeError(f"{prefix} pipeline failed (exit code {ex.code}).") from ex
+    return out.convert("RGB")
+
+
+def run_script(script: str, prefix: str, image: Image.Image, flags: List[str],
+               style_refs: Optional[List[Image.Image]] = None) -> Image.Image:
+    """
+    I run `script` on `image` with CLI `flags` (everything except -i/-o) and return an RGB PIL image.
+    Errors surface as RuntimeError with a readable message, whatever the mode.
+    """
+    mode = exec_mode()
+    if mode == "resident":
+        return _run_resident(script, prefix, image, flags, style_refs)
+    if mode == "worker":
+        return _run_worker(script, prefix, image, flags, style_refs)
+    return _run_subprocess(script, prefix, image, flags, style_refs)
+
+
+def preload_script(script: str, prefix: str) -> dict:
+    # I warm up whatever the mode keeps alive, so the first request doesn't pay for torch/diffusers imports.
+    mode = exec_mode()
+    if mode == "resident":
+        mod = load_script(script)
+        # Scripts with annotators expose warm(), which loads them into this process.
+        info = mod.warm() if hasattr(mod, "warm") else {}
+        return {"ok": True, "mode": mode, "message": f"{prefix} script imported", **info}
+    if mode == "worker":
+        from backend.utils import workers
+        pool = workers.get_pool(script, prefix)
+        pool.start(warm=True)
+        return {"ok": True, "mode": mode, "message": f"{pool.size} {prefix} worker(s) ready"}
+    return {"ok": True, "mode": mode, "message": "preload noop"}
+
+
+def runtime_status() -> dict:
+    # I report what the current mode keeps warm: in-process annotators/control maps, or the worker pools.
+    mode = exec_mode()
+    if mode == "resident":
+        return {"mode": mode, "annotators": load_script("annotators").status(),
+                "controlMaps": load_script("control_cache").status()}
+    if mode == "worker":
+        from backend.utils import workers
+        return {"mode": mode, "workers": workers.status_all()}
+    return {"mode": mode, "spool": spool().status()}
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+I manage `runtime/`, the scratch folder subprocess-mode runs use to hand images to scripts.
+
+- `scratch(prefix)` gives a run its own file names and deletes whatever it created when the
+  run ends, success or not.
+- A background sweeper removes leftovers (crashed runs, files from older versions) once they
+  are older than the TTL, and the oldest files whenever the folder is over its byte quota.
+  Files of runs still in progress are never touched.
+- `status()` reports spool size and what the sweeper has removed, for /healthz.
+
+Settings (env vars):
+  ARTIFY_SPOOL_MB       byte quota for runtime/ (default 512)
+  ARTIFY_SPOOL_TTL_S    leftovers older than this are deleted (default 3600)
+  ARTIFY_SPOOL_SWEEP_S  seconds between sweeps (default 60, 0 = no background sweeper)
+"""
+from __future__ import annotations
+import os, time, uuid, threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+class Scratch:
+    """The file names one run may use. I only hand out paths; callers create the files."""
+
+    def __init__(self, spool: "Spool", prefix: str):
+        self.spool = spool
+        self.prefix = prefix
+        self.tid = uuid.uuid4().hex[:8]
+        self.paths: List[str] = []
+
+    def path(self, role: str, ext: str = "png") -> str:
+        # e.g. runtime/noir_in_1a2b3c4d.png — same naming the wrappers always used.
+        p = os.path.join(self.spool.root, f"{self.prefix}_{role}_{self.tid}.{ext}")
+        self.paths.append(p)
+        self.spool._claim(p)
+        return p
+
+
+class Spool:
+    def __init__(self, root: str, quota_bytes: int, ttl_s: float):
+        self.root = root
+        self.quota_bytes = max(0, quota_bytes)
+        self.ttl_s = max(1.0, ttl_s)
+        self._in_use: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"sweeps": 0, "deletedFiles": 0, "deletedBytes": 0, "files": 0, "bytes": 0}
+
+    def _claim(self, path: str) -> None:
+        with self._lock:
+            self._in_use.add(path)
+
+    @contextmanager
+    def scratch(self, prefix: str) -> Iterator[Scratch]:
+        os.makedirs(self.root, exist_ok=True)
+        sc = Scratch(self, prefix)
+        try:
+            yield sc
+        finally:
+            for p in sc.paths:
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"[spool] could not delete {p}: {e}")
+            with self._lock:
+                self._in_use.difference_update(sc.paths)
+
+    def _listing(self):
+        out = []
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return out
+        for name in names:
+            p = os.path.join(self.root, name)
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            if os.path.isfile(p):
+                out.append((st.st_mtime, st.st_size, p))
+        return out
+
+    def sweep(self) -> dict:
+        """I delete expired leftovers, then the oldest idle files while over quota."""
+        now = time.time()
+        files = sorted(self._listing())
+        with self._lock:
+            busy = set(self._in_use)
+        total = sum(size for _, size, _ in files)
+        deleted = deleted_bytes = 0
+        for mtime, size, p in files:
+            if p in busy:
+                continue
+            if now - mtime <= self.ttl_s and total <= self.quota_bytes:
+                continue
+            try:
+                os.remove(p)
+            except OSError:
+                continue
+            total -= size
+            deleted += 1
+            deleted_bytes += size
+        with self._lock:
+            self.stats["sweeps"] += 1
+            self.stats["deletedFiles"] += deleted
+            self.stats["deletedBytes"] += deleted_bytes
+            self.stats["files"] = len(files) - deleted
+            self.stats["bytes"] = total
+        if deleted:
+            print(f"[spool] swept {deleted} file(s), {deleted_bytes // 1024} KB from {self.root}")
+        return self.status()
+
+    def start_sweeper(self, interval_s: float) -> None:
+        if interval_s <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+
+        def _loop():
+            while not self._stop.wait(interval_s):
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"[spool] sweep failed: {e}")
+
+        self._thread = threading.Thread(target=_loop, name="spool-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop_sweeper(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"root": self.root, "quotaBytes": self.quota_bytes, "ttlS": self.ttl_s,
+                    "inUse": len(self._in_use), **self.stats}
+
+
+_SPOOLS: Dict[str, Spool] = {}
+_SPOOLS_LOCK = threading.Lock()
+
+
+def for_dir(root: str) -> Spool:
+    # One Spool per folder, so every wrapper shares the same bookkeeping.
+    root = os.path.abspath(root)
+    with _SPOOLS_LOCK:
+        sp = _SPOOLS.get(root)
+        if sp is None:
+            sp = _SPOOLS[root] = Spool(
+                root,
+                quota_bytes=_env_int("ARTIFY_SPOOL_MB", 512) * 1024 * 1024,
+                ttl_s=float(_env_int("ARTIFY_SPOOL_TTL_S", 3600)),
+            )
+        return sp
+
+
+def sweep_interval_s() -> float:
+    return float(max(0, _env_int("ARTIFY_SPOOL_SWEEP_S", 60)))
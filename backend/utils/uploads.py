@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+I read a multipart/form-data stylize upload straight off the request stream.
+
+The JSON endpoint makes clients inflate a photo by a third into base64 and makes the server
+hold and decode that string. Here file parts go chunk by chunk from the socket into one
+byte buffer each (python-multipart parses incrementally), and I stop as soon as a part
+crosses its byte limit instead of buffering the whole body first.
+
+Form layout:
+  image        the photo (file, required)
+  styleImages  style reference images (file, repeatable, optional)
+  extras       JSON object (optional)
+  any other    a StylizeOptions field as plain text (mode, style, subject, steps, ...)
+"""
+from __future__ import annotations
+import json
+from typing import Dict, List, Optional, Tuple
+
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+FILE_FIELDS = ("image", "styleImages")
+MAX_FIELD_BYTES = 64 * 1024         # plain form values are tiny; this is generous
+MAX_STYLE_IMAGES = 8
+
+
+class UploadError(ValueError):
+    """Malformed or incomplete upload (→ 400)."""
+
+
+class UploadTooLarge(ValueError):
+    """A part went over its byte limit (→ 413)."""
+
+
+class _FormCollector:
+    # I receive python-multipart callbacks and collect parts into bounded buffers.
+
+    def __init__(self, max_file_bytes: int):
+        self.max_file_bytes = max_file_bytes
+        self.fields: Dict[str, str] = {}
+        self.files: Dict[str, List[bytes]] = {name: [] for name in FILE_FIELDS}
+        self._header_field = b""
+        self._header_value = b""
+        self._disposition: Optional[bytes] = None
+        self._name: Optional[str] = None
+        self._buf = bytearray()
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": lambda d, s, e: self._add("_header_field", d[s:e]),
+            "on_header_value": lambda d, s, e: self._add("_header_value", d[s:e]),
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        }
+
+    def _add(self, attr: str, data: bytes) -> None:
+        setattr(self, attr, getattr(self, attr) + data)
+
+    def _part_begin(self) -> None:
+        self._disposition, self._name = None, None
+        self._buf = bytearray()
+
+    def _header_end(self) -> None:
+        if self._header_field.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_field, self._header_value = b"", b""
+
+    def _headers_finished(self) -> None:
+        if self._disposition is None:
+            raise UploadError("Multipart part without Content-Disposition")
+        _, params = parse_options_header(self._disposition)
+        name = params.get(b"name")
+        if not name:
+            raise UploadError("Multipart part without a field name")
+        self._name = name.decode("utf-8", "replace")
+        if self._name == "styleImages" and len(self.files["styleImages"]) >= MAX_STYLE_IMAGES:
+            raise UploadError(f"At most {MAX_STYLE_IMAGES} style images are allowed")
+
+    def _limit(self) -> int:
+        return self.max_file_bytes if self._name in FILE_FIELDS else MAX_FIELD_BYTES
+
+    def _part_data(self, data: bytes, start: int, end: int) -> None:
+        if len(self._buf) + (end - start) > self._limit():
+            if self._name in FILE_FIELDS:
+                raise UploadTooLarge(f"'{self._name}' exceeds {self.max_file_bytes // (1024 * 1024)} MB limit")
+            raise UploadError(f"Form field '{self._name}' is too large")
+        self._buf += data[start:end]
+
+    def _part_end(self) -> None:
+        if self._name in FILE_FIELDS:
+            self.files[self._name].append(bytes(self._buf))
+        else:
+            self.fields[self._name] = self._buf.decode("utf-8")
+
+
+async def read_stylize_form(request, max_file_bytes: int) -> Tuple[Dict[str, object], bytes, List[bytes]]:
+    """
+    I parse the upload and return (option fields, image bytes, style image bytes).
+    Raises UploadTooLarge / UploadError; option values are left for pydantic to validate.
+    """
+    ctype, params = parse_options_header(request.headers.get("content-type", ""))
+    if ctype != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadError("Expected multipart/form-data with a boundary")
+
+    # I can refuse obviously oversized bodies before reading a byte.
+    declared = request.headers.get("content-length")
+    budget = max_file_bytes * (1 + MAX_STYLE_IMAGES) + MAX_FIELD_BYTES * 16
+    if declared and declared.isdigit() and int(declared) > budget:
+        raise UploadTooLarge("Request body is too large")
+
+    form = _FormCollector(max_file_bytes)
+    parser = MultipartParser(params[b"boundary"], form.callbacks())
+    async for chunk in request.stream():
+        parser.write(chunk)
+    parser.finalize()
+
+    if not form.files["image"]:
+        raise UploadError("Missing 'image' file part")
+    fields: Dict[str, object] = dict(form.fields)
+    if "extras" in fields:
+        try:
+            fields["extras"] = json.loads(fields["extras"]) if fields["extras"] else None
+        except json.JSONDecodeError as e:
+            raise UploadError(f"'extras' is not valid JSON: {e}")
+    return fields, form.files["image"][0], form.files["styleImages"]
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+I manage pools of long-lived stylizer workers (`python scripts/<style>.py --serve`).
+
+Each worker is a separate process, so a crash or OOM in a model only takes down that worker,
+but it keeps its pipelines loaded between jobs, so requests skip interpreter start and model
+loading. Wrappers reach me through `backend.utils.runner` when ARTIFY_EXEC_MODE=worker.
+
+The wire protocol (length-prefixed JSON frames over stdin/stdout) lives in
+`scripts/worker_serve.py`; I reuse its read/write helpers so both sides agree.
+
+Settings (env vars, read when a pool is created):
+  ARTIFY_WORKERS          workers per style (default 1)
+  ARTIFY_WORKER_MAX_JOBS  recycle a worker after this many jobs (default 100, 0 = never)
+  ARTIFY_WORKER_HEALTH_S  seconds between health pings of idle workers (default 30, 0 = off)
+  ARTIFY_WORKER_START_S   how long a new worker may take to report ready (default 120)
+  ARTIFY_WORKER_JOB_S     per-job timeout; a worker that overruns is killed (default 900)
+  ARTIFY_WORKER_CANCEL_S  how long a cancelled job may take to stop before its worker is killed (default 10)
+"""
+from __future__ import annotations
+import os, sys, time, queue, itertools, threading, subprocess, collections
+from typing import Dict, List, Optional
+from PIL import Image
+
+from backend import progress, telemetry
+from backend.cancellation import Cancelled
+from backend.utils.runner import load_script
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _protocol():
+    # I import the scripts' framing helpers once (cached by the import system).
+    return load_script("worker_serve")
+
+
+def _progress_event(frame: dict) -> dict:
+    # A progress frame may carry its preview as one raw RGB blob, sized by "preview".
+    preview = None
+    if frame.get("preview") and frame.get("_blobs"):
+        preview = Image.frombytes("RGB", tuple(frame["preview"]), frame["_blobs"][0])
+    return {"step": frame.get("step"), "steps": frame.get("steps"), "preview": preview}
+
+
+class Worker:
+    """One `--serve` process plus the threads that read its frames and stderr."""
+
+    def __init__(self, script: str):
+        env = os.environ.copy()
+        env.setdefault("PYTHONIOENCODING", "utf-8")
+        env.setdefault("PYTHONUTF8", "1")
+        self.script = script
+        self.proc = subprocess.Popen(
+            [sys.executable, script, "--serve"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+        )
+        self.jobs = 0
+        self.started = time.time()
+        self.warm_info: dict = {}                  # what the script reported after "warm" (annotators)
+        self.log = collections.deque(maxlen=200)   # I keep the stderr tail for error messages.
+        self._frames: "queue.Queue[Optional[dict]]" = queue.Queue()
+        self._ids = itertools.count(1)
+        threading.Thread(target=self._read_frames, daemon=True).start()
+        threading.Thread(target=self._drain_stderr, daemon=True).start()
+
+    @property
+    def pid(self) -> int:
+        return self.proc.pid
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def tail(self, n: int = 40) -> str:
+        return "\n".join(list(self.log)[-n:])
+
+    def _read_frames(self) -> None:
+        proto = _protocol()
+        while True:
+            try:
+                msg = proto.read_message(self.proc.stdout)
+            except Exception:
+                msg = None
+            frame = None
+            if msg is not None:
+                frame, blobs = msg
+                if blobs:
+                    frame["_blobs"] = blobs     # raw payloads that followed the JSON frame
+            self._frames.put(frame)
+            if frame is None:
+                return
+
+    def _drain_stderr(self) -> None:
+        for line in iter(self.proc.stderr.readline, b""):
+            self.log.append(line.decode("utf-8", "replace").rstrip())
+
+    def _next_frame(self, deadline: float) -> dict:
+        try:
+            frame = self._frames.get(timeout=max(0.0, deadline - time.time()))
+        except queue.Empty:
+            raise TimeoutError("worker did not answer in time")
+        if frame is None:
+            raise RuntimeError(f"worker exited (code {self.proc.poll()})")
+        return frame
+
+    def wait_ready(self, timeout: float) -> None:
+        frame = self._next_frame(time.time() + timeout)
+        if frame.get("op") != "ready":
+            raise RuntimeError(f"unexpected first frame from worker: {frame}")
+
+    def _send(self, msg: dict, blobs=()) -> None:
+        try:
+            _protocol().write_message(self.proc.stdin, msg, blobs)
+        except (BrokenPipeError, OSError, ValueError) as ex:
+            raise RuntimeError(f"worker pipe closed: {ex}") from ex
+
+    def request(self, msg: dict, timeout: float, blobs=(), on_progress=None,
+                token=None, cancel_grace: float = 10.0) -> dict:
+        # I tag each request with an id and skip stray frames (e.g. a late pong).
+        # "progress" frames for this request go to `on_progress` until the real reply arrives.
+        # With a cancel `token` I check it on every pass, whether a frame came in or not (a worker
+        # streaming progress never leaves me idle): once it trips I send "cancel", and if the
+        # worker hasn't stopped `cancel_grace` seconds later I raise Cancelled (the pool kills it).
+        rid = next(self._ids)
+        self._send(dict(msg, id=rid), blobs)
+        deadline = time.time() + timeout
+        cancel_sent: Optional[float] = None
+        reason: Optional[str] = None
+        while True:
+            if token is None:
+                frame = self._next_frame(deadline)
+            else:
+                reason = reason or token.reason()
+                if reason and cancel_sent is None:
+                    self._send({"op": "cancel", "id": rid})
+                    cancel_sent = time.time()
+                elif cancel_sent is not None and time.time() - cancel_sent > cancel_grace:
+                    raise Cancelled(reason)
+                try:
+                    frame = self._next_frame(min(deadline, time.time() + 0.25))
+                except TimeoutError:
+                    if time.time() >= deadline:
+                        raise
+                    continue
+            if frame.get("id") != rid:
+                continue
+            if frame.get("op") != "progress":
+                return frame
+            if on_progress is not None:
+                on_progress(_progress_event(frame))
+
+    def stop(self, grace: float = 5.0) -> None:
+        # I ask nicely first, then kill.
+        if self.alive():
+            try:
+                _protocol().write_frame(self.proc.stdin, {"op": "shutdown"})
+                self.proc.wait(timeout=grace)
+            except Exception:
+                self.proc.kill()
+                try:
+                    self.proc.wait(timeout=grace)
+                except Exception:
+                    pass
+
+
+class WorkerPool:
+    """
+    A fixed number of worker slots for one script. A slot holds either a live Worker or None,
+    meaning "spawn on next use", so a failed spawn or a recycled worker never loses a slot.
+    """
+
+    def __init__(self, script: str, prefix: str):
+        self.script = script
+        self.prefix = prefix
+        self.size = max(1, _env_int("ARTIFY_WORKERS", 1))
+        self.max_jobs = max(0, _env_int("ARTIFY_WORKER_MAX_JOBS", 100))
+        self.health_s = max(0, _env_int("ARTIFY_WORKER_HEALTH_S", 30))
+        self.start_s = max(1, _env_int("ARTIFY_WORKER_START_S", 120))
+        self.job_s = max(1, _env_int("ARTIFY_WORKER_JOB_S", 900))
+        self.cancel_s = max(1, _env_int("ARTIFY_WORKER_CANCEL_S", 10))
+        self._slots: "queue.Queue[Optional[Worker]]" = queue.Queue()
+        self._live: Dict[int, Worker] = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self._closed = threading.Event()
+
+    # ---- lifecycle ----
+    def start(self, warm: bool = False) -> None:
+        # I create the slots once; with warm=True I also spawn the processes right away.
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for _ in range(self.size):
+                self._slots.put(None)
+        if warm:
+            # I spawn every worker and let it load its annotators before the first request.
+            for _ in range(self.size):
+                w = self._acquire()
+                try:
+                    reply = w.request({"op": "warm"}, timeout=self.start_s)
+                    w.warm_info = {k: v for k, v in reply.items() if k not in ("id", "ok")}
+                except Exception as ex:
+                    print(f"[workers] {self.prefix} worker {w.pid} failed to warm up: {ex}")
+                self._release(w)
+        if self.health_s:
+            threading.Thread(target=self._health_loop, daemon=True).start()
+
+    def shutdown(self) -> None:
+        self._closed.set()
+        with self._lock:
+            workers = list(self._live.values())
+            self._live.clear()
+        for w in workers:
+            w.stop()
+
+    # ---- slots ----
+    def _spawn(self) -> Worker:
+        w = Worker(self.script)
+        try:
+            w.wait_ready(self.start_s)
+        except Exception as ex:
+            w.stop(grace=1.0)
+            raise RuntimeError(f"{self.prefix} worker failed to start: {ex}\n{w.tail()}") from ex
+        with self._lock:
+            self._live[w.pid] = w
+        return w
+
+    def _retire(self, w: Optional[Worker]) -> None:
+        if w is None:
+            return
+        with self._lock:
+            self._live.pop(w.pid, None)
+        w.stop()
+
+    def _acquire(self) -> Worker:
+        # I block until a slot is free; that's the pool's natural backpressure.
+        w = self._slots.get()
+        if w is not None and w.alive():
+            return w
+        self._retire(w)
+        try:
+            with telemetry.stage("spawn"):
+                return self._spawn()
+        except Exception:
+            self._slots.put(None)
+            raise
+
+    def _release(self, w: Optional[Worker]) -> None:
+        self._slots.put(w)
+
+    # ---- jobs ----
+    def run(self, argv: List[str], images: Optional[List[Image.Image]] = None, on_progress=None,
+            token=None) -> dict:
+        """
+        I run one job (the script's CLI flags) and return the worker's reply.
+        With `images` (input first, then style refs) pixels go over the pipe as raw RGB and the
+        reply carries the output under "image"; otherwise argv's -i/-o must be real file paths.
+        `on_progress` gets the job's step events (see backend.progress) while it runs.
+        A tripped cancel `token` (backend.cancellation) stops the job and raises Cancelled.
+        """
+        self.start()
+        msg: dict = {"op": "run", "argv": list(argv)}
+        if on_progress is not None:
+            msg["progress"] = {"previewEvery": progress.preview_every()}
+        blobs = ()
+        if images:
+            images = [im.convert("RGB") for im in images]
+            msg["images"] = [list(im.size) for im in images]
+            blobs = [im.tobytes() for im in images]
+        w = self._acquire()
+        try:
+            reply = w.request(msg, timeout=self.job_s, blobs=blobs, on_progress=on_progress,
+                              token=token, cancel_grace=self.cancel_s)
+        except Cancelled:
+            # It didn't stop in time (stuck outside the denoising loop): a fresh worker is cheaper.
+            print(f"[workers] {self.prefix} worker {w.pid} ignored cancel; killing it")
+            self._retire(w)
+            self._release(None)
+            raise
+        except Exception as ex:
+            # A crashed or stuck worker gets replaced; the slot comes back empty.
+            tail = w.tail()
+            self._retire(w)
+            self._release(None)
+            raise RuntimeError(f"{self.prefix} worker failed: {ex}\n{tail}"[-4000:]) from ex
+        w.jobs += 1
+        if self.max_jobs and w.jobs >= self.max_jobs:
+            # I recycle long-lived workers to cap slow leaks (fragmentation, caches).
+            self._retire(w)
+            self._release(None)
+        else:
+            self._release(w)
+        if reply.get("cancelled"):
+            raise Cancelled(token.reason() if token is not None and token.reason() else "cancelled")
+        if not reply.get("ok"):
+            raise RuntimeError(f"{self.prefix} worker job failed: {reply.get('error')}\n{w.tail()}"[-4000:])
+        if "image" in reply:
+            reply["image"] = Image.frombytes("RGB", tuple(reply["image"]), reply.pop("_blobs")[0])
+        return reply
+
+    # ---- health ----
+    def _health_loop(self) -> None:
+        while not self._closed.wait(self.health_s):
+            self.check_health()
+
+    def check_health(self) -> None:
+        # I ping whichever workers are idle right now; busy ones are proving themselves anyway.
+        for _ in range(self._slots.qsize()):
+            try:
+                w = self._slots.get_nowait()
+            except queue.Empty:
+                return
+            if w is not None:
+                try:
+                    ok = w.alive() and w.request({"op": "ping"}, timeout=10).get("ok")
+                except Exception:
+                    ok = False
+                if not ok:
+                    print(f"[workers] {self.prefix} worker {w.pid} failed health check; replacing")
+                    self._retire(w)
+                    w = None
+            self._release(w)
+
+    def status(self) -> dict:
+        with self._lock:
+            live = [{"pid": w.pid, "jobs": w.jobs, "uptimeS": int(time.time() - w.started), **w.warm_info}
+                    for w in self._live.values()]
+        return {"size": self.size, "idle": self._slots.qsize(), "workers": live}
+
+
+_POOLS: Dict[str, WorkerPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pool(script: str, prefix: str) -> WorkerPool:
+    with _POOLS_LOCK:
+        pool = _POOLS.get(script)
+        if pool is None:
+            pool = _POOLS[script] = WorkerPool(script, prefix)
+        return pool
+
+
+def status_all() -> dict:
+    with _POOLS_LOCK:
+        pools = dict(_POOLS)
+    return {p.prefix: p.status() for p in pools.values()}
+
+
+def shutdown_all() -> None:
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for p in pools:
+        p.shutdown()
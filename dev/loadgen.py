@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+I replay stylize requests against a running server and report throughput and latency
+percentiles per style/mode. Standard library only.
+
+Payloads are either captured JSON files (e.g. from dev/make_payload.py, repeat --payload) or
+generated from --styles/--modes with a synthetic photo (or --image). Each request gets its own
+seed by default so the result cache doesn't answer for the server (--seeds fixed to test it).
+
+Load shapes:
+  closed loop  (--rate 0, default)  --concurrency clients send back to back
+  open loop    (--rate R)            R requests/s on average (Poisson arrivals, or --arrival
+                                     uniform), at most --concurrency in flight. Latency counts
+                                     from the scheduled arrival, so time spent waiting for a
+                                     free client slot is included.
+
+For a CPU-only box, start the server with the stub style (backend/styles/stub.py):
+  ARTIFY_STUB_STYLE=1 ARTIFY_STUB_STEP_MS=30 uvicorn backend.server:app --port 8000
+  python dev/loadgen.py --styles stub --modes preview,full --concurrency 8 --rate 2 --duration 60
+"""
+import argparse, base64, io, itertools, json, math, random, sys, threading, time
+import urllib.error, urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+DEFAULTS = {"preview": {"steps": 25, "maxSide": 768}, "full": {"steps": 36, "maxSide": 1280}}
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser("Stylize load generator")
+    p.add_argument("--url", default="http://127.0.0.1:8000")
+    p.add_argument("--path", default="/api/stylize")
+    p.add_argument("--payload", action="append", default=[], help="Captured request JSON (repeatable)")
+    p.add_argument("--styles", default="stub", help="Comma-separated styles for generated payloads")
+    p.add_argument("--modes", default="preview", help="Comma-separated modes for generated payloads")
+    p.add_argument("--subject", default="scene", choices=["scene", "portrait"])
+    p.add_argument("--image", help="Input photo for generated payloads (default: synthetic)")
+    p.add_argument("--size", type=int, default=1024, help="Long side of the synthetic photo")
+    p.add_argument("--extras", default="{}", help='JSON merged into "extras", e.g. \'{"stepMs": 20}\'')
+    p.add_argument("--seeds", choices=["unique", "fixed", "none"], default="unique")
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--rate", type=float, default=0.0, help="Open-loop arrivals per second (0 = closed loop)")
+    p.add_argument("--arrival", choices=["poisson", "uniform"], default="poisson")
+    p.add_argument("--requests", type=int, default=50, help="Stop after this many requests")
+    p.add_argument("--duration", type=float, default=0.0, help="Or stop sending after this many seconds")
+    p.add_argument("--timeout", type=float, default=600.0)
+    p.add_argument("--result-ref", action="store_true", help="Ask for ?result=ref instead of inline images")
+    p.add_argument("--json", dest="json_out", help="Also write the report as JSON here")
+    return p.parse_args(argv)
+
+
+def synthetic_photo(side: int) -> Image.Image:
+    # Gradients, blocks and noise: compresses and grades like a photo, always the same.
+    w, h = side, side * 3 // 4
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    arr = np.stack([xx / w, yy / h, 0.5 + 0.5 * np.sin(xx / 37.0) * np.cos(yy / 23.0)], axis=2)
+    arr = arr * 0.75 + ((xx // 64 + yy // 64) % 2)[..., None] * 0.25
+    arr = arr + np.random.default_rng(0).normal(0, 0.03, arr.shape)
+    return Image.fromarray((np.clip(arr, 0, 1) * 255).astype(np.uint8))
+
+
+def to_data_uri(img: Image.Image) -> str:
+    buf = io.BytesIO()
+    img.convert("RGB").save(buf, "JPEG", quality=92)
+    return "data:image/jpeg;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def build_payloads(args) -> list:
+    if args.payload:
+        out = []
+        for path in args.payload:
+            with open(path, "r", encoding="utf-8") as f:
+                out.append(json.load(f))
+        return out
+    uri = to_data_uri(Image.open(args.image) if args.image else synthetic_photo(args.size))
+    extras = json.loads(args.extras)
+    return [
+        {"mode": mode, "style": style, "subject": args.subject, "imageBase64": uri, "control": "auto",
+         "strength": 0.32, "guidance": 6.6, **DEFAULTS[mode], "seed": 77, "styleImagesBase64": [], "extras": extras}
+        for style in args.styles.split(",") for mode in args.modes.split(",")
+    ]
+
+
+def post(url: str, body: dict, timeout: float):
+    req = urllib.request.Request(url, data=json.dumps(body).encode("utf-8"), method="POST",
+                                 headers={"Content-Type": "application/json", "Accept": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            return r.status, json.loads(r.read() or b"null")
+    except urllib.error.HTTPError as e:
+        try:
+            return e.code, json.loads(e.read() or b"null")
+        except ValueError:
+            return e.code, None
+    except Exception as e:
+        return 0, {"detail": {"code": "CLIENT_ERROR", "message": str(e)}}
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    # Nearest rank: the smallest value with at least q% of the samples at or below it.
+    if not sorted_values:
+        return float("nan")
+    k = max(0, min(len(sorted_values) - 1, math.ceil(q / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def summarize(results: list, wall_s: float) -> dict:
+    groups = {}
+    for r in results:
+        groups.setdefault(f"{r['style']}/{r['mode']}", []).append(r)
+    groups["all"] = list(results)
+    report = {}
+    for key, rs in groups.items():
+        ok = sorted(r["latency"] for r in rs if r["status"] == 200)
+        server = [r["durationMs"] for r in rs if r.get("durationMs") is not None]
+        statuses = {}
+        for r in rs:
+            if r["status"] != 200:
+                statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+        caches = {}
+        for r in rs:
+            if r.get("cache"):
+                caches[r["cache"]] = caches.get(r["cache"], 0) + 1
+        report[key] = {
+            "sent": len(rs), "ok": len(ok), "errors": statuses, "cache": caches,
+            "throughputPerS": round(len(ok) / wall_s, 3) if wall_s > 0 else None,
+            "p50Ms": round(percentile(ok, 50) * 1000), "p95Ms": round(percentile(ok, 95) * 1000),
+            "p99Ms": round(percentile(ok, 99) * 1000),
+            "serverMeanMs": round(sum(server) / len(server)) if server else None,
+        } if ok else {"sent": len(rs), "ok": 0, "errors": statuses, "cache": caches}
+    return report
+
+
+def print_report(report: dict, wall_s: float) -> None:
+    print(f"\n{'style/mode':<22}{'sent':>6}{'ok':>6}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'srv ms':>9}  errors")
+    for key, r in sorted(report.items(), key=lambda kv: (kv[0] == "all", kv[0])):
+        if r["ok"]:
+            print(f"{key:<22}{r['sent']:>6}{r['ok']:>6}{r['throughputPerS']:>8.2f}{r['p50Ms']:>9}{r['p95Ms']:>9}"
+                  f"{r['p99Ms']:>9}{r['serverMeanMs'] if r['serverMeanMs'] is not None else '-':>9}  {r['errors'] or ''}")
+        else:
+            print(f"{key:<22}{r['sent']:>6}{0:>6}{'-':>8}{'-':>9}{'-':>9}{'-':>9}{'-':>9}  {r['errors']}")
+    print(f"wall time {wall_s:.1f} s")
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    payloads = build_payloads(args)
+    url = args.url.rstrip("/") + args.path + ("?result=ref" if args.result_ref else "")
+    results, lock = [], threading.Lock()
+    counter = itertools.count()
+    t_start = time.perf_counter()
+    stop_at = t_start + args.duration if args.duration > 0 else None
+
+    def next_index():
+        # I hand out request numbers until --requests or --duration runs out.
+        i = next(counter)
+        if (args.duration <= 0 and i >= args.requests) or (stop_at and time.perf_counter() >= stop_at):
+            return None
+        return i
+
+    def fire(i: int, scheduled: float) -> None:
+        body = dict(payloads[i % len(payloads)])
+        if args.seeds == "unique":
+            body["seed"] = 1000 + i
+        elif args.seeds == "none":
+            body["seed"] = None
+        status, data = post(url, body, args.timeout)
+        latency = time.perf_counter() - scheduled
+        metrics = (data.get("metrics") or {}) if isinstance(data, dict) else {}
+        with lock:
+            results.append({"style": body["style"], "mode": body["mode"], "status": status, "latency": latency,
+                            "durationMs": metrics.get("durationMs"), "cache": metrics.get("cache")})
+        if status != 200:
+            detail = data.get("detail") if isinstance(data, dict) else None
+            print(f"[{i}] {body['style']}/{body['mode']} → {status} {detail or ''}", file=sys.stderr)
+
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        if args.rate > 0:
+            # Open loop: arrivals follow the clock, not the server.
+            due = time.perf_counter()
+            while True:
+                i = next_index()
+                if i is None:
+                    break
+                gap = random.expovariate(args.rate) if args.arrival == "poisson" else 1.0 / args.rate
+                due += gap
+                time.sleep(max(0.0, due - time.perf_counter()))
+                pool.submit(fire, i, due)
+        else:
+            def client() -> None:
+                while True:
+                    i = next_index()
+                    if i is None:
+                        return
+                    fire(i, time.perf_counter())
+            for _ in range(max(1, args.concurrency)):
+                pool.submit(client)
+
+    wall_s = time.perf_counter() - t_start
+    report = summarize(results, wall_s)
+    print_report(report, wall_s)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "wallS": round(wall_s, 3), "groups": report}, f, indent=2)
+    return 0 if results and report["all"]["ok"] == len(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
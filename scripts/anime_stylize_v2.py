@@ -4,16 +4,25 @@
 # I keep comments short: what I pass in, how I pick models/control, and how I run seeds.
 
 import os
+import sys
 import argparse
 import warnings
 from pathlib import Path
 from typing import Optional, List
 
 import numpy as np
-from PIL import Image, ImageOps, ImageFilter
+from PIL import Image, ImageOps
 
 import torch
 
+import pipeline_cache
+import control_cache
+import annotators
+import worker_serve
+import step_hooks
+import stages
+import postfx
+
 # --- OpenCV shims (I make sure basic cv2 ops exist before controlnet_aux imports) ---
 try:
     import cv2
@@ -49,6 +58,7 @@ def load_image(path: str) -> Image.Image:
     # I always work in RGB.
     return Image.open(path).convert("RGB")
 
+@stages.timed("resize")
 def resize_max_side(img: Image.Image, max_side: int = 640) -> Image.Image:
     # I keep aspect ratio and clamp the longest side.
     w, h = img.size
@@ -102,37 +112,39 @@ def pick_controlnet_repo(kind: str, attn_dim: int) -> Optional[str]:
     return mapping.get(kind)
 
 # ============================== Control map builders ==============================
-def build_control_map(init_image: Image.Image, control_kind: str, fast: bool) -> Optional[Image.Image]:
+def build_control_map(init_image: Image.Image, control_kind: str, fast: bool,
+                      source: Optional[str] = None) -> Optional[Image.Image]:
     # I generate a control image via controlnet_aux (lineart/hed) or OpenCV (canny).
-    try:
-        if control_kind == "lineart_anime":
-            from controlnet_aux.lineart_anime import LineartAnimeDetector
-            lad = LineartAnimeDetector.from_pretrained("lllyasviel/Annotators")
-            detect_res = 512 if fast else 768
-            ctrl = lad(init_image, detect_resolution=detect_res, image_resolution=max(init_image.size))
-            ctrl = to_white_bg_black_lines(ctrl)
-        elif control_kind == "softedge":
-            from controlnet_aux.hed import HEDdetector
-            hed = HEDdetector.from_pretrained("lllyasviel/Annotators")
-            ctrl = hed(init_image)
-            ctrl = to_white_bg_black_lines(ctrl)
-        elif control_kind == "canny":
-            if cv2 is None:
-                from controlnet_aux.hed import HEDdetector
-                hed = HEDdetector.from_pretrained("lllyasviel/Annotators")
-                ctrl = hed(init_image)
-                ctrl = to_white_bg_black_lines(ctrl)
-            else:
-                g = cv2.cvtColor(np.array(init_image), cv2.COLOR_RGB2GRAY)
+    # Maps are cached per photo/kind/detect resolution (see control_cache.py); canny per size.
+    detect_res = 512 if fast else 768
+
+    def build(im: Image.Image) -> Optional[Image.Image]:
+        try:
+            if control_kind == "lineart_anime":
+                lad = annotators.get("lineart_anime")
+                ctrl = lad(im, detect_resolution=detect_res, image_resolution=max(im.size))
+                return to_white_bg_black_lines(ctrl)
+            if control_kind == "softedge" or (control_kind == "canny" and cv2 is None):
+                hed = annotators.get("hed")
+                return to_white_bg_black_lines(hed(im))
+            if control_kind == "canny":
+                g = cv2.cvtColor(np.array(im), cv2.COLOR_RGB2GRAY)
                 edges = cv2.Canny(g, 80, 160)
-                ctrl = Image.fromarray(edges)
-                ctrl = to_white_bg_black_lines(ctrl)
-        else:
-            ctrl = None
-    except Exception as e:
-        print(f"[warn] controlnet_aux failed for {control_kind}: {e}")
-        ctrl = None
+                return to_white_bg_black_lines(Image.fromarray(edges))
+        except Exception as e:
+            print(f"[warn] controlnet_aux failed for {control_kind}: {e}")
+        return None
+
+    if control_kind not in {"lineart_anime", "softedge", "canny"}:
+        return None
+    if control_kind == "lineart_anime":
+        ctrl = control_cache.cached_map("lineart_anime", init_image, build, detect_res=detect_res, source=source)
+    elif control_kind == "softedge" or cv2 is None:
+        ctrl = control_cache.cached_map("hed", init_image, build, detect_res=512, source=source)
+    else:
+        ctrl = control_cache.cached_map("canny", init_image, build, source=source, exact_size=True)
 
+    # I upsample (or shrink) a reused map to this render's size.
     if ctrl is not None:
         ctrl = ctrl.resize(init_image.size, Image.LANCZOS)
     return ctrl
@@ -161,7 +173,7 @@ def parse_seed_list(s: Optional[str]) -> List[Optional[int]]:
         out.append(None if part == "" or part.lower() == "none" else int(part))
     return out
 
-def main():
+def build_parser() -> argparse.ArgumentParser:
     p = argparse.ArgumentParser("Photo → Anime (SD1.5/SD2.1 + ControlNet)")
     p.add_argument("--input", "-i", required=True)
     p.add_argument("--output", "-o", default="styled.png")
@@ -186,20 +198,18 @@ def main():
     p.add_argument("--no-cuda", action="store_true")
     p.add_argument("--save-control", action="store_true")
     p.add_argument("--fast-detector", action="store_true")
-    args = p.parse_args()
-
-    # Load & resize input
-    src = load_image(args.input)
-    src = resize_max_side(src, args.max_side)
-
-    # Choose base model
-    if args.model == "primary":
-        base = "cag/anything-v3-1"; base_attn = 768
-    elif args.model == "trinart":
-        base = "waifu-diffusion/wd-1-5-beta2"; base_attn = attn_dim_for_base(base)
-    else:
-        base = "runwayml/stable-diffusion-v1-5"; base_attn = 768
-
+    return p
+
+def base_for_model(model: str):
+    # I map the --model choice to a base repo and its cross-attention dim.
+    if model == "primary":
+        return "cag/anything-v3-1", 768
+    if model == "trinart":
+        base = "waifu-diffusion/wd-1-5-beta2"
+        return base, attn_dim_for_base(base)
+    return "runwayml/stable-diffusion-v1-5", 768
+
+def plan_control(src: Image.Image, args, base_attn: int, source: Optional[str] = None):
     # Pick control (AUTO tries lineart → softedge; fast mode flips order)
     requested = args.control
     controlnet_id: Optional[str] = None
@@ -212,7 +222,7 @@ def main():
             plan = ["softedge", "lineart_anime"]
 
         for kind in plan:
-            tmp_control_image = build_control_map(src, kind, fast=args.fast_detector)
+            tmp_control_image = build_control_map(src, kind, fast=args.fast_detector, source=source)
             cov = ink_coverage(tmp_control_image)
             candidate_id = pick_controlnet_repo(kind, base_attn)
             if candidate_id is None:
@@ -237,20 +247,24 @@ def main():
             print("[auto] No suitable control map; proceeding without ControlNet.")
             controlnet_id, control_image, control_scale = None, None, None
 
-    # Build pipeline (I match dtype/device and reuse one pipe for all seeds)
-    torch_dtype = torch.float16 if (torch.cuda.is_available() and not args.no_cuda) else torch.float32
-    device = "cuda" if (torch.cuda.is_available() and not args.no_cuda) else "cpu"
+    stages.note("controlNet", controlnet_id)
+    return controlnet_id, control_image, control_scale
 
+def build_pipeline(base: str, controlnet_id: Optional[str], args, torch_dtype, device: str):
+    # Build pipeline (I match dtype/device and reuse one pipe for all seeds)
+    # LoRA weights are patched into the UNet, so I only share base weights when no LoRA is loaded.
+    lora = args.lora if args.model == "sd15" else None
+    shared = {} if lora else pipeline_cache.shared_modules(base, torch_dtype)
     if controlnet_id:
-        from diffusers import StableDiffusionControlNetImg2ImgPipeline, ControlNetModel
-        controlnet = ControlNetModel.from_pretrained(controlnet_id, torch_dtype=torch_dtype)
+        from diffusers import StableDiffusionControlNetImg2ImgPipeline
+        controlnet = pipeline_cache.controlnet(controlnet_id, torch_dtype)
         pipe = StableDiffusionControlNetImg2ImgPipeline.from_pretrained(
-            base, controlnet=controlnet, torch_dtype=torch_dtype, safety_checker=None, feature_extractor=None
+            base, controlnet=controlnet, torch_dtype=torch_dtype, safety_checker=None, feature_extractor=None, **shared
         )
     else:
         from diffusers import StableDiffusionImg2ImgPipeline
         pipe = StableDiffusionImg2ImgPipeline.from_pretrained(
-            base, torch_dtype=torch_dtype, safety_checker=None, feature_extractor=None
+            base, torch_dtype=torch_dtype, safety_checker=None, feature_extractor=None, **shared
         )
 
     ensure_compat(pipe)
@@ -266,39 +280,136 @@ def main():
     pipe.set_progress_bar_config(disable=True)
 
     # Optional LoRA for sd15
-    if args.model == "sd15" and args.lora:
+    if lora:
         try:
-            print(f"[info] Loading LoRA: {args.lora}")
-            pipe.load_lora_weights(args.lora)
+            print(f"[info] Loading LoRA: {lora}")
+            pipe.load_lora_weights(lora)
         except Exception as e:
-            print(f"[warn] Failed to load LoRA ({args.lora}): {e}")
+            print(f"[warn] Failed to load LoRA ({lora}): {e}")
 
     # Scheduler choice
     from diffusers import UniPCMultistepScheduler
     pipe.scheduler = UniPCMultistepScheduler.from_config(pipe.scheduler.config)
-
-    # Prompts (kept simple and safe for portraits)
-    positive_prompt = (
-        "masterpiece, best quality, anime illustration, clean bold lineart, cel shading, vivid colors, "
-        "detailed anime eyes, smooth skin, studio portrait, soft background"
-    )
-    negative_prompt = (
-        "lowres, blurry, bad anatomy, bad hands, extra fingers, text, watermark, "
-        "photorealistic, photo, 3d, cgi, monochrome, grayscale, oversharp, noise"
-    )
-
-    # Common kwargs passed to the pipeline
-    common_kwargs = dict(
-        prompt=positive_prompt,
-        negative_prompt=negative_prompt,
-        image=src,
+    return pipe
+
+# Prompts (kept simple and safe for portraits)
+POSITIVE_PROMPT = (
+    "masterpiece, best quality, anime illustration, clean bold lineart, cel shading, vivid colors, "
+    "detailed anime eyes, smooth skin, studio portrait, soft background"
+)
+NEGATIVE_PROMPT = (
+    "lowres, blurry, bad anatomy, bad hands, extra fingers, text, watermark, "
+    "photorealistic, photo, 3d, cgi, monochrome, grayscale, oversharp, noise"
+)
+
+def render_batch(pipe, srcs: List[Image.Image], args, control_images, control_scale, seeds: List[Optional[int]],
+                 device: str, use_autocast: bool) -> List[Image.Image]:
+    # I render same-size images in one pipeline call; each item keeps its own generator.
+    n = len(srcs)
+    kwargs = dict(
+        prompt=[POSITIVE_PROMPT] * n,
+        negative_prompt=[NEGATIVE_PROMPT] * n,
+        image=srcs,
         strength=float(args.strength),
         guidance_scale=float(args.guidance),
         num_inference_steps=int(args.steps),
     )
-    if controlnet_id and control_image is not None:
-        common_kwargs["control_image"] = control_image
-        common_kwargs["controlnet_conditioning_scale"] = control_scale
+    if control_images is not None:
+        kwargs["control_image"] = control_images
+        kwargs["controlnet_conditioning_scale"] = control_scale
+    # diffusers wants all generators or none, so unseeded items in a mixed batch get a random seed.
+    if any(s is not None for s in seeds):
+        seeds = [int(s) if s is not None else int(np.random.randint(0, 2**31 - 1)) for s in seeds]
+        kwargs["generator"] = [torch.Generator(device=device).manual_seed(s) for s in seeds]
+    else:
+        kwargs["generator"] = None
+    kwargs.update(step_hooks.pipe_kwargs())
+
+    with torch.inference_mode():
+        if use_autocast:
+            with torch.autocast(device_type="cuda", dtype=torch.float16):
+                outs = pipe(**kwargs).images
+        else:
+            outs = pipe(**kwargs).images
+
+    # I lightly sharpen the result to restore micro-contrast (postfx.anime).
+    return [postfx.anime(out) for out in outs]
+
+def render(pipe, src: Image.Image, args, control_image, control_scale, seed: Optional[int], device: str, use_autocast: bool) -> Image.Image:
+    return render_batch(pipe, [src], args, None if control_image is None else [control_image],
+                        control_scale, [seed], device, use_autocast)[0]
+
+def _runtime(args):
+    # I match dtype/device to what is available.
+    torch_dtype = torch.float16 if (torch.cuda.is_available() and not args.no_cuda) else torch.float32
+    device = "cuda" if (torch.cuda.is_available() and not args.no_cuda) else "cpu"
+    return torch_dtype, device
+
+def _pipe_key(base, controlnet_id, args, torch_dtype, device):
+    return ("anime", base, controlnet_id, args.lora if args.model == "sd15" else None, str(torch_dtype), device)
+
+def stylize_batch(images: List[Image.Image], args_list) -> List[Image.Image]:
+    """
+    I render several images, one seed each (args.seed), sharing pipeline calls where I can.
+    All `args_list` entries must share the same flags except --seed. The control plan is
+    decided per image, so I sub-batch by (size, ControlNet, control scale).
+    """
+    args = args_list[0]
+    base, base_attn = base_for_model(args.model)
+    torch_dtype, device = _runtime(args)
+    use_autocast = (device == "cuda" and torch_dtype == torch.float16)
+
+    groups = {}
+    for i, im in enumerate(images):
+        # I key control maps on the photo as received, so preview and full share them.
+        key = control_cache.source_key(im)
+        src = resize_max_side(im.convert("RGB"), args.max_side)
+        controlnet_id, control_image, control_scale = plan_control(src, args, base_attn, source=key)
+        groups.setdefault((src.size, controlnet_id, control_scale), []).append((i, src, control_image))
+
+    outs = [None] * len(images)
+    for (_, controlnet_id, control_scale), items in groups.items():
+        seeds = [args_list[i].seed for i, _, _ in items]
+        print(
+            f"Running… base={base} control={controlnet_id or 'none'} "
+            f"strength={args.strength} cfg={args.guidance} c-scale={control_scale} "
+            f"max-side={args.max_side} seeds={seeds}"
+        )
+        key = _pipe_key(base, controlnet_id, args, torch_dtype, device)
+        with pipeline_cache.use(key, lambda: build_pipeline(base, controlnet_id, args, torch_dtype, device)) as pipe:
+            rendered = render_batch(pipe, [src for _, src, _ in items], args,
+                                    [c for _, _, c in items] if controlnet_id else None,
+                                    control_scale, seeds, device, use_autocast)
+        for (i, _, _), img in zip(items, rendered):
+            outs[i] = img
+    return outs
+
+# Annotators my control builders may use; long-lived callers warm them up front.
+ANNOTATORS = ("lineart_anime", "hed")
+
+def warm() -> dict:
+    # I load my annotators now so the first request doesn't pay for it (backend preload / worker "warm").
+    return {"annotators": annotators.preload(ANNOTATORS)}
+
+def stylize_image(src: Image.Image, args) -> Image.Image:
+    # I render a single seed (args.seed) on an already-loaded image; in-process callers use this.
+    return stylize_batch([src], [args])[0]
+
+def main():
+    if "--serve" in sys.argv[1:]:
+        # I stay alive and take jobs over stdin/stdout (see worker_serve.py).
+        return worker_serve.serve(build_parser, stylize_image, warm=warm)
+    args = build_parser().parse_args()
+
+    # Load & resize input
+    src = load_image(args.input)
+    src = resize_max_side(src, args.max_side)
+
+    # Choose base model
+    base, base_attn = base_for_model(args.model)
+
+    controlnet_id, control_image, control_scale = plan_control(src, args, base_attn)
+    torch_dtype, device = _runtime(args)
 
     # Seed handling (single or batched)
     seed_list = parse_seed_list(args.seeds) if args.seeds else [args.seed]
@@ -314,35 +425,26 @@ def main():
 
     # Inference loop
     use_autocast = (device == "cuda" and torch_dtype == torch.float16)
-    for s in seed_list:
-        generator = None if s is None else torch.Generator(device=device).manual_seed(int(s))
-        kwargs = dict(common_kwargs)
-        kwargs["generator"] = generator
-
-        out_path = out_name_for(s)
-        print(
-            f"Running… base={base} control={controlnet_id or 'none'} "
-            f"strength={args.strength} cfg={args.guidance} c-scale={control_scale} "
-            f"max-side={args.max_side} seed={s} → {out_path}"
-        )
-
-        with torch.inference_mode():
-            if use_autocast:
-                with torch.autocast(device_type="cuda", dtype=torch.float16):
-                    out = pipe(**kwargs).images[0]
-            else:
-                out = pipe(**kwargs).images[0]
-
-        # I lightly sharpen the result to restore micro-contrast.
-        out = out.filter(ImageFilter.UnsharpMask(radius=1, percent=120, threshold=8))
-
-        Path(out_path).parent.mkdir(parents=True, exist_ok=True)
-        out.save(out_path)
-        if args.save_control and control_image is not None:
-            ctl_path = Path(out_path).with_name(Path(out_path).stem + "_control.png")
-            control_image.save(ctl_path)
-
-        print(f"✅ Saved: {out_path}")
+    key = _pipe_key(base, controlnet_id, args, torch_dtype, device)
+    with pipeline_cache.use(key, lambda: build_pipeline(base, controlnet_id, args, torch_dtype, device)) as pipe:
+        for s in seed_list:
+            out_path = out_name_for(s)
+            print(
+                f"Running… base={base} control={controlnet_id or 'none'} "
+                f"strength={args.strength} cfg={args.guidance} c-scale={control_scale} "
+                f"max-side={args.max_side} seed={s} → {out_path}"
+            )
+
+            out = render(pipe, src, args, control_image if controlnet_id else None, control_scale, s, device, use_autocast)
+
+            Path(out_path).parent.mkdir(parents=True, exist_ok=True)
+            with stages.stage("save"):
+                out.save(out_path)
+                if args.save_control and control_image is not None:
+                    ctl_path = Path(out_path).with_name(Path(out_path).stem + "_control.png")
+                    control_image.save(ctl_path)
+
+            print(f"✅ Saved: {out_path}")
 
 if __name__ == "__main__":
     main()
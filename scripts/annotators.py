@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# I load each ControlNet annotator (HED, MiDaS, anime lineart) once per process and hand
+# out the same instance afterwards. The control builders used to call
+# `XDetector.from_pretrained(...)` on every run, which re-read the weights every time.
+#
+# `preload(names)` lets the backend warm them at startup; `status()` reports which ones
+# are resident and how long each took to load.
+
+import time, importlib, threading
+
+REPO = "lllyasviel/Annotators"
+
+# name -> (module, class) in controlnet_aux
+SPECS = {
+    "hed": ("controlnet_aux.hed", "HEDdetector"),
+    "midas": ("controlnet_aux.midas", "MidasDetector"),
+    "lineart_anime": ("controlnet_aux.lineart_anime", "LineartAnimeDetector"),
+}
+
+_DETECTORS = {}
+_LOAD_MS = {}
+_ERRORS = {}
+_LOCKS = {name: threading.Lock() for name in SPECS}
+
+
+def get(name: str):
+    """I return the loaded detector `name`, loading it on first use. Load errors propagate."""
+    det = _DETECTORS.get(name)
+    if det is not None:
+        return det
+    with _LOCKS[name]:
+        det = _DETECTORS.get(name)
+        if det is None:
+            module, cls = SPECS[name]
+            t0 = time.perf_counter()
+            try:
+                det = getattr(importlib.import_module(module), cls).from_pretrained(REPO)
+            except Exception as e:
+                _ERRORS[name] = f"{type(e).__name__}: {e}"
+                raise
+            _LOAD_MS[name] = int((time.perf_counter() - t0) * 1000)
+            _ERRORS.pop(name, None)
+            _DETECTORS[name] = det
+    return det
+
+
+def preload(names) -> dict:
+    # I never raise here: a missing annotator only means its control mode degrades later.
+    for name in names:
+        try:
+            get(name)
+        except Exception as e:
+            print(f"[warn] annotator {name} failed to preload: {e}")
+    return {name: status()[name] for name in names}
+
+
+def status() -> dict:
+    return {
+        name: {"loaded": name in _DETECTORS, "loadMs": _LOAD_MS.get(name), "error": _ERRORS.get(name)}
+        for name in SPECS
+    }
@@ -2,13 +2,21 @@
 # -*- coding: utf-8 -*-
 # I turn photos into a teal–orange “cinematic” look (SD1.5 + ControlNet). I keep comments short.
 
-import os, argparse, warnings
+import os, sys, argparse, warnings
 from pathlib import Path
-import numpy as np
-from PIL import Image, ImageFilter, ImageOps
+from typing import List
+from PIL import Image, ImageOps
 
 import torch
-from diffusers import StableDiffusionControlNetImg2ImgPipeline, ControlNetModel, UniPCMultistepScheduler
+from diffusers import StableDiffusionControlNetImg2ImgPipeline, UniPCMultistepScheduler
+
+import pipeline_cache
+import control_cache
+import annotators
+import worker_serve
+import step_hooks
+import stages
+import postfx
 
 warnings.filterwarnings("ignore", category=UserWarning)
 
@@ -18,6 +26,7 @@ def load_image(path: str) -> Image.Image:
     # I always work in RGB.
     return Image.open(path).convert("RGB")
 
+@stages.timed("resize")
 def resize_max_side(img: Image.Image, max_side=1280) -> Image.Image:
     # I keep aspect ratio and snap sizes to /8 so SD runs cleanly.
     w, h = img.size
@@ -33,160 +42,39 @@ def ensure_dir(p: Path):
     # I make sure the output folder exists.
     p.parent.mkdir(parents=True, exist_ok=True)
 
-def to_np(img: Image.Image) -> np.ndarray:
-    return np.asarray(img).astype(np.float32) / 255.0
-
-def to_pil(arr: np.ndarray) -> Image.Image:
-    return Image.fromarray(np.clip(arr * 255.0, 0, 255).astype(np.uint8))
-
 # ---------------- Annotators ----------------
 
-def control_image_softedge(img: Image.Image) -> Image.Image|None:
-    # I prefer HED edges for portraits.
-    try:
-        from controlnet_aux.hed import HEDdetector
-        hed = HEDdetector.from_pretrained("lllyasviel/Annotators")
-        e = hed(img)
-        return e.convert("RGB")
-    except Exception as e:
-        print(f"[warn] softedge annotator unavailable: {e}")
-        return None
-
-def control_image_depth(img: Image.Image) -> Image.Image|None:
+def control_image_softedge(img: Image.Image, source: str|None = None) -> Image.Image|None:
+    # I prefer HED edges for portraits. Maps are cached per photo (see control_cache.py).
+    def build(im):
+        try:
+            hed = annotators.get("hed")
+            e = hed(im)
+            return e.convert("RGB")
+        except Exception as e:
+            print(f"[warn] softedge annotator unavailable: {e}")
+            return None
+    return control_cache.cached_map("hed", img, build, detect_res=512, source=source)
+
+def control_image_depth(img: Image.Image, source: str|None = None) -> Image.Image|None:
     # I use depth for scenes to guide structure.
-    try:
-        from controlnet_aux.midas import MidasDetector
-        midas = MidasDetector.from_pretrained("lllyasviel/Annotators")
-        dep = midas(img)
-        return ImageOps.autocontrast(dep).convert("RGB")
-    except Exception as e:
-        print(f"[warn] depth annotator unavailable: {e}")
-        return None
-
-# ---------------- Utility ----------------
-
-def luminance(arr: np.ndarray) -> np.ndarray:
-    return 0.2126*arr[...,0] + 0.7152*arr[...,1] + 0.0722*arr[...,2]
-
-def sigmoid(x, k=10.0, x0=0.5):
-    return 1.0/(1.0 + np.exp(-k*(x - x0)))
-
-def saturate_pil(pil: Image.Image, sat_scale: float) -> Image.Image:
-    # I nudge saturation at the end to keep colors lively.
-    if abs(sat_scale - 1.0) < 1e-3:
-        return pil
-    hsv = pil.convert("HSV")
-    h, s, v = hsv.split()
-    s_np = np.array(s, dtype=np.float32)
-    s_np = np.clip(s_np * sat_scale, 0, 255).astype(np.uint8)
-    hsv = Image.merge("HSV", (h, Image.fromarray(s_np), v))
-    return hsv.convert("RGB")
-
-# ---------------- Refined dual-mode grade ----------------
-
-def grade_v5(
-    img: Image.Image,
-    subject: str = "scene",
-    tone_mix: float | None = None,
-    bloom: float | None = None,
-    contrast: float | None = None,
-    skin_suppress: float | None = None,
-    saturation: float = 1.05,
-    add_dither: bool = True,
-) -> Image.Image:
-    # I do the teal–orange grade in numpy, with different settings for scene vs portrait.
-    a = to_np(img)
-    base = a.copy()
-    h, w, _ = a.shape
-    lum = luminance(a)
-
-    if subject == "portrait":
-        tone_mix = 0.22 if tone_mix is None else tone_mix
-        bloom = 0.22 if bloom is None else bloom
-        contrast = 0.18 if contrast is None else contrast
-        skin_suppress = 0.80 if skin_suppress is None else skin_suppress
-        shadow_w = sigmoid(0.35 - lum, k=12.0, x0=0.0)
-        highlight_w = sigmoid(lum - 0.60, k=10.0, x0=0.0)
-    else:
-        tone_mix = 0.40 if tone_mix is None else tone_mix
-        bloom = 0.42 if bloom is None else bloom
-        contrast = 0.24 if contrast is None else contrast
-        skin_suppress = 0.85 if skin_suppress is None else skin_suppress
-        shadow_w = sigmoid(0.50 - lum, k=12.0, x0=0.0)
-        highlight_w = sigmoid(lum - 0.55, k=12.0, x0=0.0)
-
-    shadow_w = shadow_w[...,None].astype(np.float32)
-    highlight_w = highlight_w[...,None].astype(np.float32)
-
-    # I push teal in shadows and orange in highlights.
-    if subject == "scene":
-        teal_vec   = np.array([0.02, 0.58, 1.00], dtype=np.float32)
-        orange_vec = np.array([1.05, 0.70, 0.05], dtype=np.float32)
-    else:
-        teal_vec   = np.array([0.02, 0.55, 0.95], dtype=np.float32)
-        orange_vec = np.array([1.00, 0.62, 0.07], dtype=np.float32)
-
-    teal_field = teal_vec[None,None,:] * shadow_w
-    orange_field = orange_vec[None,None,:] * highlight_w
-    mask = np.clip(shadow_w + highlight_w, 0.0, 1.0)
-    a = np.clip(a*(1.0 - tone_mix*mask) + tone_mix*(teal_field + orange_field), 0.0, 1.0)
-
-    # I warm midtones for scenes.
-    if subject == "scene":
-        mid = np.clip((lum - 0.45)/0.20, 0.0, 1.0) * np.clip((0.65 - lum)/0.20, 0.0, 1.0)
-        mid = (mid * 0.06)[...,None]
-        a[...,0] += mid[...,0]
-        a[...,1] += (mid[...,0] * 0.5)
-
-    # I protect skin for portraits.
-    if subject == "portrait":
-        r, g, b = a[...,0], a[...,1], a[...,2]
-        skin = (r > g) & (r > b) & (r > 0.30) & (lum > 0.20) & (lum < 0.90)
-        if skin.any():
-            try:
-                from scipy.ndimage import uniform_filter
-                m = uniform_filter(skin.astype(np.float32), size=5)
-            except Exception:
-                m = skin.astype(np.float32)
-            m = m[...,None]
-            a = a*(1.0 - 0.40*m*skin_suppress) + base*(0.40*m*skin_suppress)
-            mid_skin = ((lum > 0.35) & (lum < 0.65))[...,None].astype(np.float32) * m
-            a[...,0] += 0.10 * mid_skin[...,0]
-            a[...,1] += 0.05 * mid_skin[...,0]
-
-    if contrast and contrast > 0.0:
-        a = np.clip((a - 0.5) * (1.0 + 1.8*contrast) + 0.5, 0.0, 1.0)
-
-    if bloom and bloom > 0.0:
-        # I add soft glow on bright regions.
+    def build(im):
         try:
-            from scipy.ndimage import gaussian_filter
-            thr = np.clip((lum - 0.60)/0.40, 0.0, 1.0)[...,None]
-            glow = gaussian_filter(a*thr, sigma=(6.0,6.0,0.0))
-            a = np.clip(a + bloom*glow, 0.0, 1.0)
-        except Exception:
-            pass
-
-    out = to_pil(a).filter(ImageFilter.UnsharpMask(radius=1, percent=115, threshold=5))
-    out = saturate_pil(out, saturation)
-
-    if add_dither:
-        # I add tiny ordered dither to fight banding.
-        arr = to_np(out); h, w, _ = arr.shape
-        yy, xx = np.mgrid[0:h, 0:w]
-        bayer = ((xx & 1) + ((yy & 1) << 1)) / 4.0 - 0.375
-        arr += (1.0/255.0)*bayer[...,None]
-        out = to_pil(np.clip(arr, 0.0, 1.0))
-
-    return out
+            midas = annotators.get("midas")
+            dep = midas(im)
+            return ImageOps.autocontrast(dep).convert("RGB")
+        except Exception as e:
+            print(f"[warn] depth annotator unavailable: {e}")
+            return None
+    return control_cache.cached_map("midas", img, build, detect_res=512, source=source)
 
 # ---------------- Runner ----------------
 
 def run(
     model_id: str,
     device: str,
-    src: Image.Image,
-    control_img: Image.Image,
+    srcs: List[Image.Image],
+    control_imgs: List[Image.Image],
     controlnet_id: str,
     prompt: str,
     negative_prompt: str,
@@ -194,46 +82,47 @@ def run(
     guidance: float,
     strength: float,
     control_scale: float,
-    seed: int,
-):
-    # I set up the SD+ControlNet pipeline and render one image.
-    if control_img.size != src.size:
-        control_img = control_img.resize(src.size, Image.LANCZOS)
-
-    controlnet = ControlNetModel.from_pretrained(
-        controlnet_id,
-        torch_dtype=torch.float16 if "cuda" in device else torch.float32
-    )
-    pipe = StableDiffusionControlNetImg2ImgPipeline.from_pretrained(
-        model_id,
-        controlnet=controlnet,
-        torch_dtype=torch.float16 if "cuda" in device else torch.float32,
-        safety_checker=None,
-    )
-    pipe.scheduler = UniPCMultistepScheduler.from_config(pipe.scheduler.config)
-    try:
-        pipe.enable_xformers_memory_efficient_attention()
-    except Exception:
-        pass
-    pipe = pipe.to(device)
-
-    generator = torch.Generator(device=device).manual_seed(seed)
-    result = pipe(
-        prompt=prompt,
-        image=src,
-        control_image=control_img,
-        controlnet_conditioning_scale=float(control_scale),
-        negative_prompt=negative_prompt,
-        guidance_scale=guidance,
-        strength=strength,
-        num_inference_steps=steps,
-        generator=generator,
-    ).images[0]
+    seeds: List[int],
+) -> List[Image.Image]:
+    # I set up the SD+ControlNet pipeline (once per process) and render a same-size batch in one call.
+    control_imgs = [c if c.size == s.size else c.resize(s.size, Image.LANCZOS) for s, c in zip(srcs, control_imgs)]
+    n = len(srcs)
+
+    def build():
+        dtype = torch.float16 if "cuda" in device else torch.float32
+        pipe = StableDiffusionControlNetImg2ImgPipeline.from_pretrained(
+            model_id,
+            controlnet=pipeline_cache.controlnet(controlnet_id, dtype),
+            torch_dtype=dtype,
+            safety_checker=None,
+            **pipeline_cache.shared_modules(model_id, dtype),
+        )
+        pipe.scheduler = UniPCMultistepScheduler.from_config(pipe.scheduler.config)
+        try:
+            pipe.enable_xformers_memory_efficient_attention()
+        except Exception:
+            pass
+        return pipe.to(device)
+
+    with pipeline_cache.use(("cinematic", model_id, controlnet_id, device), build) as pipe:
+        generators = [torch.Generator(device=device).manual_seed(seed) for seed in seeds]
+        result = pipe(
+            prompt=[prompt] * n,
+            image=srcs,
+            control_image=control_imgs,
+            controlnet_conditioning_scale=float(control_scale),
+            negative_prompt=[negative_prompt] * n,
+            guidance_scale=guidance,
+            strength=strength,
+            num_inference_steps=steps,
+            generator=generators,
+            **step_hooks.pipe_kwargs(),
+        ).images
     return result
 
 # ---------------- CLI ----------------
 
-def main():
+def build_parser() -> argparse.ArgumentParser:
     # I expose simple flags; I tune defaults per subject.
     p = argparse.ArgumentParser("Cinematic Teal–Orange v5 (refined)", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     p.add_argument("-i","--input", required=True)
@@ -256,59 +145,107 @@ def main():
     p.add_argument("--saturation", type=float, default=1.05, help="Final saturation multiplier (HSV S channel)")
     p.add_argument("--no-dither", action="store_true")
     p.add_argument("--low-vram", action="store_true")
+    return p
 
-    args = p.parse_args()
-
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    src = resize_max_side(load_image(args.input), args.max_side)
-
-    # I pick annotator + ControlNet family based on subject.
+def apply_subject_defaults(args) -> str:
+    # I tune the knobs per subject and return the ControlNet family it uses.
     if args.subject == "portrait":
         args.steps = max(args.steps, 34)
         args.guidance = max(args.guidance, 6.2)
         args.strength = min(args.strength, 0.26)
         args.control_scale = min(max(args.control_scale, 0.24), 0.40)
-        cimg = control_image_softedge(src); controlnet_id = "lllyasviel/sd-controlnet-hed"
-    else:
-        args.steps = max(args.steps, 36)
-        args.guidance = max(args.guidance, 6.6)
-        args.strength = min(args.strength, 0.42)
-        args.control_scale = min(max(args.control_scale, 0.42), 0.55)
-        cimg = control_image_depth(src); controlnet_id = "lllyasviel/sd-controlnet-depth"
-
-    if cimg is None:
-        print("[warn] Annotator missing — using RGB image as weak control.")
-        cimg = src
-
-    out = run(
-        model_id=args.model,
-        device=device,
-        src=src,
-        control_img=cimg,
-        controlnet_id=controlnet_id,
-        prompt=args.prompt,
-        negative_prompt=args.negative_prompt,
-        steps=args.steps,
-        guidance=args.guidance,
-        strength=args.strength,
-        control_scale=args.control_scale,
-        seed=args.seed,
-    )
+        return "lllyasviel/sd-controlnet-hed"
+    args.steps = max(args.steps, 36)
+    args.guidance = max(args.guidance, 6.6)
+    args.strength = min(args.strength, 0.42)
+    args.control_scale = min(max(args.control_scale, 0.42), 0.55)
+    return "lllyasviel/sd-controlnet-depth"
+
+def stylize_batch(images: List[Image.Image], args_list) -> List[Image.Image]:
+    """
+    I run annotator + SD + grade for several images at once. All `args_list` entries must
+    share the same flags except --seed; images that resize to different sizes are run as
+    separate sub-batches.
+    """
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    for a in args_list:
+        controlnet_id = apply_subject_defaults(a)
+    stages.note("controlNet", controlnet_id)
+    args = args_list[0]
+    # I key control maps on the photo as received, so preview and full share them.
+    keys = [control_cache.source_key(im) for im in images]
+    srcs = [resize_max_side(im.convert("RGB"), args.max_side) for im in images]
+
+    # I pick annotator based on subject.
+    cimgs = []
+    for src, key in zip(srcs, keys):
+        if args.subject == "portrait":
+            cimg = control_image_softedge(src, source=key)
+        else:
+            cimg = control_image_depth(src, source=key)
+        if cimg is None:
+            print("[warn] Annotator missing — using RGB image as weak control.")
+            cimg = src
+        cimgs.append(cimg)
+
+    groups = {}
+    for i, src in enumerate(srcs):
+        groups.setdefault(src.size, []).append(i)
+    outs = [None] * len(srcs)
+    for idx in groups.values():
+        rendered = run(
+            model_id=args.model,
+            device=device,
+            srcs=[srcs[i] for i in idx],
+            control_imgs=[cimgs[i] for i in idx],
+            controlnet_id=controlnet_id,
+            prompt=args.prompt,
+            negative_prompt=args.negative_prompt,
+            steps=args.steps,
+            guidance=args.guidance,
+            strength=args.strength,
+            control_scale=args.control_scale,
+            seeds=[args_list[i].seed for i in idx],
+        )
+        for i, img in zip(idx, rendered):
+            outs[i] = img
+
+    # I apply the color grade and its finishing (postfx.cinematic).
+    return [
+        postfx.cinematic(
+            out,
+            subject=args.subject,
+            tone_mix=args.tone_mix,
+            bloom=args.bloom,
+            contrast=args.contrast,
+            skin_suppress=args.skin_suppress,
+            saturation=args.saturation,
+            add_dither=not args.no_dither,
+        )
+        for out in outs
+    ]
+
+# Annotators my control builders may use; long-lived callers warm them up front.
+ANNOTATORS = ("hed", "midas")
+
+def warm() -> dict:
+    # I load my annotators now so the first request doesn't pay for it (backend preload / worker "warm").
+    return {"annotators": annotators.preload(ANNOTATORS)}
+
+def stylize_image(src: Image.Image, args) -> Image.Image:
+    # I run annotator + SD + grade on an already-loaded image (shared by the CLI and in-process callers).
+    return stylize_batch([src], [args])[0]
 
-    # I apply the color grade and a tiny sharpen.
-    graded = grade_v5(
-        out,
-        subject=args.subject,
-        tone_mix=args.tone_mix,
-        bloom=args.bloom,
-        contrast=args.contrast,
-        skin_suppress=args.skin_suppress,
-        saturation=args.saturation,
-        add_dither=not args.no_dither,
-    ).filter(ImageFilter.UnsharpMask(radius=1, percent=115, threshold=5))
+def main():
+    if "--serve" in sys.argv[1:]:
+        # I stay alive and take jobs over stdin/stdout (see worker_serve.py).
+        return worker_serve.serve(build_parser, stylize_image, warm=warm)
+    args = build_parser().parse_args()
+    graded = stylize_image(load_image(args.input), args)
 
     ensure_dir(Path(args.output))
-    graded.save(args.output)
+    with stages.stage("save"):
+        graded.save(args.output)
     print(f"✅ Saved: {args.output}")
 
 if __name__ == "__main__":
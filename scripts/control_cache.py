@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# I keep recent ControlNet annotator maps (HED, MiDaS depth, lineart, canny) in memory,
+# so a full render reuses the map its preview already computed for the same photo.
+#
+# Key = (source image hash, detector kind, detect resolution[, target size]).
+# - The source hash is taken from the image *before* the script resizes it for --max-side,
+#   so preview (768) and full (1280) runs of one photo share it.
+# - HED/MiDaS/lineart detect at a fixed resolution and their maps are resized to the
+#   render size afterwards anyway, so one cached map serves every render size.
+# - Canny runs at full resolution and thin edges don't survive upsampling, so canny
+#   maps are cached per target size (`exact_size=True`); it's cheap to recompute anyway.
+#
+# Only useful where the process lives on (resident/worker mode); a one-shot CLI run
+# just fills it and exits. ARTIFY_CONTROL_CACHE sets how many maps I keep (default 32, 0 = off).
+# Each lookup also counts as a "controlMapHits" or "controlMapMisses" note on the run (scripts/stages.py).
+
+import os, time, hashlib, threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from PIL import Image
+
+import stages
+
+_MAPS: "OrderedDict[tuple, Image.Image]" = OrderedDict()
+_LOCK = threading.Lock()
+_STATS = {"hits": 0, "misses": 0, "build_ms": 0}
+
+
+def _capacity() -> int:
+    try:
+        return max(0, int(os.environ.get("ARTIFY_CONTROL_CACHE", "32")))
+    except ValueError:
+        return 32
+
+
+def source_key(img: Image.Image) -> str:
+    # I hash decoded pixels, so the same photo matches however it was encoded.
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{img.mode}:{img.size[0]}x{img.size[1]}:".encode("ascii"))
+    h.update(img.tobytes())
+    return h.hexdigest()
+
+
+def cached_map(kind: str, img: Image.Image, build: Callable[[Image.Image], Optional[Image.Image]],
+               detect_res: Optional[int] = None, source: Optional[str] = None,
+               exact_size: bool = False) -> Optional[Image.Image]:
+    """
+    I return the control map for `img`, building it with `build(img)` only on a miss.
+    `source` is the key of the un-resized input (defaults to hashing `img` itself).
+    Failed builds (None) aren't cached, so a missing annotator is retried next time.
+    """
+    cap = _capacity()
+    if cap == 0:
+        stages.count("controlMapMisses")
+        with stages.stage("annotator"):
+            return build(img)
+    key = (source or source_key(img), kind, detect_res, img.size if exact_size else None)
+    with _LOCK:
+        hit = _MAPS.get(key)
+        if hit is not None:
+            _MAPS.move_to_end(key)
+            _STATS["hits"] += 1
+            stages.count("controlMapHits")
+            return hit.copy()
+
+    stages.count("controlMapMisses")
+    t0 = time.perf_counter()
+    with stages.stage("annotator"):
+        ctrl = build(img)
+    if ctrl is None:
+        return None
+    with _LOCK:
+        _STATS["misses"] += 1
+        _STATS["build_ms"] += int((time.perf_counter() - t0) * 1000)
+        _MAPS[key] = ctrl.copy()
+        while len(_MAPS) > cap:
+            _MAPS.popitem(last=False)
+    return ctrl
+
+
+def status() -> dict:
+    with _LOCK:
+        return {"entries": len(_MAPS), **_STATS}
+
+
+def clear() -> None:
+    with _LOCK:
+        _MAPS.clear()
@@ -16,17 +16,26 @@ from diffusers import (
     StableDiffusionImg2ImgPipeline,
     StableDiffusionInpaintPipeline,
     StableDiffusionControlNetImg2ImgPipeline,
-    ControlNetModel,
     UniPCMultistepScheduler,
     DPMSolverMultistepScheduler,
 )
 import torch
 
+import pipeline_cache
+import control_cache
+import annotators
+import worker_serve
+import step_hooks
+import stages
+from grading import gaussian_blur_keepdims, skin_mask
+import postfx
+
 # ---------- utils ----------
 def load_image(path: str) -> Image.Image:
     # I always load as RGB.
     return Image.open(path).convert("RGB")
 
+@stages.timed("resize")
 def resize_max_side(img: Image.Image, max_side=896) -> Image.Image:
     # I keep aspect ratio and cap the longest side.
     w, h = img.size
@@ -50,19 +59,6 @@ def force_multiple_of_8(pil_img: Image.Image) -> Image.Image:
         pil_img = pil_img.resize((max(8, w2), max(8, h2)), Image.LANCZOS)
     return pil_img
 
-def to_3c(x: np.ndarray) -> np.ndarray:
-    # I expand gray arrays to 3 channels.
-    if x.ndim == 2: return np.repeat(x[..., None], 3, axis=2)
-    if x.ndim == 3 and x.shape[2] == 1: return np.repeat(x, 3, axis=2)
-    return x
-
-def gaussian_blur_keepdims(x: np.ndarray, sigma: float) -> np.ndarray:
-    # I blur without changing shape.
-    import cv2
-    y = cv2.GaussianBlur(x, (0,0), sigma)
-    if y.ndim == 2: y = y[..., None]
-    return y.astype(np.float32)
-
 def collage_hstack(imgs, pad=8):
     # I tile multiple style refs side by side (nice for IP-Adapter).
     if not imgs: return None
@@ -112,38 +108,50 @@ def invert_mask(m: Image.Image) -> Image.Image:
     return ImageOps.invert(m)
 
 # ----------- Control builders -----------
-def control_image_softedge(img: Image.Image) -> Image.Image|None:
-    # I prefer HED for people/background edges.
-    try:
-        from controlnet_aux.hed import HEDdetector
-        hed = HEDdetector.from_pretrained("lllyasviel/Annotators")
-        hed_img = hed(img)
-        return ImageOps.autocontrast(hed_img).convert("RGB")
-    except Exception as e:
-        print(f"[warn] HED annotator unavailable: {e}")
-        return None
-
-def control_image_depth(img: Image.Image) -> Image.Image|None:
+def control_image_softedge(img: Image.Image, source: str|None = None) -> Image.Image|None:
+    # I prefer HED for people/background edges. Maps are cached per photo (see control_cache.py).
+    def build(im):
+        try:
+            hed = annotators.get("hed")
+            hed_img = hed(im)
+            return ImageOps.autocontrast(hed_img).convert("RGB")
+        except Exception as e:
+            print(f"[warn] HED annotator unavailable: {e}")
+            return None
+    return control_cache.cached_map("hed", img, build, detect_res=512, source=source)
+
+def control_image_depth(img: Image.Image, source: str|None = None) -> Image.Image|None:
     # I use depth for scene structure.
-    try:
-        from controlnet_aux.midas import MidasDetector
-        midas = MidasDetector.from_pretrained("lllyasviel/Annotators")
-        dep = midas(img)
-        return ImageOps.autocontrast(dep).convert("RGB")
-    except Exception as e:
-        print(f"[warn] MiDaS annotator unavailable: {e}")
-        return None
-
-def control_image_canny(img: Image.Image) -> Image.Image|None:
+    def build(im):
+        try:
+            midas = annotators.get("midas")
+            dep = midas(im)
+            return ImageOps.autocontrast(dep).convert("RGB")
+        except Exception as e:
+            print(f"[warn] MiDaS annotator unavailable: {e}")
+            return None
+    return control_cache.cached_map("midas", img, build, detect_res=512, source=source)
+
+def control_image_canny(img: Image.Image, source: str|None = None) -> Image.Image|None:
     # I fallback to OpenCV canny if needed.
-    try:
-        import cv2
-        g = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2GRAY)
-        e = cv2.Canny(g, 80, 160)
-        return Image.merge("RGB", (Image.fromarray(e),)*3)
-    except Exception as e:
-        print(f"[warn] OpenCV canny failed: {e}")
-        return None
+    def build(im):
+        try:
+            import cv2
+            g = cv2.cvtColor(np.array(im), cv2.COLOR_RGB2GRAY)
+            e = cv2.Canny(g, 80, 160)
+            return Image.merge("RGB", (Image.fromarray(e),)*3)
+        except Exception as e:
+            print(f"[warn] OpenCV canny failed: {e}")
+            return None
+    return control_cache.cached_map("canny", img, build, source=source, exact_size=True)
+
+CONTROL_BUILDERS = {"depth": control_image_depth, "softedge": control_image_softedge, "canny": control_image_canny}
+
+def build_control(choice: str, stage1_img: Image.Image, src: Image.Image, photo_key: str) -> Image.Image|None:
+    # Without an inpainted stage 1 (scenes, or a failed inpaint) the map comes from the photo
+    # itself, so it is shared by photo; an inpainted backdrop only matches its own pixels.
+    source = photo_key if stage1_img is src else None
+    return CONTROL_BUILDERS[choice](stage1_img, source=source)
 
 def pick_controlnet_repo(kind: str) -> str|None:
     # I map friendly names to SD1.5 ControlNets.
@@ -154,25 +162,6 @@ def pick_controlnet_repo(kind: str) -> str|None:
     }
     return mapping.get(kind)
 
-def soft_erode_mask(m: np.ndarray, k=5, it=1):
-    import cv2
-    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (k,k))
-    return cv2.erode(m, kernel, iterations=it)
-
-def get_skin_mask_rgb(img: Image.Image) -> Image.Image:
-    # I estimate skin in HSV so I can protect it later.
-    import cv2
-    bgr = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-    hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
-    lower = np.array([0,  20,  60], dtype=np.uint8)
-    upper = np.array([35, 180, 255], dtype=np.uint8)
-    m1 = cv2.inRange(hsv, lower, upper).astype(np.uint8)
-    m1 = cv2.GaussianBlur(m1, (0,0), 3.0)
-    m1 = (m1 > 32).astype(np.uint8)*255
-    m1 = soft_erode_mask(m1, k=5, it=1)
-    m1 = cv2.GaussianBlur(m1, (0,0), 2.0)
-    return Image.fromarray(m1, mode="L")
-
 def composite_with_mask(fg: Image.Image, bg: Image.Image, mask: Image.Image, alpha=0.7) -> Image.Image:
     # I blend two images with a soft mask.
     fg = np.asarray(fg).astype(np.float32)
@@ -182,114 +171,8 @@ def composite_with_mask(fg: Image.Image, bg: Image.Image, mask: Image.Image, alp
     out = m*fg + (1.0-m)*bg
     return Image.fromarray(out.astype(np.uint8))
 
-# ----------- Grading ----------
-def _thin_edges(e: np.ndarray, hi_q=0.95) -> np.ndarray:
-    # I keep only the thinnest, strongest edges for glow.
-    import cv2
-    t = float(np.quantile(e, hi_q))
-    e = (e >= t).astype(np.uint8)
-    k = cv2.getStructuringElement(cv2.MORPH_RECT, (3,3))
-    e = cv2.morphologyEx(e, cv2.MORPH_OPEN, k, iterations=1)
-    e = cv2.dilate(e, k, iterations=1)
-    e = cv2.GaussianBlur(e.astype(np.float32), (0,0), 1.2)
-    return e
-
-def grade_cyberpunk(
-    pil_img: Image.Image,
-    edges_for_glow: Image.Image|None,
-    bg_mask_for_edges: Image.Image|None = None,
-    neon: float = 0.30,
-    bloom: float = 0.34,
-    scanlines: float = 0.0,
-    protect_skin: bool = True,
-    tone_mix: float = 0.10,
-    glow_sigma: float = 2.0,
-    bloom_sigma: float = 5.0,
-    bloom_thresh: float = 0.75,
-    ca_px: int = 0,
-    edge_q: float = 0.985,
-    skin_suppress: float = 0.95,
-    add_dither: bool = True,
-) -> Image.Image:
-    # I push teal/magenta, add edge glow + bloom, and keep skin safe.
-    import cv2
-    arr = np.asarray(pil_img).astype(np.float32) / 255.0
-    h, w, _ = arr.shape
-
-    gray = np.mean(arr, axis=2, keepdims=True)
-    w_teal = np.clip(1.0 - 1.4*gray, 0.0, 1.0)
-    w_mag  = np.clip(1.4*gray - 0.2, 0.0, 1.0)
-    teal    = np.array([0.0,1.0,1.0], dtype=np.float32)[None,None,:]
-    magenta = np.array([1.0,0.0,0.9], dtype=np.float32)[None,None,:]
-    toned = np.clip(arr*(1.0 - tone_mix) + (w_teal*teal + w_mag*magenta)*tone_mix, 0.0, 1.0)
-
-    if edges_for_glow is not None:
-        e_img = edges_for_glow.resize((w, h), Image.LANCZOS).convert("L")
-        e = np.asarray(e_img).astype(np.float32)/255.0
-    else:
-        g = cv2.cvtColor((toned*255).astype(np.uint8), cv2.COLOR_RGB2GRAY)
-        e = cv2.Canny(g, 80, 160).astype(np.float32)/255.0
-
-    if bg_mask_for_edges is not None:
-        bg = ImageOps.invert(bg_mask_for_edges).resize((w,h), Image.NEAREST)
-        bg = np.asarray(bg).astype(np.float32)/255.0
-        e = e * (bg > 0.5).astype(np.float32)
-
-    e = _thin_edges(e, hi_q=edge_q)
-    e = gaussian_blur_keepdims(e, 1.2)
-
-    if protect_skin:
-        hsv = cv2.cvtColor((arr*255).astype(np.uint8), cv2.COLOR_RGB2HSV).astype(np.float32)
-        H, S, V = hsv[...,0], hsv[...,1]/255.0, hsv[...,2]/255.0
-        skin = ((H >= 0) & (H <= 50) & (S > 0.10) & (S < 0.68) & (V > 0.2) & (V < 0.95)).astype(np.float32)
-        skin = gaussian_blur_keepdims(skin, 3.0)
-        e = e * (1.0 - skin_suppress * skin)
-
-    y = (np.arange(h, dtype=np.float32) / max(h - 1, 1))[:, None]
-    grad_mag  = np.clip(1.2*y - 0.1, 0.0, 1.0)
-    grad_teal = 1.0 - grad_mag
-    glow_color = np.stack([
-        1.0*grad_mag + 0.0*grad_teal,
-        0.10*grad_mag + 1.0*grad_teal,
-        0.90*grad_mag + 1.0*grad_teal,
-    ], axis=2)
-    glow = gaussian_blur_keepdims(e * glow_color, glow_sigma)
-
-    lum = np.max(toned, axis=2, keepdims=True)
-    bloom_map = np.clip(lum - bloom_thresh, 0.0, 1.0)
-    bloom_map = gaussian_blur_keepdims(bloom_map, bloom_sigma)
-    bloom_rgb = to_3c(bloom_map)
-
-    def screen(a, b, k): return 1.0 - (1.0 - a) * (1.0 - np.clip(k,0,1)*np.clip(b,0,1))
-    out = screen(toned, glow,  neon)
-    out = screen(out,  bloom_rgb, bloom)
-
-    if scanlines > 0:
-        yy = np.arange(h, dtype=np.float32)[:, None]
-        lines = 0.5*(1.0 + np.sin(2.0*np.pi*yy/3.0))
-        mask = 1.0 - float(scanlines)*(1.0 - lines)
-        mask = np.broadcast_to(mask[:, :, None], (h, w, 1)).astype(np.float32)
-        out = np.clip(out * mask, 0.0, 1.0)
-
-    if ca_px > 0:
-        out_ca = out.copy()
-        out_ca[...,0] = np.roll(out[...,0], -ca_px, axis=1)
-        out_ca[...,2] = np.roll(out[...,2],  ca_px, axis=1)
-        out = out_ca
-
-    blur = cv2.GaussianBlur(out, (0,0), 0.8)
-    hp = np.clip(out - blur, 0.0, 1.0)
-    weight = np.clip(np.max(hp, axis=2, keepdims=True)*1.5, 0.0, 1.0)
-    out = np.clip(out + weight*0.30*(out - blur), 0.0, 1.0)
-
-    if add_dither:
-        noise = np.random.normal(0, 0.002, out.shape).astype(np.float32)
-        out = np.clip(out + noise, 0.0, 1.0)
-
-    return Image.fromarray((out*255).astype(np.uint8))
-
 # ------------- main -------------
-def main():
+def build_parser() -> argparse.ArgumentParser:
     # I expose simple flags; portraits do a background inpaint first.
     p = argparse.ArgumentParser("Photo → Cyberpunk (v4)")
     p.add_argument("-i","--input", required=True)
@@ -328,28 +211,47 @@ def main():
     p.add_argument("--rim-boost", type=float, default=0.22, help="Extra rim glow for portraits (0..1)")
     p.add_argument("--skin-keep", type=float, default=0.65)
 
-    args = p.parse_args()
+    return p
+
+def scheduler_class_for(scheduler: str):
+    return DPMSolverMultistepScheduler if scheduler == "dpmpp" else UniPCMultistepScheduler
+
+# Annotators my control builders may use; long-lived callers warm them up front.
+ANNOTATORS = ("hed", "midas")
 
-    # I/O
-    src = resize_max_side(load_image(args.input), args.max_side)
+def warm() -> dict:
+    # I load my annotators now so the first request doesn't pay for it (backend preload / worker "warm").
+    return {"annotators": annotators.preload(ANNOTATORS)}
 
-    style_imgs = None
-    if args.style_image:
+def _grain_rng(args) -> np.random.Generator|None:
+    # The grade's grain follows --seed like the diffusion does (a per-run generator, never the
+    # global RNG that concurrent resident runs share); unseeded runs get fresh grain.
+    return np.random.default_rng(args.seed) if args.seed else None
+
+def stylize_image(src: Image.Image, args, style_imgs=None) -> Image.Image:
+    # I run the whole cyberpunk flow on an already-loaded image and return the graded result.
+    # In-process callers pass style refs as images; the CLI loads them from --style-image.
+    # I key control maps on the photo as received, so preview and full share them.
+    photo_key = control_cache.source_key(src)
+    src = resize_max_side(src.convert("RGB"), args.max_side)
+
+    if style_imgs:
+        style_imgs = [resize_max_side(i.convert("RGB"), args.max_side) for i in style_imgs]
+    elif args.style_image:
         paths = [s.strip() for s in args.style_image.split(",") if s.strip()]
         style_imgs = [resize_max_side(load_image(pth), args.max_side) for pth in paths]
     style_collage = collage_hstack(style_imgs) if style_imgs and len(style_imgs) > 1 else (style_imgs[0] if style_imgs else None)
 
     # Grade-only path
     if args.grade_only:
-        graded = grade_cyberpunk(
-            src, edges_for_glow=None, bg_mask_for_edges=None,
+        graded = postfx.cyberpunk(
+            src, edges_for_glow=None, bg_mask_for_edges=None, sharpen=False,
             neon=args.neon or 0.30, bloom=args.bloom or 0.34,
             edge_q=args.edge_q or 0.985, skin_suppress=args.skin_suppress or 0.95,
-            scanlines=args.scanlines
+            scanlines=args.scanlines, rng=_grain_rng(args)
         )
-        ensure_dir(Path(args.output))
-        graded.save(args.output); print(f"✅ Saved (grade-only): {args.output}")
-        return
+        print("✅ Graded (grade-only)")
+        return graded
 
     # Device / dtype
     torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
@@ -401,25 +303,29 @@ def main():
             print("[info] rembg not available; using dummy ellipse subject mask.")
         bg_mask = invert_mask(subj_mask)
 
-        try:
+        def build_inpaint():
             inpaint = StableDiffusionInpaintPipeline.from_pretrained(
-                args.base, torch_dtype=torch_dtype, safety_checker=None
+                args.base, torch_dtype=torch_dtype, safety_checker=None,
+                **pipeline_cache.shared_modules(args.base, torch_dtype),
             ).to(device)
-            inpaint.scheduler = (
-                DPMSolverMultistepScheduler if args.scheduler == "dpmpp" else UniPCMultistepScheduler
-            ).from_config(inpaint.scheduler.config)
+            inpaint.scheduler = scheduler_class_for(args.scheduler).from_config(inpaint.scheduler.config)
+            return inpaint
 
+        try:
             s1_strength = 0.70
             s1_steps = max(32, int(steps))
-            stage1_img = inpaint(
-                prompt=("neon cyberpunk city backdrop, magenta and teal signage, rain bokeh, colored fog, cinematic depth"),
-                negative_prompt="text, watermark, heavy vignette, plastic look",
-                image=src,
-                mask_image=bg_mask,
-                strength=s1_strength,
-                guidance_scale=5.8,
-                num_inference_steps=s1_steps,
-            ).images[0]
+            with pipeline_cache.use(("cyberpunk-inpaint", args.base, args.scheduler, str(torch_dtype), device), build_inpaint) as inpaint, \
+                    stages.stage("inpaint"):
+                stage1_img = inpaint(
+                    prompt=("neon cyberpunk city backdrop, magenta and teal signage, rain bokeh, colored fog, cinematic depth"),
+                    negative_prompt="text, watermark, heavy vignette, plastic look",
+                    image=src,
+                    mask_image=bg_mask,
+                    strength=s1_strength,
+                    guidance_scale=5.8,
+                    num_inference_steps=s1_steps,
+                    **step_hooks.pipe_kwargs(),
+                ).images[0]
             print("Stage-1 background inpaint done.")
             stage1_img = force_multiple_of_8(stage1_img)
         except Exception:
@@ -433,55 +339,54 @@ def main():
         control_choice = (control_policy if args.subject=="scene" else "softedge")
     controlnet_id, control_img = None, None
     if control_choice != "none":
-        if control_choice == "depth":
-            control_img = control_image_depth(stage1_img)
-        elif control_choice == "softedge":
-            control_img = control_image_softedge(stage1_img)
-        elif control_choice == "canny":
-            control_img = control_image_canny(stage1_img)
+        control_img = build_control(control_choice, stage1_img, src, photo_key)
         controlnet_id = pick_controlnet_repo(control_choice) if control_img is not None else None
 
         if control_img is not None:
             control_img = force_multiple_of_8(control_img.resize(stage1_img.size, Image.LANCZOS))
             stage1_img   = force_multiple_of_8(stage1_img)
+    stages.note("controlNet", controlnet_id)
 
-    # Build pipeline
-    try:
-        if controlnet_id:
-            controlnet = ControlNetModel.from_pretrained(controlnet_id, torch_dtype=torch_dtype)
-            pipe = StableDiffusionControlNetImg2ImgPipeline.from_pretrained(
-                args.base, controlnet=controlnet, torch_dtype=torch_dtype,
-                safety_checker=None, feature_extractor=None,
-            )
-        else:
-            pipe = StableDiffusionImg2ImgPipeline.from_pretrained(
-                args.base, torch_dtype=torch_dtype, safety_checker=None, feature_extractor=None
-            )
-        pipe.scheduler = (DPMSolverMultistepScheduler if args.scheduler=="dpmpp" else UniPCMultistepScheduler).from_config(pipe.scheduler.config)
-        pipe = pipe.to(device)
-    except Exception:
-        traceback.print_exc(); sys.exit(2)
-
-    # IP-Adapter (style refs)
+    # Build pipeline (IP-Adapter patches the UNet, so styled pipelines get their own weights)
     DIFF_OK_FOR_IP = version.parse(_df.__version__) >= version.parse("0.35.0")
-    use_style = False
-    if style_collage is not None and DIFF_OK_FOR_IP:
+    want_style = style_collage is not None and DIFF_OK_FOR_IP
+
+    def build_main():
         try:
-            try: pipe.disable_attention_slicing()
+            shared = {} if want_style else pipeline_cache.shared_modules(args.base, torch_dtype)
+            if controlnet_id:
+                controlnet = pipeline_cache.controlnet(controlnet_id, torch_dtype)
+                pipe = StableDiffusionControlNetImg2ImgPipeline.from_pretrained(
+                    args.base, controlnet=controlnet, torch_dtype=torch_dtype,
+                    safety_checker=None, feature_extractor=None, **shared,
+                )
+            else:
+                pipe = StableDiffusionImg2ImgPipeline.from_pretrained(
+                    args.base, torch_dtype=torch_dtype, safety_checker=None, feature_extractor=None, **shared
+                )
+            pipe.scheduler = scheduler_class_for(args.scheduler).from_config(pipe.scheduler.config)
+            pipe = pipe.to(device)
+        except Exception:
+            traceback.print_exc(); sys.exit(2)
+
+        # IP-Adapter (style refs)
+        pipe.ip_adapter_ready = False
+        if want_style:
+            try:
+                try: pipe.disable_attention_slicing()
+                except Exception: pass
+                pipe.load_ip_adapter(
+                    "h94/IP-Adapter", subfolder="models",
+                    weight_name="ip-adapter_sd15.safetensors",
+                    torch_dtype=torch_dtype,
+                )
+                pipe.ip_adapter_ready = True
+            except Exception as e:
+                print(f"[warn] IP-Adapter load failed: {e}")
+        if not pipe.ip_adapter_ready:
+            try: pipe.enable_attention_slicing("auto")
             except Exception: pass
-            pipe.load_ip_adapter(
-                "h94/IP-Adapter", subfolder="models",
-                weight_name="ip-adapter_sd15.safetensors",
-                torch_dtype=torch_dtype,
-            )
-            pipe.set_ip_adapter_scale([float(style_strength)])
-            use_style = True
-            print(f"IP-Adapter loaded, style_strength={style_strength}")
-        except Exception as e:
-            print(f"[warn] IP-Adapter load failed: {e}")
-    if not use_style:
-        try: pipe.enable_attention_slicing("auto")
-        except Exception: pass
+        return pipe
 
     # Seed
     generator = (torch.Generator(device=device).manual_seed(args.seed) if args.seed else None)
@@ -492,44 +397,55 @@ def main():
     else:
         control_scale = args.control_scale if args.control_scale is not None else 0.22
 
-    # Stage-2 (main stylization)
-    kwargs = dict(
-        prompt=ppos, negative_prompt=pneg,
-        image=stage1_img, strength=float(strength),
-        guidance_scale=float(guidance), num_inference_steps=int(steps),
-        generator=generator,
-    )
-    if controlnet_id and control_img is not None:
-        kwargs["control_image"] = control_img
-        kwargs["controlnet_conditioning_scale"] = float(control_scale)
-    if use_style:
-        kwargs["ip_adapter_image"] = [style_collage]
-    print(f"Running Stage-2… subject={args.subject} strength={strength} cfg={guidance} steps={steps} control={control_choice}/{bool(controlnet_id)} style={use_style}")
-    try:
-        result = pipe(**kwargs).images[0]
-    except Exception:
-        traceback.print_exc(); sys.exit(3)
-
-    # Optional refine pass
-    if args.refine:
-        r_strength = args.refine_strength if args.refine_strength is not None else (0.22 if args.subject=="portrait" else 0.28)
-        ref_kwargs = dict(
-            prompt=ppos, negative_prompt=pneg, image=result,
-            strength=float(r_strength), guidance_scale=float(guidance),
-            num_inference_steps=20, generator=generator
+    pipe_key = ("cyberpunk", args.base, controlnet_id, args.scheduler, want_style, str(torch_dtype), device)
+    with pipeline_cache.use(pipe_key, build_main) as pipe:
+        use_style = pipe.ip_adapter_ready
+        stages.note("ipAdapter", bool(use_style))
+        if use_style:
+            pipe.set_ip_adapter_scale([float(style_strength)])
+            print(f"IP-Adapter loaded, style_strength={style_strength}")
+
+        # Stage-2 (main stylization)
+        kwargs = dict(
+            prompt=ppos, negative_prompt=pneg,
+            image=stage1_img, strength=float(strength),
+            guidance_scale=float(guidance), num_inference_steps=int(steps),
+            generator=generator,
+            **step_hooks.pipe_kwargs(),
         )
         if controlnet_id and control_img is not None:
-            ref_kwargs["control_image"] = control_img
-            ref_kwargs["controlnet_conditioning_scale"] = float(control_scale*0.9)
-        if use_style and style_collage is not None:
-            ref_kwargs["ip_adapter_image"] = [style_collage]
-        result = pipe(**ref_kwargs).images[0]
+            kwargs["control_image"] = control_img
+            kwargs["controlnet_conditioning_scale"] = float(control_scale)
+        if use_style:
+            kwargs["ip_adapter_image"] = [style_collage]
+        print(f"Running Stage-2… subject={args.subject} strength={strength} cfg={guidance} steps={steps} control={control_choice}/{bool(controlnet_id)} style={use_style}")
+        try:
+            result = pipe(**kwargs).images[0]
+        except Exception:
+            traceback.print_exc(); sys.exit(3)
+
+        # Optional refine pass
+        if args.refine:
+            r_strength = args.refine_strength if args.refine_strength is not None else (0.22 if args.subject=="portrait" else 0.28)
+            ref_kwargs = dict(
+                prompt=ppos, negative_prompt=pneg, image=result,
+                strength=float(r_strength), guidance_scale=float(guidance),
+                num_inference_steps=20, generator=generator,
+                **step_hooks.pipe_kwargs(),
+            )
+            if controlnet_id and control_img is not None:
+                ref_kwargs["control_image"] = control_img
+                ref_kwargs["controlnet_conditioning_scale"] = float(control_scale*0.9)
+            if use_style and style_collage is not None:
+                ref_kwargs["ip_adapter_image"] = [style_collage]
+            with stages.stage("refine"):
+                result = pipe(**ref_kwargs).images[0]
 
     # Skin keep (blend some original skin back)
     if args.subject == "portrait" and subj_mask is not None and args.skin_keep > 0:
-        skin_mask = get_skin_mask_rgb(src).resize(result.size, Image.BILINEAR)
+        skin = skin_mask(src).resize(result.size, Image.BILINEAR)
         subj_mask_res = subj_mask.resize(result.size, Image.NEAREST)
-        m = Image.fromarray(((np.array(skin_mask) > 80) & (np.array(subj_mask_res) > 128)).astype(np.uint8) * 255, mode="L")
+        m = Image.fromarray(((np.array(skin) > 80) & (np.array(subj_mask_res) > 128)).astype(np.uint8) * 255, mode="L")
         m = m.filter(ImageFilter.GaussianBlur(radius=2.0))
         result = composite_with_mask(src.resize(result.size, Image.LANCZOS), result, m, alpha=float(args.skin_keep))
 
@@ -567,17 +483,25 @@ def main():
         result = Image.fromarray((base*255).astype(np.uint8))
 
     # Final grade + light sharpen
-    graded = grade_cyberpunk(
+    return postfx.cyberpunk(
         result,
         edges_for_glow=edges_for_glow,
         bg_mask_for_edges=bg_mask_for_edges,
         neon=float(neon), bloom=float(bloom), scanlines=float(args.scanlines),
         edge_q=float(edge_q), skin_suppress=float(skin_suppress),
-        ca_px=(0 if args.subject=="portrait" else 1)
-    ).filter(ImageFilter.UnsharpMask(radius=1, percent=110, threshold=6))
+        ca_px=(0 if args.subject=="portrait" else 1), rng=_grain_rng(args)
+    )
+
+def main():
+    if "--serve" in sys.argv[1:]:
+        # I stay alive and take jobs over stdin/stdout (see worker_serve.py).
+        return worker_serve.serve(build_parser, stylize_image, warm=warm)
+    args = build_parser().parse_args()
+    graded = stylize_image(load_image(args.input), args)
 
     ensure_dir(Path(args.output))
-    graded.save(args.output)
+    with stages.stage("save"):
+        graded.save(args.output)
     print(f"✅ Saved: {args.output}")
 
 if __name__ == "__main__":
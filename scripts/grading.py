@@ -0,0 +1,1017 @@
+# -*- coding: utf-8 -*-
+# I hold the colour grades the stylizer scripts apply after diffusion (noir, cinematic v5,
+# cyberpunk v3), plus the small numpy helpers they share and the 8-bit finishing steps (sharpen,
+# saturation, ordered dither). scripts/postfx.py chains them into each style's post-processing.
+# They only need numpy, PIL, OpenCV and SciPy, so they import without torch/diffusers:
+# the benchmarks in tests/bench time them on any CPU box.
+#
+# The grades work in place on scratch buffers from an `Arena` instead of allocating a fresh
+# full-frame float32 array per step (each one is ~15 MB at 1280 px, and a grade used a dozen).
+# Every thread keeps its own arena, holding the buffers of the last few frame sizes it graded,
+# so back-to-back grades at the same size allocate nothing but the output image.
+# ARTIFY_GRADE_ARENA_SIZES sets how many frame sizes a thread keeps buffers for (default 2;
+# 0 = drop them after every grade).
+#
+# Large frames are graded in horizontal strips of at most ARTIFY_GRADE_STRIP_ROWS rows (default
+# 1024; 0 = whole frame), so the float buffers scale with the strip, not the frame. Each strip
+# computes a halo of extra rows as deep as its blurs reach, which makes the result bit-identical
+# to grading the whole frame at once. Only uint8 images and single-channel maps stay frame-sized.
+#
+# The wide glow/bloom blurs go through bloom_blur, which by default (ARTIFY_GRADE_BLOOM=fast)
+# blurs on an image pyramid at a quarter of the cost, within one 8-bit level of the exact blur
+# (ARTIFY_GRADE_BLOOM=exact).
+#
+# When numba imports, the per-pixel passes between the blurs run as fused, row-parallel kernels
+# (scripts/grading_kernels.py) instead of a chain of whole-strip NumPy passes; they follow the
+# NumPy arithmetic step for step. finish8 does the same for the 8-bit finishing steps (unsharp,
+# saturation, dither), matching PIL byte for byte. ARTIFY_GRADE_NUMBA=0 keeps the NumPy path.
+#
+# Film grain draws from the run's own generator (`rng`, which the scripts derive from --seed),
+# never from numpy's global RNG: resident-mode runs share a process, and two seeded runs drawing
+# from one global state would interleave and stop repeating. One draw from `rng` seeds a frame of
+# grain whose every row has a fixed place in the stream (`grain_into`), so a strip fetches its
+# own rows and the grain, too, is the same whatever the strip size.
+
+import os, threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageOps, ImageFilter
+
+import stages
+
+# ---------------- Scratch buffers ----------------
+
+def _arena_sizes() -> int:
+    try:
+        return max(0, int(os.environ.get("ARTIFY_GRADE_ARENA_SIZES", "2")))
+    except ValueError:
+        return 2
+
+class Arena:
+    """
+    I hand out named scratch arrays, reused whenever the same name, shape and dtype come back.
+    Buffers are grouped by frame size (`size`, by default the first two dims of the shape); past
+    `max_sizes` sizes I drop the least recently used size's buffers. Contents are garbage on
+    return: callers overwrite them.
+    """
+
+    def __init__(self, max_sizes: int = 2):
+        self.max_sizes = max_sizes
+        self._sizes: "OrderedDict[tuple, dict]" = OrderedDict()
+
+    def get(self, name: str, shape, dtype=np.float32, size=None) -> np.ndarray:
+        shape = tuple(shape)
+        size = tuple(size) if size is not None else shape[:2]
+        bufs = self._sizes.get(size)
+        if bufs is None:
+            bufs = self._sizes[size] = {}
+        self._sizes.move_to_end(size)
+        key = (name, shape, np.dtype(dtype))
+        buf = bufs.get(key)
+        if buf is None:
+            buf = bufs[key] = np.empty(shape, dtype=dtype)
+        return buf
+
+    def trim(self) -> None:
+        # I run after a grade, so the buffers it is still using are never dropped mid-way.
+        while len(self._sizes) > self.max_sizes:
+            self._sizes.popitem(last=False)
+
+    def nbytes(self) -> int:
+        return sum(b.nbytes for bufs in self._sizes.values() for b in bufs.values())
+
+_LOCAL = threading.local()
+
+def arena() -> Arena:
+    # This thread's arena (grades run concurrently in resident mode, so arenas are not shared).
+    a = getattr(_LOCAL, "arena", None)
+    if a is None:
+        a = _LOCAL.arena = Arena(_arena_sizes())
+    return a
+
+def release_arena() -> None:
+    # I drop this thread's scratch buffers (the next grade allocates them again).
+    _LOCAL.arena = None
+
+def _grain_seed(rng: np.random.Generator | None) -> int:
+    # One draw from the run's generator seeds a whole frame of grain; an unseeded run gets a fresh one.
+    return int((rng if rng is not None else np.random.default_rng()).integers(1 << 63))
+
+def grain_into(seed: int, y0: int, out: np.ndarray, chunk_words: int = 16384) -> np.ndarray:
+    """
+    I fill `out` (n, w, 3) float32 with standard normal grain for frame rows y0..y0+n.
+    Each uint64 of a PCG64 stream makes two draws (Box-Muller on two 24-bit uniforms), and row y
+    starts at word y * ceil(w*3/2): a strip jumps straight to its rows with advance(), so the
+    grain of a row doesn't depend on how the frame was cut into strips.
+    """
+    n, w = out.shape[:2]
+    per_row = (w * 3 + 1) // 2
+    bits = np.random.PCG64(seed)
+    bits.advance(y0 * per_row)
+    # A few rows at a time: the temporaries stay well under a MB and in cache.
+    chunk_rows = max(1, chunk_words // per_row)
+    for r0 in range(0, n, chunk_rows):
+        m = min(chunk_rows, n - r0)
+        raw = bits.random_raw(m * per_row)
+        u1 = ((raw >> 40) + 1).astype(np.float32)           # (0, 2^24]: log() never sees 0
+        u1 *= np.float32(2.0 ** -24)
+        r = np.log(u1, out=u1)
+        r *= np.float32(-2.0)
+        np.sqrt(r, out=r)
+        theta = ((raw >> 16) & 0xFFFFFF).astype(np.float32)
+        theta *= np.float32(2.0 * np.pi * 2.0 ** -24)
+        z = np.empty((m, per_row, 2), np.float32)
+        np.multiply(r.reshape(m, per_row), np.cos(theta).reshape(m, per_row), out=z[..., 0])
+        np.multiply(r.reshape(m, per_row), np.sin(theta).reshape(m, per_row), out=z[..., 1])
+        out[r0:r0 + m] = z.reshape(m, per_row * 2)[:, :w * 3].reshape(m, w, 3)
+    return out
+
+# ---------------- Numba kernels ----------------
+
+# Stand-ins for a kernel's optional arrays ("no skin mask", "no glow", ...).
+_NO2 = np.empty((0, 0), np.float32)
+_NO3 = np.empty((0, 0, 3), np.float32)
+_NO1U8 = np.empty(0, np.uint8)
+_NO2U8 = np.empty((0, 0), np.uint8)
+_NO3U8 = np.empty((0, 0, 3), np.uint8)
+_NO4U8 = np.empty((0, 0, 0, 0), np.uint8)
+
+def _kernels():
+    # grading_kernels when numba imports and ARTIFY_GRADE_NUMBA isn't "0"; else None (NumPy path).
+    if os.environ.get("ARTIFY_GRADE_NUMBA", "1").strip() == "0":
+        return None
+    try:
+        import grading_kernels
+    except ImportError:
+        return None
+    return grading_kernels
+
+# ---------------- Strips ----------------
+
+def _strip_rows() -> int:
+    try:
+        return max(0, int(os.environ.get("ARTIFY_GRADE_STRIP_ROWS", "1024")))
+    except ValueError:
+        return 1024
+
+def _blur_radius(sigma: float) -> int:
+    # Rows either side that cv2.GaussianBlur reads for a float image (its kernel size for ksize=(0,0)).
+    return (int(round(sigma * 8 + 1)) | 1) // 2
+
+def _gauss_radius(sigma: float) -> int:
+    # Same for scipy.ndimage.gaussian_filter (truncate=4.0).
+    return int(4.0 * sigma + 0.5)
+
+def _bands(h: int, halo: int, strip_rows: int | None = None, align: int = 1):
+    """
+    I split `h` rows into equal strips of at most `strip_rows` (0 = one strip) and return
+    (rows, [(y0, y1, e0, e1), ...]): each strip delivers rows y0..y1 but computes e0..e1, `halo`
+    more on each side (clamped to the frame), so blurs see the same neighbours as on the whole
+    frame. e0 is a multiple of `align`, which keeps pyramid blurs on the frame's grid.
+    `rows` is the most any strip computes: the height of the scratch buffers.
+    """
+    strip_rows = _strip_rows() if strip_rows is None else strip_rows
+    n = 1 if strip_rows <= 0 or h <= strip_rows else -(-h // strip_rows)
+    core = -(-h // n)
+    bands = [(y0, min(h, y0 + core), max(0, y0 - halo) // align * align, min(h, y0 + core + halo))
+             for y0 in range(0, h, core)]
+    return max(e1 - e0 for _, _, e0, e1 in bands), bands
+
+def _scratch(ar: Arena, rows: int, w: int):
+    # buf(name, *channels, dtype=...) → this strip's view of a (rows, w, ...) arena buffer.
+    # `buf.n` is the strip's row count; set it before each strip.
+    # buf.padded(name, pad, *channels) is the same with `pad` extra rows and columns on each side.
+    def buf(name: str, *tail, dtype=np.float32) -> np.ndarray:
+        return ar.get(name, (rows, w) + tail, dtype)[:buf.n]
+    def padded(name: str, pad: int, *tail) -> np.ndarray:
+        return ar.get(name, (rows + 2*pad, w + 2*pad) + tail, size=(rows, w))[:buf.n + 2*pad]
+    buf.n = rows
+    buf.padded = padded
+    return buf
+
+def _rgb_array(img: Image.Image) -> np.ndarray:
+    # The image's pixels as a read-only (h, w, 3) uint8 array, without an extra convert() copy.
+    return np.asarray(img if img.mode == "RGB" else img.convert("RGB"))
+
+def _load_rgb(src: np.ndarray, out: np.ndarray) -> np.ndarray:
+    # I fill `out` with uint8 rows as float32 in 0..1 (same values as src.astype(f32) / 255).
+    np.copyto(out, src, casting="unsafe")
+    out /= 255.0
+    return out
+
+def _store(a: np.ndarray, out8: np.ndarray) -> None:
+    # `a` is float 0..1 and gets scaled in place; out8 gets the same bytes as (a*255).astype(uint8).
+    a *= 255.0
+    np.copyto(out8, a, casting="unsafe")
+
+# ---------------- Masks and tables ----------------
+# Things that only depend on the frame size and the grade's settings (the vignette, the glow
+# gradient, scanlines) and 8-bit lookup tables. Output sizes come from a few maxSide buckets, so
+# they are built once and shared by every thread, up to ARTIFY_GRADE_MASK_MB (default 32).
+
+_MASKS: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+_MASKS_LOCK = threading.Lock()
+
+def _mask_budget() -> int:
+    try:
+        return max(0, int(os.environ.get("ARTIFY_GRADE_MASK_MB", "32"))) * 2**20
+    except ValueError:
+        return 32 * 2**20
+
+def _mask(key: tuple, build) -> np.ndarray:
+    # build() for `key`, made read-only and kept (least recently used go first past the budget).
+    with _MASKS_LOCK:
+        hit = _MASKS.get(key)
+        if hit is not None:
+            _MASKS.move_to_end(key)
+            return hit
+    arr = build()
+    arr.setflags(write=False)
+    budget = _mask_budget()
+    if arr.nbytes <= budget:
+        with _MASKS_LOCK:
+            _MASKS[key] = arr
+            while sum(a.nbytes for a in _MASKS.values()) > budget:
+                _MASKS.popitem(last=False)
+    return arr
+
+def clear_masks() -> None:
+    with _MASKS_LOCK:
+        _MASKS.clear()
+
+# ---------------- Shared helpers ----------------
+
+def pil_to_numpy(img: Image.Image) -> np.ndarray:
+    return np.asarray(img).astype(np.float32)/255.0
+
+def numpy_to_pil(arr: np.ndarray) -> Image.Image:
+    arr = np.clip(arr, 0.0, 1.0)
+    return Image.fromarray((arr*255.0).astype(np.uint8))
+
+def to_np(img: Image.Image) -> np.ndarray:
+    return np.asarray(img).astype(np.float32) / 255.0
+
+def to_pil(arr: np.ndarray) -> Image.Image:
+    return Image.fromarray(np.clip(arr * 255.0, 0, 255).astype(np.uint8))
+
+def to_3c(x: np.ndarray) -> np.ndarray:
+    # I expand gray arrays to 3 channels.
+    if x.ndim == 2: return np.repeat(x[..., None], 3, axis=2)
+    if x.ndim == 3 and x.shape[2] == 1: return np.repeat(x, 3, axis=2)
+    return x
+
+def gaussian_blur_keepdims(x: np.ndarray, sigma: float) -> np.ndarray:
+    # I blur without changing shape.
+    import cv2
+    y = cv2.GaussianBlur(x, (0,0), sigma)
+    if y.ndim == 2: y = y[..., None]
+    return y.astype(np.float32)
+
+def luminance(arr: np.ndarray) -> np.ndarray:
+    return 0.2126*arr[...,0] + 0.7152*arr[...,1] + 0.0722*arr[...,2]
+
+def sigmoid(x, k=10.0, x0=0.5):
+    return 1.0/(1.0 + np.exp(-k*(x - x0)))
+
+def sharpen(pil: Image.Image, percent: int, threshold: int, radius: float = 1, passes: int = 1) -> Image.Image:
+    # PIL's unsharp mask, `passes` times over (every style ends with one).
+    f = ImageFilter.UnsharpMask(radius=radius, percent=percent, threshold=threshold)
+    for _ in range(passes):
+        pil = pil.filter(f)
+    return pil
+
+def saturate_pil(pil: Image.Image, sat_scale: float) -> Image.Image:
+    # I nudge saturation at the end to keep colors lively.
+    if abs(sat_scale - 1.0) < 1e-3:
+        return pil
+    hsv = pil.convert("HSV")
+    h, s, v = hsv.split()
+    hsv = Image.merge("HSV", (h, s.point(_saturation_lut(sat_scale).tolist()), v))
+    return hsv.convert("RGB")
+
+def _saturation_lut(sat_scale: float) -> np.ndarray:
+    # Through a 256-entry table (same values as scaling a float copy of the channel).
+    return _mask(("saturation", float(sat_scale)),
+                 lambda: np.clip(np.arange(256, dtype=np.float32) * sat_scale, 0, 255).astype(np.uint8))
+
+def _unsharp_lut(percent: int, threshold: int) -> np.ndarray:
+    # (256, 256) uint8: what PIL's unsharp mask makes of a pixel value given its blurred value
+    # (UnsharpMask.c: integer percent, C division, untouched within the threshold).
+    def build():
+        v = np.arange(256)[:, None]
+        d = v - np.arange(256)[None, :]
+        step = np.sign(d) * (np.abs(d) * int(percent) // 100)
+        return np.where(np.abs(d) > int(threshold), np.clip(v + step, 0, 255), v).astype(np.uint8)
+    return _mask(("unsharp", int(percent), int(threshold)), build)
+
+def finish8(pil: Image.Image, unsharp: tuple | None = None, saturation: float = 1.0,
+            dither: bool = False) -> Image.Image:
+    """
+    I apply 8-bit finishing steps in this order: sharpen() (radius 1, `unsharp` =
+    (percent, threshold)), saturate_pil(saturation), ordered_dither. With numba the three run as
+    one fused pass over the pixels (only the unsharp blur goes through PIL first); without, as
+    the PIL steps one after another. Both give the same bytes.
+    """
+    nbk = _kernels() if pil.mode == "RGB" else None
+    if nbk is None:
+        if unsharp:
+            pil = sharpen(pil, *unsharp)
+        pil = saturate_pil(pil, saturation)
+        return ordered_dither(pil) if dither else pil
+    src = np.asarray(pil)
+    blur, table = _NO3U8, _NO2U8
+    if unsharp:
+        # The same blur UnsharpMask makes internally.
+        blur, table = np.asarray(pil.filter(ImageFilter.GaussianBlur(1))), _unsharp_lut(*unsharp)
+    sat = _saturation_lut(saturation) if abs(saturation - 1.0) >= 1e-3 else _NO1U8
+    out8 = np.empty_like(src)
+    nbk.finish8(src, blur, table, sat, _mask(("bayer",), _bayer_luts) if dither else _NO4U8, out8)
+    return Image.fromarray(out8)
+
+def _luminance_into(a: np.ndarray, out: np.ndarray, tmp: np.ndarray) -> np.ndarray:
+    # luminance(a) without temporaries; `tmp` is a 2D scratch of the same size.
+    np.multiply(a[...,0], 0.2126, out=out)
+    np.multiply(a[...,1], 0.7152, out=tmp); out += tmp
+    np.multiply(a[...,2], 0.0722, out=tmp); out += tmp
+    return out
+
+def _sigmoid_into(x: np.ndarray, k: float) -> np.ndarray:
+    # sigmoid(x, k, x0=0) in place.
+    x *= -k
+    np.exp(x, out=x)
+    x += 1.0
+    np.divide(1.0, x, out=x)
+    return x
+
+def _screen_into(a: np.ndarray, b: np.ndarray, k: float) -> None:
+    # a = 1 - (1 - a) * (1 - k*b), in place; `b` is used up.
+    np.clip(b, 0.0, 1.0, out=b)
+    b *= np.clip(k, 0, 1)
+    np.subtract(1.0, b, out=b)
+    np.subtract(1.0, a, out=a)
+    a *= b
+    np.subtract(1.0, a, out=a)
+
+# ---------------- Bloom ----------------
+
+# Smallest blur left for the coarsest pyramid level; a level is only taken if it leaves this much.
+_MIN_RESIDUAL = 0.9
+
+def _bloom_quality() -> str:
+    q = os.environ.get("ARTIFY_GRADE_BLOOM", "fast").strip().lower()
+    return q if q in ("fast", "exact") else "fast"
+
+def _pyramid_plan(sigma: float, quality: str) -> tuple:
+    # (levels, blur left for the last level). A pyrDown/pyrUp pair at level i blurs by σ = 2^i px
+    # each way (variance 2·4^i in all); the last level's GaussianBlur makes up the rest of sigma².
+    if quality == "exact":
+        return 0, sigma
+    k = 0
+    while (sigma**2 - 2*(4**(k + 1) - 1)/3) / 4**(k + 1) >= _MIN_RESIDUAL**2:
+        k += 1
+    return k, float(np.sqrt((sigma**2 - 2*(4**k - 1)/3) / 4**k))
+
+def bloom_geometry(sigma: float, quality: str | None = None) -> tuple:
+    """
+    (reach, align) of bloom_blur: how many rows away an output pixel reads, and the row multiple
+    a strip must start on to see the same pyramid grid as the whole frame.
+    """
+    k, r = _pyramid_plan(sigma, quality or _bloom_quality())
+    if k == 0:
+        return _blur_radius(sigma), 1
+    return 4*((1 << k) - 1) + (_blur_radius(r) + 1) * (1 << k), 1 << k
+
+def bloom_blur(x: np.ndarray, sigma: float, quality: str | None = None,
+               out: np.ndarray | None = None, padded=None, border: int | None = None) -> np.ndarray:
+    """
+    I Gaussian-blur `x` (float32, (h, w) or (h, w, c)) by `sigma` for glows and bloom.
+
+    quality "exact" is cv2.GaussianBlur at full resolution. "fast" (the default, or
+    ARTIFY_GRADE_BLOOM) goes down an image pyramid (pyrDown), blurs what is left of sigma at the
+    coarsest level and comes back up (pyrUp): 2 levels for sigma 5-6, 1 for sigma 3; below
+    about 2.3 there is nothing to gain and I blur exactly. The edges are reflected first, the
+    way the exact blur does (`border`, default cv2.BORDER_REFLECT_101), so the border matches too.
+    For inputs in 0..1 "fast" stays within 0.002 of "exact" for sigma >= 3 (well under one 8-bit
+    level) and within 0.005 below that; tests/backend/test_grading.py holds it to this.
+
+    `padded(pad)` may supply the (h + 2·pad, w + 2·pad, ...) scratch array I need for "fast".
+    The result goes to `out` if given, else it may be a view of that scratch array.
+    """
+    import cv2
+    border = cv2.BORDER_REFLECT_101 if border is None else border
+    k, r = _pyramid_plan(sigma, quality or _bloom_quality())
+    if k == 0:
+        return cv2.GaussianBlur(x, (0,0), sigma, dst=out, borderType=border)
+    step = 1 << k
+    pad = -(-bloom_geometry(sigma, "fast")[0] // step) * step
+    h, w = x.shape[:2]
+    p = padded(pad) if padded else np.empty((h + 2*pad, w + 2*pad) + x.shape[2:], np.float32)
+    cv2.copyMakeBorder(x, pad, pad, pad, pad, border, dst=p)
+    levels = [p]
+    for _ in range(k):
+        levels.append(cv2.pyrDown(levels[-1]))
+    y = levels.pop()
+    if r > 0:
+        y = cv2.GaussianBlur(y, (0,0), r)
+    while levels:
+        up = levels.pop()
+        y = cv2.pyrUp(y, dst=up if not levels else None, dstsize=(up.shape[1], up.shape[0]))
+    y = y[pad:pad + h, pad:pad + w]
+    if out is None:
+        return y
+    np.copyto(out, y)
+    return out
+
+# ---------------- Noir ----------------
+
+def _vignette(h: int, w: int, strength: float) -> np.ndarray:
+    dx = (np.arange(w, dtype=np.float32) - w/2) / (0.9*w)
+    dy = (np.arange(h, dtype=np.float32) - h/2) / (0.9*h)
+    r = np.sqrt((dx**2)[None, :] + (dy**2)[:, None])
+    np.power(r, 1.5, out=r)
+    r *= strength
+    return np.clip(1.0 - r, 0.0, 1.0)
+
+def _noir_strip_numba(nbk, src, vig, buf, y0, y1, e0, e1, grain_seed, out8, bloom_sigma, bloom_thresh,
+                      halation, dither_std, filmic_lift, filmic_gamma, filmic_gain, bloom_quality):
+    # One strip of grade_noir with the per-pixel passes fused into Numba kernels.
+    import cv2
+    luma = buf("luma")
+    nbk.luma(src[e0:e1], luma)
+    blur = cv2.GaussianBlur(luma, (0,0), 1.2, dst=buf("t0"))
+    nbk.noir_contrast(luma, blur, blur, np.float32(bloom_thresh))
+    halo = bloom_blur(blur, float(bloom_sigma), bloom_quality, out=buf("t1"),
+                      padded=lambda pad: buf.padded("pad", pad))
+    core = slice(y0 - e0, y1 - e0)
+    buf.n = y1 - y0
+    noise, grain = _NO3, np.float32(0.0)
+    if grain_seed is not None:
+        noise, grain = grain_into(grain_seed, y0, buf("rgb", 3)), np.float32(dither_std)
+    lift = float(filmic_lift)
+    out2d = luma[core]
+    nbk.noir_curve(out2d, halo[core], vig[y0:y1], np.float32(halation), np.float32(lift),
+                   np.float32(1.0 + lift))
+    np.power(out2d, float(filmic_gamma), out=out2d)
+    nbk.noir_finish(out2d, np.float32(filmic_gain), noise, grain, out8[y0:y1])
+
+@stages.timed("grade")
+def grade_noir(pil_img: Image.Image,
+               vignette=0.18, halation=0.28,
+               bloom_sigma=3.0, bloom_thresh=0.70,
+               dither_std=0.002,
+               filmic_lift=0.02, filmic_gamma=0.96, filmic_gain=1.02,
+               strip_rows: int | None = None, bloom_quality: str | None = None,
+               finish: bool = True, rng: np.random.Generator | None = None) -> Image.Image:
+    # I do grayscale luma, local contrast, bloom/halation, vignette, and light grain.
+    # Everything up to the grain is single-channel, so I stay 2D until the very end.
+    # finish=False skips the closing sharpen (postfx graphs run it as an op of their own).
+    import cv2
+    src = _rgb_array(pil_img)
+    h, w = src.shape[:2]
+    # The halation blurs the output of the local-contrast blur, so their reach adds up.
+    reach, align = bloom_geometry(float(bloom_sigma), bloom_quality)
+    rows, bands = _bands(h, _blur_radius(1.2) + reach, strip_rows, align)
+    ar = arena()
+    buf = _scratch(ar, rows, w)
+    grain_seed = _grain_seed(rng) if dither_std and dither_std > 0 else None
+    out8 = np.empty((h, w, 3), np.uint8)
+    vig = _mask(("vignette", h, w, float(vignette)), lambda: _vignette(h, w, float(vignette)))
+
+    nbk = _kernels()
+    for y0, y1, e0, e1 in bands:
+        buf.n = e1 - e0
+        if nbk is not None:
+            _noir_strip_numba(nbk, src, vig, buf, y0, y1, e0, e1, grain_seed, out8, bloom_sigma, bloom_thresh,
+                              halation, dither_std, filmic_lift, filmic_gamma, filmic_gain, bloom_quality)
+            continue
+        rgb = _load_rgb(src[e0:e1], buf("rgb", 3))
+        luma = _luminance_into(rgb, buf("luma"), buf("t0"))
+
+        # Local contrast on luma
+        blur = cv2.GaussianBlur(luma, (0,0), 1.2, dst=buf("t0"))
+        hp = np.subtract(luma, blur, out=blur)
+        np.clip(hp, 0.0, 1.0, out=hp)
+        hp *= 0.65
+        l2 = np.add(luma, hp, out=luma)
+        np.clip(l2, 0.0, 1.0, out=l2)
+
+        # Bloom / halation
+        bright = np.subtract(l2, float(bloom_thresh), out=buf("t0"))
+        np.clip(bright, 0.0, 1.0, out=bright)
+        halo = bloom_blur(bright, float(bloom_sigma), bloom_quality, out=buf("t1"),
+                          padded=lambda pad: buf.padded("pad", pad))
+        halo *= float(halation)
+        out2d = np.add(l2, halo, out=l2)
+        np.clip(out2d, 0.0, 1.0, out=out2d)
+
+        # From here on every pixel stands alone: only this strip's own rows are needed.
+        out2d = out2d[y0 - e0:y1 - e0]
+        buf.n = y1 - y0
+
+        # Vignette
+        out2d *= vig[y0:y1]
+        np.clip(out2d, 0.0, 1.0, out=out2d)
+
+        # Filmic curve (lift/gamma/gain)
+        lift, gamma, gain = float(filmic_lift), float(filmic_gamma), float(filmic_gain)
+        np.clip(out2d, 0, 1, out=out2d)
+        out2d += lift
+        out2d /= (1.0 + lift)
+        np.power(out2d, gamma, out=out2d)
+        out2d *= gain
+        np.clip(out2d, 0, 1, out=out2d)
+
+        # Back to RGB + tiny grain
+        out = buf("rgb", 3)
+        if grain_seed is not None:
+            grain_into(grain_seed, y0, out)
+            out *= float(dither_std)
+            out += out2d[..., None]
+            np.clip(out, 0.0, 1.0, out=out)
+        else:
+            out[...] = out2d[..., None]
+        _store(out, out8[y0:y1])
+    ar.trim()
+
+    pil = Image.fromarray(out8)
+    return sharpen(pil, 110, 6) if finish else pil
+
+# ---------------- Cinematic v5 (teal/orange) ----------------
+
+def _bayer_luts() -> np.ndarray:
+    # (2, 1, 256, 6) uint8: for rows of parity py, what a value becomes at an even (channels 0-2)
+    # or odd x (3-5). Same arithmetic as adding the step to the pixel as float and storing it back.
+    v = np.arange(256, dtype=np.float32)
+    v /= 255.0
+    lut = np.empty((2, 1, 256, 6), np.uint8)
+    for py in (0, 1):
+        for px in (0, 1):
+            step = (1.0/255.0) * ((px + (py << 1)) / 4.0 - 0.375)
+            d = (v.astype(np.float64) + step).astype(np.float32)
+            np.clip(d, 0.0, 1.0, out=d)
+            d *= 255.0
+            lut[py, 0, :, 3*px:3*px + 3] = d.astype(np.uint8)[:, None]
+    return lut
+
+def _bayer_dither(out8: np.ndarray) -> None:
+    # A 2×2 Bayer step per pixel parity, in place on (h, w, 3) uint8, through a table per parity.
+    import cv2
+    lut = _mask(("bayer",), _bayer_luts)
+    w = out8.shape[1]
+    we = w - (w & 1)
+    for py in (0, 1):
+        # Rows of one parity, seen as pairs of pixels (even x, odd x) with 6 channels.
+        if we:
+            pairs = out8[py::2, :we].reshape(-1, we // 2, 6)
+            cv2.LUT(pairs, lut[py], dst=pairs)
+        if we < w:
+            last = out8[py::2, we]
+            last[...] = lut[py, 0, last, np.arange(3)]
+
+def ordered_dither(pil: Image.Image) -> Image.Image:
+    # A tiny ordered dither against banding, on a copy.
+    out8 = np.array(pil)
+    _bayer_dither(out8)
+    return Image.fromarray(out8)
+
+def _v5_glow(lit, buf, exact_glow):
+    if exact_glow:
+        from scipy.ndimage import gaussian_filter
+        return gaussian_filter(lit, sigma=(6.0,6.0,0.0), output=buf("f1", 3))
+    import cv2     # BORDER_REFLECT is SciPy's mode="reflect"
+    return bloom_blur(lit, 6.0, "fast", out=buf("f1", 3), border=cv2.BORDER_REFLECT,
+                      padded=lambda pad: buf.padded("pad", pad, 3))
+
+def _v5_strip_numba(nbk, src, buf, y0, y1, e0, e1, out8, subject, teal_vec, orange_vec, tone_mix,
+                    curve, bloom, contrast, skin_suppress, exact_glow):
+    # One strip of grade_v5 with the per-pixel passes fused into Numba kernels.
+    f32 = np.float32
+    a, lum = buf("rgb", 3), buf("lum")
+    skin = buf("m") if subject == "portrait" else _NO2
+    shadow_at, shadow_k, highlight_at, highlight_k = curve
+    nbk.luma(src[e0:e1], lum)
+    shadow_w = np.subtract(shadow_at, lum, out=buf("shadow")); _sigmoid_into(shadow_w, shadow_k)
+    highlight_w = np.subtract(lum, highlight_at, out=buf("highlight")); _sigmoid_into(highlight_w, highlight_k)
+    nbk.v5_tone(src[e0:e1], a, lum, shadow_w, highlight_w, teal_vec, orange_vec, f32(tone_mix),
+                subject == "scene", skin)
+    if skin.shape[0] and skin.any():
+        m = skin
+        try:
+            from scipy.ndimage import uniform_filter
+            m = uniform_filter(m, size=5, output=buf("t0"))
+        except Exception:
+            pass
+        nbk.v5_skin(a, src[e0:e1], m, lum, f32(skin_suppress))
+
+    lit = buf("f0", 3) if bloom and bloom > 0.0 else _NO3
+    nbk.v5_contrast_lit(a, lum, f32(1.0 + 1.8*contrast if contrast and contrast > 0.0 else 0.0), lit)
+    glow = _NO3
+    if lit.shape[0]:
+        try:
+            glow = _v5_glow(lit, buf, exact_glow)[y0 - e0:y1 - e0]
+        except Exception:
+            pass
+    nbk.v5_finish(a[y0 - e0:y1 - e0], glow, f32(bloom or 0.0), out8[y0:y1])
+
+@stages.timed("grade")
+def grade_v5(
+    img: Image.Image,
+    subject: str = "scene",
+    tone_mix: float | None = None,
+    bloom: float | None = None,
+    contrast: float | None = None,
+    skin_suppress: float | None = None,
+    saturation: float = 1.05,
+    add_dither: bool = True,
+    strip_rows: int | None = None,
+    bloom_quality: str | None = None,
+    finish: bool = True,
+) -> Image.Image:
+    # I do the teal–orange grade in numpy, with different settings for scene vs portrait.
+    # finish=False stops before the 8-bit sharpen/saturation/dither (postfx runs those as ops).
+    if subject == "portrait":
+        tone_mix = 0.22 if tone_mix is None else tone_mix
+        bloom = 0.22 if bloom is None else bloom
+        contrast = 0.18 if contrast is None else contrast
+        skin_suppress = 0.80 if skin_suppress is None else skin_suppress
+        shadow_at, shadow_k, highlight_at, highlight_k = 0.35, 12.0, 0.60, 10.0
+    else:
+        tone_mix = 0.40 if tone_mix is None else tone_mix
+        bloom = 0.42 if bloom is None else bloom
+        contrast = 0.24 if contrast is None else contrast
+        skin_suppress = 0.85 if skin_suppress is None else skin_suppress
+        shadow_at, shadow_k, highlight_at, highlight_k = 0.50, 12.0, 0.55, 12.0
+
+    # I push teal in shadows and orange in highlights.
+    if subject == "scene":
+        teal_vec   = np.array([0.02, 0.58, 1.00], dtype=np.float32)
+        orange_vec = np.array([1.05, 0.70, 0.05], dtype=np.float32)
+    else:
+        teal_vec   = np.array([0.02, 0.55, 0.95], dtype=np.float32)
+        orange_vec = np.array([1.00, 0.62, 0.07], dtype=np.float32)
+
+    src = _rgb_array(img)
+    h, w = src.shape[:2]
+    # The glow blurs colours that the skin pass (a 5×5 box) already mixed. "exact" keeps the
+    # SciPy blur this grade always used; "fast" goes through bloom_blur.
+    exact_glow = (bloom_quality or _bloom_quality()) == "exact"
+    reach, align = (_gauss_radius(6.0), 1) if exact_glow else bloom_geometry(6.0, "fast")
+    halo = (2 if subject == "portrait" else 0) + (reach if bloom and bloom > 0.0 else 0)
+    rows, bands = _bands(h, halo, strip_rows, align)
+    ar = arena()
+    buf = _scratch(ar, rows, w)
+    out8 = np.empty((h, w, 3), np.uint8)
+
+    nbk = _kernels()
+    for y0, y1, e0, e1 in bands:
+        buf.n = e1 - e0
+        if nbk is not None:
+            _v5_strip_numba(nbk, src, buf, y0, y1, e0, e1, out8, subject, teal_vec, orange_vec, tone_mix,
+                            (shadow_at, shadow_k, highlight_at, highlight_k), bloom, contrast,
+                            skin_suppress, exact_glow)
+            continue
+        a = _load_rgb(src[e0:e1], buf("rgb", 3))
+        lum = _luminance_into(a, buf("lum"), buf("t0"))
+
+        shadow_w = buf("shadow", 1)
+        highlight_w = buf("highlight", 1)
+        np.subtract(shadow_at, lum, out=shadow_w[..., 0]); _sigmoid_into(shadow_w, shadow_k)
+        np.subtract(lum, highlight_at, out=highlight_w[..., 0]); _sigmoid_into(highlight_w, highlight_k)
+
+        field = np.multiply(teal_vec[None,None,:], shadow_w, out=buf("f0", 3))
+        field += np.multiply(orange_vec[None,None,:], highlight_w, out=buf("f1", 3))
+        field *= tone_mix
+        keep = np.add(shadow_w, highlight_w, out=shadow_w)
+        np.clip(keep, 0.0, 1.0, out=keep)
+        keep *= tone_mix
+        np.subtract(1.0, keep, out=keep)
+        a *= keep
+        a += field
+        np.clip(a, 0.0, 1.0, out=a)
+
+        # I warm midtones for scenes.
+        if subject == "scene":
+            mid = np.subtract(lum, 0.45, out=buf("t0"))
+            mid /= 0.20
+            np.clip(mid, 0.0, 1.0, out=mid)
+            hi = np.subtract(0.65, lum, out=buf("t1"))
+            hi /= 0.20
+            np.clip(hi, 0.0, 1.0, out=hi)
+            mid *= hi
+            mid *= 0.06
+            a[...,0] += mid
+            mid *= 0.5
+            a[...,1] += mid
+
+        # I protect skin for portraits.
+        if subject == "portrait":
+            r, g, b = a[...,0], a[...,1], a[...,2]
+            skin = np.greater(r, g, out=buf("skin", dtype=bool))
+            tmp = buf("bool", dtype=bool)
+            skin &= np.greater(r, b, out=tmp)
+            skin &= np.greater(r, 0.30, out=tmp)
+            skin &= np.greater(lum, 0.20, out=tmp)
+            skin &= np.less(lum, 0.90, out=tmp)
+            if skin.any():
+                m = buf("m")
+                np.copyto(m, skin)
+                try:
+                    from scipy.ndimage import uniform_filter
+                    m = uniform_filter(m, size=5, output=buf("t0"))
+                except Exception:
+                    pass
+                wgt = np.multiply(m, 0.40, out=buf("t1"))
+                wgt *= skin_suppress
+                keep = np.subtract(1.0, wgt, out=buf("keep"))
+                # a*(1 - wgt) + base*wgt, where base is the input again (rebuilt per channel, not kept).
+                base = buf("base")
+                for c in range(3):
+                    np.copyto(base, src[e0:e1, :, c], casting="unsafe")
+                    base /= 255.0
+                    base *= wgt
+                    a[..., c] *= keep
+                    a[..., c] += base
+                mid_skin = np.greater(lum, 0.35, out=skin)
+                mid_skin &= np.less(lum, 0.65, out=tmp)
+                ms = np.multiply(mid_skin, m, out=base)
+                a[...,0] += np.multiply(ms, 0.10, out=wgt)
+                a[...,1] += np.multiply(ms, 0.05, out=wgt)
+
+        if contrast and contrast > 0.0:
+            a -= 0.5
+            a *= (1.0 + 1.8*contrast)
+            a += 0.5
+            np.clip(a, 0.0, 1.0, out=a)
+
+        if bloom and bloom > 0.0:
+            # I add soft glow on bright regions.
+            try:
+                thr = np.subtract(lum, 0.60, out=buf("t0"))
+                thr /= 0.40
+                np.clip(thr, 0.0, 1.0, out=thr)
+                lit = np.multiply(a, thr[..., None], out=buf("f0", 3))
+                glow = _v5_glow(lit, buf, exact_glow)
+                glow *= bloom
+                a += glow
+                np.clip(a, 0.0, 1.0, out=a)
+            except Exception:
+                pass
+
+        a = a[y0 - e0:y1 - e0]
+        np.clip(a, 0.0, 1.0, out=a)
+        _store(a, out8[y0:y1])
+
+    ar.trim()
+    out = Image.fromarray(out8)
+    if not finish:
+        return out
+    out = saturate_pil(sharpen(out, 115, 5), saturation)
+    # I add tiny ordered dither to fight banding.
+    return ordered_dither(out) if add_dither else out
+
+# ---------------- Skin ----------------
+# The styles' skin tests, in one place. They differ on purpose: each is tuned to what it protects.
+# - skin_mask: a soft mask of the source photo, for blending its skin back into a render;
+# - _skin_hsv: the hard test cyberpunk's grade dims its edge glow with;
+# - v5 portraits test skin on the graded RGB inside the tone pass (r > g, r > b, r > 0.3, mid
+#   luma), fused there because it reads the toned pixels as they are made.
+
+def skin_mask(img: Image.Image) -> Image.Image:
+    # I estimate skin in HSV so I can protect it later ("L", soft edges).
+    import cv2
+    hsv = cv2.cvtColor(np.asarray(img.convert("RGB")), cv2.COLOR_RGB2HSV)
+    m = cv2.inRange(hsv, np.array([0, 20, 60], np.uint8), np.array([35, 180, 255], np.uint8))
+    m = cv2.GaussianBlur(m, (0,0), 3.0)
+    m = (m > 32).astype(np.uint8)*255
+    m = cv2.erode(m, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5,5)), iterations=1)
+    m = cv2.GaussianBlur(m, (0,0), 2.0)
+    return Image.fromarray(m, mode="L")
+
+def _skin_sv_bounds() -> np.ndarray:
+    # 8-bit S and V ranges of the skin test (0.10 < S/255 < 0.68, 0.2 < V/255 < 0.95), read off the
+    # 256 levels so the comparison needs no float copy of the channels.
+    lv = np.arange(256, dtype=np.float32) / np.float32(255.0)
+    s_ok = np.nonzero((lv > 0.10) & (lv < 0.68))[0]
+    v_ok = np.nonzero((lv > 0.2) & (lv < 0.95))[0]
+    return np.array([s_ok[0], s_ok[-1], v_ok[0], v_ok[-1]], np.uint8)
+
+def _skin_hsv(hsv: np.ndarray) -> np.ndarray:
+    # Bool skin test on 8-bit OpenCV HSV: hue up to 50 (of 180), 0.10 < S < 0.68, 0.2 < V < 0.95.
+    H, S, V = hsv[...,0], hsv[...,1], hsv[...,2]
+    s_lo, s_hi, v_lo, v_hi = _mask(("skin_sv",), _skin_sv_bounds)
+    return (H <= 50) & (S >= s_lo) & (S <= s_hi) & (V >= v_lo) & (V <= v_hi)
+
+# ---------------- Cyberpunk v3 ----------------
+
+def _thin_edges(e: np.ndarray, hi_q=0.95) -> np.ndarray:
+    # I keep only the thinnest, strongest edges for glow.
+    import cv2
+    t = float(np.quantile(e, hi_q))
+    e = (e >= t).astype(np.uint8)
+    k = cv2.getStructuringElement(cv2.MORPH_RECT, (3,3))
+    e = cv2.morphologyEx(e, cv2.MORPH_OPEN, k, iterations=1)
+    e = cv2.dilate(e, k, iterations=1)
+    e = cv2.GaussianBlur(e.astype(np.float32), (0,0), 1.2)
+    return e
+
+def _glow_color(h: int) -> np.ndarray:
+    # (h, 1, 3): the edge glow fades from teal at the top to magenta at the bottom.
+    y = (np.arange(h, dtype=np.float32) / max(h - 1, 1))[:, None]
+    grad_mag  = np.clip(1.2*y - 0.1, 0.0, 1.0)
+    grad_teal = 1.0 - grad_mag
+    return np.stack([
+        1.0*grad_mag + 0.0*grad_teal,
+        0.10*grad_mag + 1.0*grad_teal,
+        0.90*grad_mag + 1.0*grad_teal,
+    ], axis=2)
+
+def _scanlines(h: int, strength: float) -> np.ndarray:
+    # (h, 1, 1): brightness of each row under the scanlines (a 3 px period).
+    yy = np.arange(h, dtype=np.float32)[:, None]
+    lines = 0.5*(1.0 + np.sin(2.0*np.pi*yy/3.0))
+    return (1.0 - strength*(1.0 - lines)).astype(np.float32)[:, :, None]
+
+def _tone_cyberpunk(buf, arr: np.ndarray, tone_mix: float) -> np.ndarray:
+    # I teal the shadows and magenta the highlights of `arr` (used up as scratch) into buf("toned").
+    gray = np.mean(arr, axis=2, keepdims=True, out=buf("c0", 1))
+    w_teal = np.multiply(gray, 1.4, out=buf("c1", 1))
+    np.subtract(1.0, w_teal, out=w_teal)
+    np.clip(w_teal, 0.0, 1.0, out=w_teal)
+    w_mag = gray
+    w_mag *= 1.4
+    w_mag -= 0.2
+    np.clip(w_mag, 0.0, 1.0, out=w_mag)
+    teal    = np.array([0.0,1.0,1.0], dtype=np.float32)[None,None,:]
+    magenta = np.array([1.0,0.0,0.9], dtype=np.float32)[None,None,:]
+    toned = np.multiply(arr, 1.0 - tone_mix, out=buf("toned", 3))
+    work = np.multiply(w_teal, teal, out=buf("work", 3))
+    work += np.multiply(w_mag, magenta, out=arr)
+    work *= tone_mix
+    toned += work
+    np.clip(toned, 0.0, 1.0, out=toned)
+    return toned
+
+@stages.timed("grade")
+def grade_cyberpunk(
+    pil_img: Image.Image,
+    edges_for_glow: Image.Image|None,
+    bg_mask_for_edges: Image.Image|None = None,
+    neon: float = 0.30,
+    bloom: float = 0.34,
+    scanlines: float = 0.0,
+    protect_skin: bool = True,
+    tone_mix: float = 0.10,
+    glow_sigma: float = 2.0,
+    bloom_sigma: float = 5.0,
+    bloom_thresh: float = 0.75,
+    ca_px: int = 0,
+    edge_q: float = 0.985,
+    skin_suppress: float = 0.95,
+    add_dither: bool = True,
+    strip_rows: int | None = None,
+    bloom_quality: str | None = None,
+    rng: np.random.Generator | None = None,
+) -> Image.Image:
+    # I push teal/magenta, add edge glow + bloom, and keep skin safe.
+    # Three 3-channel float buffers do the colour work: rgb (the input, later scratch),
+    # toned (becomes the output) and work.
+    import cv2
+    src = _rgb_array(pil_img)
+    h, w = src.shape[:2]
+    # Glow reaches through the skin blur and the glow blur, bloom through its own blur; the
+    # sharpening at the end blurs their result once more.
+    glow_reach, glow_align = bloom_geometry(glow_sigma, bloom_quality)
+    bloom_reach, bloom_align = bloom_geometry(bloom_sigma, bloom_quality)
+    glow_reach += _blur_radius(3.0) if protect_skin else 0
+    halo = max(glow_reach, bloom_reach) + _blur_radius(0.8)
+    rows, bands = _bands(h, halo, strip_rows, max(glow_align, bloom_align))
+    ar = arena()
+    buf = _scratch(ar, rows, w)
+
+    # The edge map is a whole-frame affair (Canny's hysteresis, the quantile in _thin_edges), but
+    # it is one channel: I build it first, toning strip by strip for the Canny input.
+    if edges_for_glow is not None:
+        e_img = edges_for_glow.resize((w, h), Image.LANCZOS).convert("L")
+        e = np.asarray(e_img).astype(np.float32)/255.0
+    else:
+        g = np.empty((h, w), np.uint8)
+        nbk = _kernels()
+        for y0, y1, _, _ in bands:
+            buf.n = y1 - y0
+            if nbk is not None:
+                toned = buf("toned", 3)
+                nbk.cp_tone(src[y0:y1], toned, _NO2, np.float32(tone_mix), np.float32(1.0 - tone_mix),
+                            np.float32(bloom_thresh))
+            else:
+                toned = _tone_cyberpunk(buf, _load_rgb(src[y0:y1], buf("rgb", 3)), tone_mix)
+            toned8 = buf("toned8", 3, dtype=np.uint8)
+            _store(toned, toned8)
+            cv2.cvtColor(toned8, cv2.COLOR_RGB2GRAY, dst=g[y0:y1])
+        e = cv2.Canny(g, 80, 160).astype(np.float32)/255.0
+
+    if bg_mask_for_edges is not None:
+        bg = ImageOps.invert(bg_mask_for_edges).resize((w,h), Image.NEAREST)
+        bg = np.asarray(bg).astype(np.float32)/255.0
+        e = e * (bg > 0.5).astype(np.float32)
+
+    e = _thin_edges(e, hi_q=edge_q)
+    e = cv2.GaussianBlur(e, (0,0), 1.2)           # (h, w)
+
+    out8 = np.empty((h, w, 3), np.uint8)
+    grain_seed = _grain_seed(rng) if add_dither else None
+    ca = ca_px % w if ca_px > 0 else 0
+    glow_color = _mask(("glow_color", h), lambda: _glow_color(h))
+    if scanlines > 0:
+        lines = _mask(("scanlines", h, float(scanlines)), lambda: _scanlines(h, float(scanlines)))
+    nbk = _kernels()
+    f32 = np.float32
+    for y0, y1, e0, e1 in bands:
+        buf.n = e1 - e0
+        work = buf("work", 3)
+        if nbk is not None:
+            toned, lum = buf("toned", 3), buf("c0")
+            nbk.cp_tone(src[e0:e1], toned, lum, f32(tone_mix), f32(1.0 - tone_mix), f32(bloom_thresh))
+        else:
+            toned = _tone_cyberpunk(buf, _load_rgb(src[e0:e1], buf("rgb", 3)), tone_mix)
+
+        skin_f = None
+        if protect_skin:
+            # The skin test on the 8-bit input (what `arr` would give back as uint8, exactly).
+            hsv = cv2.cvtColor(np.ascontiguousarray(src[e0:e1]), cv2.COLOR_RGB2HSV)
+            skin_f = buf("c1")
+            np.copyto(skin_f, _skin_hsv(hsv))
+            skin_f = cv2.GaussianBlur(skin_f, (0,0), 3.0, dst=buf("c2"))
+
+        if nbk is not None:
+            lit = buf("rgb", 3)
+            nbk.cp_lit(e[e0:e1], _NO2 if skin_f is None else skin_f, f32(skin_suppress),
+                       glow_color[e0:e1], lit)
+        else:
+            eb = buf("e")
+            np.copyto(eb, e[e0:e1])
+            if skin_f is not None:
+                skin_f *= skin_suppress
+                np.subtract(1.0, skin_f, out=skin_f)
+                eb *= skin_f
+            lit = np.multiply(eb[..., None], glow_color[e0:e1], out=buf("rgb", 3))
+        glow = bloom_blur(lit, glow_sigma, bloom_quality, out=work, padded=lambda pad: buf.padded("pad", pad, 3))
+
+        if nbk is None:
+            lum = np.max(toned, axis=2, keepdims=True, out=buf("c0", 1))[..., 0]
+            lum -= bloom_thresh
+            np.clip(lum, 0.0, 1.0, out=lum)
+        bloom_map = bloom_blur(lum, bloom_sigma, bloom_quality, out=buf("c2"),
+                               padded=lambda pad: buf.padded("pad", pad))
+
+        out = toned
+        if nbk is not None:
+            nbk.cp_screen(out, glow, bloom_map, f32(np.clip(neon, 0, 1)), f32(np.clip(bloom, 0, 1)),
+                          lines[e0:e1] if scanlines > 0 else _NO3)
+        else:
+            _screen_into(out, glow, neon)
+            _screen_into(out, bloom_map[..., None], bloom)
+            if scanlines > 0:
+                out *= lines[e0:e1]
+                np.clip(out, 0.0, 1.0, out=out)
+
+        if ca:
+            # Red shifts left, blue right (np.roll along x), through one channel-sized copy.
+            ch = buf("c2")
+            np.copyto(ch, out[..., 0])
+            out[:, :-ca, 0] = ch[:, ca:]
+            out[:, -ca:, 0] = ch[:, :ca]
+            np.copyto(ch, out[..., 2])
+            out[:, ca:, 2] = ch[:, :-ca]
+            out[:, :ca, 2] = ch[:, -ca:]
+
+        diff = cv2.GaussianBlur(out, (0,0), 0.8, dst=work)
+        out = out[y0 - e0:y1 - e0]
+        diff = diff[y0 - e0:y1 - e0]
+        buf.n = y1 - y0
+        if nbk is not None:
+            noise, grain = _NO3, f32(0.0)
+            if grain_seed is not None:
+                noise, grain = grain_into(grain_seed, y0, buf("rgb", 3)), f32(0.002)
+            nbk.cp_finish(out, diff, noise, grain, out8[y0:y1])
+            continue
+        np.subtract(out, diff, out=diff)
+        # clip(max(clip(d)) * 1.5) == clip(max(d) * 1.5): no clipped copy of the whole diff needed.
+        weight = np.max(diff, axis=2, keepdims=True, out=buf("c0", 1))
+        np.clip(weight, 0.0, 1.0, out=weight)
+        weight *= 1.5
+        np.clip(weight, 0.0, 1.0, out=weight)
+        weight *= 0.30
+        diff *= weight
+        out += diff
+        np.clip(out, 0.0, 1.0, out=out)
+
+        if grain_seed is not None:
+            noise = grain_into(grain_seed, y0, buf("rgb", 3))
+            noise *= 0.002
+            out += noise
+            np.clip(out, 0.0, 1.0, out=out)
+        _store(out, out8[y0:y1])
+
+    ar.trim()
+    return Image.fromarray(out8)
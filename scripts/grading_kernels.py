@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+# I hold Numba versions of the grades' per-pixel passes (scripts/grading.py). Each kernel fuses
+# what the NumPy path does in several whole-strip array passes (tone mixing, skin masks, screen
+# blends, the filmic curve, grain, the final 8-bit store) into one loop, parallel over rows.
+# The blurs, Canny and HSV conversion stay with OpenCV/SciPy.
+#
+# grading.py uses me when numba imports (ARTIFY_GRADE_NUMBA=0 keeps the NumPy path). I follow
+# the NumPy path's float32 arithmetic step for step, so the two agree to within rounding
+# (tests/backend/test_grading.py checks they stay within one 8-bit level).
+# Kernels compile on first use and are cached next to this file (see _jit below).
+#
+# Resident mode grades on several threads at once, so the kernels must be safe to launch
+# concurrently. Numba's workqueue threading layer isn't (it aborts the process), TBB and OpenMP
+# are: I ask for one of those, and where neither is installed I compile the kernels serial
+# (prange is then a plain range). Either way every grading thread runs its kernels right away.
+
+import numba as nb
+import numpy as np
+from numba import prange
+
+
+def _threadsafe_layer() -> bool:
+    # I keep an explicit NUMBA_THREADING_LAYER; every layer but workqueue takes concurrent launches.
+    layer = nb.config.THREADING_LAYER
+    if layer != "default":
+        return layer != "workqueue"
+    for pool in ("tbbpool", "omppool"):
+        try:
+            __import__(f"numba.np.ufunc.{pool}")
+        except ImportError:
+            continue
+        nb.config.THREADING_LAYER = "threadsafe"
+        return True
+    return False
+
+
+PARALLEL = _threadsafe_layer()
+
+# numba's on-disk cache doesn't tell a serial build from a parallel one, so only the parallel
+# build is cached; the serial fallback compiles once per process.
+_jit = nb.njit(parallel=PARALLEL, cache=PARALLEL, nogil=True)
+_inline = nb.njit(inline="always", cache=True)
+
+_0 = np.float32(0.0)
+_1 = np.float32(1.0)
+_255 = np.float32(255.0)
+
+
+@_inline
+def _clip01(v):
+    # min/max rather than a conditional: it compiles to branch-free code, which matters once a
+    # good share of the pixels clip.
+    return min(max(v, _0), _1)
+
+
+@_inline
+def _store8(v):
+    # (v*255).astype(uint8) for v in 0..1.
+    return np.uint8(v * _255)
+
+
+@_inline
+def _unit(p):
+    return np.float32(p) / _255
+
+
+@_inline
+def _luma(r, g, b):
+    # Same order as _luminance_into: ((r·kr) + g·kg) + b·kb.
+    return r * np.float32(0.2126) + g * np.float32(0.7152) + b * np.float32(0.0722)
+
+
+@_jit
+def luma(src, out):
+    # Luminance of the uint8 RGB `src`, as _luminance_into computes it on src/255.
+    for y in prange(src.shape[0]):
+        for x in range(src.shape[1]):
+            out[y, x] = _luma(_unit(src[y, x, 0]), _unit(src[y, x, 1]), _unit(src[y, x, 2]))
+
+
+# ---------------- Noir ----------------
+
+@_jit
+def noir_contrast(luma, blur, bright, thresh):
+    # luma becomes l2 = clip(luma + 0.65·clip(luma - blur)); bright = clip(l2 - thresh).
+    for y in prange(luma.shape[0]):
+        for x in range(luma.shape[1]):
+            l2 = _clip01(luma[y, x] + _clip01(luma[y, x] - blur[y, x]) * np.float32(0.65))
+            luma[y, x] = l2
+            bright[y, x] = _clip01(l2 - thresh)
+
+
+@_jit
+def noir_curve(l2, halo, vig, halation, lift, lift_div):
+    # Halation, vignette and the filmic lift, in place on l2. The gamma that follows is left to
+    # np.power: its SIMD loop beats a scalar pow per pixel several times over.
+    for y in prange(l2.shape[0]):
+        for x in range(l2.shape[1]):
+            v = _clip01(l2[y, x] + halo[y, x] * halation)
+            v = _clip01(v * vig[y, x])
+            l2[y, x] = (_clip01(v) + lift) / lift_div
+
+
+@_jit
+def noir_finish(v, gain, noise, grain, out8):
+    # Filmic gain, then gray → RGB with per-channel grain, stored as uint8.
+    # `noise` is (rows, w, 3) standard normal draws, used only if `grain` > 0.
+    for y in prange(v.shape[0]):
+        for x in range(v.shape[1]):
+            g = _clip01(v[y, x] * gain)
+            if grain > _0:
+                for c in range(3):
+                    out8[y, x, c] = _store8(_clip01(g + noise[y, x, c] * grain))
+            else:
+                g8 = _store8(g)
+                for c in range(3):
+                    out8[y, x, c] = g8
+
+
+# ---------------- Cinematic v5 ----------------
+
+@_jit
+def v5_tone(src, a, lum, shadow_w, highlight_w, teal, orange, tone_mix, warm_mids, skin):
+    # Teal shadows / orange highlights (and warm mids for scenes) into `a`, given the luminance and
+    # the two sigmoid weights; NumPy's SIMD exp computes those faster than a scalar exp here.
+    # For portraits (`skin` has rows) I also mark skin-coloured pixels as 1.0.
+    for y in prange(src.shape[0]):
+        for x in range(src.shape[1]):
+            r, g, b = _unit(src[y, x, 0]), _unit(src[y, x, 1]), _unit(src[y, x, 2])
+            l = lum[y, x]
+            sw, hw = shadow_w[y, x], highlight_w[y, x]
+            keep = _1 - _clip01(sw + hw) * tone_mix
+            r = _clip01(r * keep + (teal[0] * sw + orange[0] * hw) * tone_mix)
+            g = _clip01(g * keep + (teal[1] * sw + orange[1] * hw) * tone_mix)
+            b = _clip01(b * keep + (teal[2] * sw + orange[2] * hw) * tone_mix)
+            if warm_mids:
+                mid = (_clip01((l - np.float32(0.45)) / np.float32(0.20))
+                       * _clip01((np.float32(0.65) - l) / np.float32(0.20)) * np.float32(0.06))
+                r += mid
+                g += mid * np.float32(0.5)
+            a[y, x, 0], a[y, x, 1], a[y, x, 2] = r, g, b
+            if skin.shape[0]:
+                is_skin = (r > g) and (r > b) and (r > np.float32(0.30)) and (l > np.float32(0.20)) and (l < np.float32(0.90))
+                skin[y, x] = _1 if is_skin else _0
+
+
+@_jit
+def v5_skin(a, src, m, lum, skin_suppress):
+    # Pull skin back toward the input by the blurred skin mask `m`, and warm its midtones a little.
+    for y in prange(a.shape[0]):
+        for x in range(a.shape[1]):
+            wgt = m[y, x] * np.float32(0.40) * skin_suppress
+            keep = _1 - wgt
+            for c in range(3):
+                a[y, x, c] = a[y, x, c] * keep + _unit(src[y, x, c]) * wgt
+            l = lum[y, x]
+            if l > np.float32(0.35) and l < np.float32(0.65):
+                a[y, x, 0] += m[y, x] * np.float32(0.10)
+                a[y, x, 1] += m[y, x] * np.float32(0.05)
+
+
+@_jit
+def v5_contrast_lit(a, lum, contrast, lit):
+    # Contrast around mid-grey (if `contrast` > 0), then the glow source `lit` = a · bright(lum)
+    # (if `lit` has rows).
+    for y in prange(a.shape[0]):
+        thr = np.float32(0.0)
+        for x in range(a.shape[1]):
+            if lit.shape[0]:
+                thr = _clip01((lum[y, x] - np.float32(0.60)) / np.float32(0.40))
+            for c in range(3):
+                v = a[y, x, c]
+                if contrast > _0:
+                    v = _clip01((v - np.float32(0.5)) * contrast + np.float32(0.5))
+                    a[y, x, c] = v
+                if lit.shape[0]:
+                    lit[y, x, c] = v * thr
+
+
+@_jit
+def v5_finish(a, glow, bloom, out8):
+    # Add the glow (if `glow` has rows) and store as uint8.
+    for y in prange(out8.shape[0]):
+        for x in range(out8.shape[1]):
+            for c in range(3):
+                v = a[y, x, c]
+                if glow.shape[0]:
+                    v = _clip01(v + glow[y, x, c] * bloom)
+                out8[y, x, c] = _store8(_clip01(v))
+
+
+# ---------------- Cyberpunk v3 ----------------
+
+@_jit
+def cp_tone(src, toned, lum, tone_mix, keep, bloom_thresh):
+    # Teal shadows / magenta highlights into `toned`; `lum` (if it has rows) gets the bloom source
+    # clip(max(toned) - bloom_thresh).
+    for y in prange(src.shape[0]):
+        for x in range(src.shape[1]):
+            r, g, b = _unit(src[y, x, 0]), _unit(src[y, x, 1]), _unit(src[y, x, 2])
+            gray = (r + g + b) / np.float32(3.0)
+            w_teal = _clip01(_1 - gray * np.float32(1.4))
+            w_mag = _clip01(gray * np.float32(1.4) - np.float32(0.2))
+            r = _clip01(r * keep + w_mag * tone_mix)
+            g = _clip01(g * keep + w_teal * tone_mix)
+            b = _clip01(b * keep + (w_teal + w_mag * np.float32(0.9)) * tone_mix)
+            toned[y, x, 0], toned[y, x, 1], toned[y, x, 2] = r, g, b
+            if lum.shape[0]:
+                lum[y, x] = _clip01(max(r, g, b) - bloom_thresh)
+
+
+@_jit
+def cp_lit(e, skin_f, skin_suppress, glow_color, lit):
+    # Edge glow source: the edge map, dimmed on skin (if `skin_f` has rows), times the row's colour.
+    for y in prange(e.shape[0]):
+        for x in range(e.shape[1]):
+            v = e[y, x]
+            if skin_f.shape[0]:
+                v = v * (_1 - skin_f[y, x] * skin_suppress)
+            for c in range(3):
+                lit[y, x, c] = v * glow_color[y, 0, c]
+
+
+@_inline
+def _screen(a, b, k):
+    return _1 - (_1 - a) * (_1 - _clip01(b) * k)
+
+
+@_jit
+def cp_screen(out, glow, bloom_map, neon, bloom, lines):
+    # Screen the glow and bloom over `out`, then the scanlines (if `lines` has rows).
+    for y in prange(out.shape[0]):
+        for x in range(out.shape[1]):
+            for c in range(3):
+                v = _screen(_screen(out[y, x, c], glow[y, x, c], neon), bloom_map[y, x], bloom)
+                if lines.shape[0]:
+                    v = _clip01(v * lines[y, 0, 0])
+                out[y, x, c] = v
+
+
+@_jit
+def cp_finish(out, blur, noise, grain, out8):
+    # Unsharp step (weighted by the strongest channel's detail), grain, and the uint8 store.
+    for y in prange(out.shape[0]):
+        for x in range(out.shape[1]):
+            d0 = out[y, x, 0] - blur[y, x, 0]
+            d1 = out[y, x, 1] - blur[y, x, 1]
+            d2 = out[y, x, 2] - blur[y, x, 2]
+            weight = _clip01(_clip01(max(d0, d1, d2)) * np.float32(1.5)) * np.float32(0.30)
+            for c, d in ((0, d0), (1, d1), (2, d2)):
+                v = _clip01(out[y, x, c] + d * weight)
+                if grain > _0:
+                    v = _clip01(v + noise[y, x, c] * grain)
+                out8[y, x, c] = _store8(v)
+
+
+# ---------------- 8-bit finishing ----------------
+
+@_inline
+def _saturate(r, g, b, lut):
+    # PIL's RGB → HSV → RGB round trip (Convert.c rgb2hsv_row / hsv2rgb) with S mapped through
+    # `lut`, keeping C's float/double steps so every colour comes out as PIL makes it.
+    f32, f64 = np.float32, np.float64
+    maxc = max(r, g, b)
+    minc = min(r, g, b)
+    if maxc == minc:
+        return r, g, b
+    cr = f32(maxc - minc)
+    s = cr / f32(maxc)
+    rc = f32(maxc - r) / cr
+    gc = f32(maxc - g) / cr
+    bc = f32(maxc - b) / cr
+    if r == maxc:
+        h = bc - gc
+    elif g == maxc:
+        h = f32(2.0 + f64(rc) - f64(bc))
+    else:
+        h = f32(4.0 + f64(gc) - f64(rc))
+    h6 = f64(h) / 6.0 + 1.0
+    h = f32(h6 - np.floor(h6))                     # fmod(h6, 1.0); h6 is positive
+    uh = np.int32(f64(h) * 255.0)
+    s2 = np.int32(lut[np.int32(f64(s) * 255.0)])
+    v = maxc
+    if s2 == 0:
+        return v, v, v
+    hh = f64(uh) * 6.0 / 255.0
+    i = np.int32(np.floor(hh))
+    f = f64(f32(hh - f64(i)))
+    fs = f64(f32(f64(s2) / 255.0))
+    fv = f64(v)
+    # C's round() on non-negative values.
+    p = np.int32(np.floor(fv * (1.0 - fs) + 0.5))
+    q = np.int32(np.floor(fv * (1.0 - fs * f) + 0.5))
+    t = np.int32(np.floor(fv * (1.0 - fs * (1.0 - f)) + 0.5))
+    i %= 6
+    if i == 0:
+        return v, t, p
+    if i == 1:
+        return q, v, p
+    if i == 2:
+        return p, v, t
+    if i == 3:
+        return p, q, v
+    if i == 4:
+        return t, p, v
+    return v, p, q
+
+
+@_jit
+def finish8(src, blur, unsharp, sat, dither, out8):
+    # The 8-bit finishing steps in one pass, each only if its table has entries: PIL's unsharp
+    # mask as `unsharp[pixel, blurred pixel]`, saturation through PIL's HSV round trip, and the
+    # ordered dither (grading._bayer_luts).
+    for y in prange(src.shape[0]):
+        py = y & 1
+        for x in range(src.shape[1]):
+            r = np.int32(src[y, x, 0])
+            g = np.int32(src[y, x, 1])
+            b = np.int32(src[y, x, 2])
+            if unsharp.shape[0]:
+                r = np.int32(unsharp[r, blur[y, x, 0]])
+                g = np.int32(unsharp[g, blur[y, x, 1]])
+                b = np.int32(unsharp[b, blur[y, x, 2]])
+            if sat.shape[0]:
+                r, g, b = _saturate(r, g, b, sat)
+            if dither.shape[0]:
+                px = (x & 1) * 3
+                r = np.int32(dither[py, 0, r, px])
+                g = np.int32(dither[py, 0, g, px + 1])
+                b = np.int32(dither[py, 0, b, px + 2])
+            out8[y, x, 0] = r
+            out8[y, x, 1] = g
+            out8[y, x, 2] = b
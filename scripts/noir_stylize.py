@@ -2,12 +2,19 @@
 # -*- coding: utf-8 -*-
 # I turn a photo into a noir/film look. I keep comments short and first-person.
 
-import os, argparse, random
+import os, sys, argparse
 from pathlib import Path
 import numpy as np
-from PIL import Image, ImageFilter
+from PIL import Image
 import torch
 
+import pipeline_cache
+import worker_serve
+import step_hooks
+import stages
+from grading import pil_to_numpy
+import postfx
+
 # ---- CLI ----
 def build_parser():
     # I collect simple flags so I can run this from the terminal.
@@ -40,75 +47,19 @@ def build_parser():
     return p
 
 # ---- Utils ----
-def set_seed(seed: int):
-    # I make runs repeatable.
-    random.seed(seed); np.random.seed(seed)
-    torch.manual_seed(seed); torch.cuda.manual_seed_all(seed)
-
 def load_image(path: str, max_side: int) -> Image.Image:
     # I load RGB and shrink if it's too big.
-    img = Image.open(path).convert("RGB")
+    return fit_max_side(Image.open(path).convert("RGB"), max_side)
+
+@stages.timed("resize")
+def fit_max_side(img: Image.Image, max_side: int) -> Image.Image:
+    # I shrink in-memory images the same way load_image does for files.
     w, h = img.size
     scale = max_side / float(max(w, h))
     if scale < 1.0:
         img = img.resize((int(w*scale), int(h*scale)), Image.LANCZOS)
     return img
 
-def pil_to_numpy(img: Image.Image) -> np.ndarray:
-    return np.asarray(img).astype(np.float32)/255.0
-
-def numpy_to_pil(arr: np.ndarray) -> Image.Image:
-    arr = np.clip(arr, 0.0, 1.0)
-    return Image.fromarray((arr*255.0).astype(np.uint8))
-
-# ---- Noir grade (post) ----
-def grade_noir(pil_img: Image.Image,
-               vignette=0.18, halation=0.28,
-               bloom_sigma=3.0, bloom_thresh=0.70,
-               dither_std=0.002,
-               filmic_lift=0.02, filmic_gamma=0.96, filmic_gain=1.02) -> Image.Image:
-    # I do grayscale luma, local contrast, bloom/halation, vignette, and light grain.
-    import cv2, numpy as np
-    from PIL import ImageFilter
-
-    arr = pil_to_numpy(pil_img)                      # HxWx3
-    luma = (0.2126*arr[...,0] + 0.7152*arr[...,1] + 0.0722*arr[...,2]).astype(np.float32)  # HxW
-
-    # Local contrast on luma
-    blur = cv2.GaussianBlur(luma, (0,0), 1.2)
-    hp   = np.clip(luma - blur, 0.0, 1.0)
-    l2   = np.clip(luma + 0.65*hp, 0.0, 1.0)
-
-    # Bloom / halation
-    bright = np.clip(l2 - float(bloom_thresh), 0.0, 1.0)
-    halo   = cv2.GaussianBlur(bright, (0,0), float(bloom_sigma))
-    out2d  = np.clip(l2 + float(halation)*halo, 0.0, 1.0)
-
-    # Vignette
-    h, w = out2d.shape
-    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
-    r = np.sqrt(((xx - w/2)/(0.9*w))**2 + ((yy - h/2)/(0.9*h))**2)
-    vig = np.clip(1.0 - float(vignette)*(r**1.5), 0.0, 1.0)
-    out2d = np.clip(out2d * vig, 0.0, 1.0)
-
-    # Filmic curve (lift/gamma/gain)
-    def _filmic(x, lift=0.02, gamma=0.95, gain=1.04):
-        x = np.clip(x, 0, 1)
-        x = (x + lift) / (1.0 + lift)
-        x = np.power(x, gamma)
-        x = np.clip(x * gain, 0, 1)
-        return x
-
-    out2d = _filmic(out2d, lift=float(filmic_lift), gamma=float(filmic_gamma), gain=float(filmic_gain))
-
-    # Back to RGB + tiny grain
-    out = np.stack([out2d, out2d, out2d], axis=2)
-    if dither_std and dither_std > 0:
-        out = np.clip(out + np.random.normal(0, float(dither_std), out.shape).astype(np.float32), 0.0, 1.0)
-
-    pil = numpy_to_pil(out).filter(ImageFilter.UnsharpMask(radius=1, percent=110, threshold=6))
-    return pil
-
 # ---- Control preprocessors ----
 def make_canny_cond(pil_img: Image.Image) -> Image.Image:
     # I build a simple Canny edge map for ControlNet.
@@ -118,12 +69,13 @@ def make_canny_cond(pil_img: Image.Image) -> Image.Image:
     return Image.fromarray(edges).convert("RGB")
 
 # ---- Pipeline factory ----
+CANNY_CONTROLNET = "lllyasviel/sd-controlnet-canny"
+
 def build_pipeline(args):
     # I create SD 1.5 img2img, with optional Canny ControlNet.
     from diffusers import (
         StableDiffusionImg2ImgPipeline,
         StableDiffusionControlNetImg2ImgPipeline,
-        ControlNetModel,
         DPMSolverMultistepScheduler,
         UniPCMultistepScheduler,
     )
@@ -131,12 +83,13 @@ def build_pipeline(args):
     dtype = torch.float16 if (device == "cuda") else torch.float32
     base = "runwayml/stable-diffusion-v1-5"
 
+    # I reuse the process-wide base weights and ControlNet so resident runs load them once.
+    shared = pipeline_cache.shared_modules(base, dtype)
     if args.control == "canny":
-        control_id = "lllyasviel/sd-controlnet-canny"
-        controlnet = ControlNetModel.from_pretrained(control_id, torch_dtype=dtype)
-        pipe = StableDiffusionControlNetImg2ImgPipeline.from_pretrained(base, controlnet=controlnet, torch_dtype=dtype).to(device)
+        controlnet = pipeline_cache.controlnet(CANNY_CONTROLNET, dtype)
+        pipe = StableDiffusionControlNetImg2ImgPipeline.from_pretrained(base, controlnet=controlnet, torch_dtype=dtype, **shared).to(device)
     else:
-        pipe = StableDiffusionImg2ImgPipeline.from_pretrained(base, torch_dtype=dtype, safety_checker=None).to(device)
+        pipe = StableDiffusionImg2ImgPipeline.from_pretrained(base, torch_dtype=dtype, safety_checker=None, **shared).to(device)
 
     # Scheduler
     if args.scheduler == "uni":
@@ -162,46 +115,17 @@ def build_pipeline(args):
 
     return pipe
 
-# ---- Main ----
-def main():
-    parser = build_parser()
-    args = parser.parse_args()
-    set_seed(args.seed)
-
-    # I keep portrait strength modest so faces stay recognizable.
-    if args.subject == "portrait" and args.strength > 0.28:
-        print("[warn] For portraits, --strength > 0.28 may cause identity drift.")
-
-    # Load & prep image
-    inp = load_image(args.input, args.max_side)
-
-    # Build pipeline
-    pipe = build_pipeline(args)
-
-    # Optional ControlNet input
-    control_image = make_canny_cond(inp) if args.control == "canny" else None
-
-    # Inference
-    gen = torch.Generator(device=pipe.device).manual_seed(args.seed)
-    common_kwargs = dict(
-        prompt=args.prompt,
-        negative_prompt=args.negative_prompt,
-        image=inp,
-        strength=args.strength,
-        guidance_scale=args.guidance,
-        num_inference_steps=args.steps,
-        generator=gen
-    )
-    if control_image is not None:
-        out = pipe(control_image=control_image, controlnet_conditioning_scale=float(args.control_scale), **common_kwargs)
-    else:
-        out = pipe(**common_kwargs)
+def pipeline_key(args):
+    # I key cached pipelines on everything build_pipeline() reads from args.
+    return ("noir", args.control, args.scheduler, args.mem_attn)
 
-    result = out.images[0]
-
-    # Post grade to get the noir look
-    noir = grade_noir(
+# ---- Stylize (shared by CLI and in-process callers) ----
+def _grade(result: Image.Image, args) -> Image.Image:
+    # Post grade to get the noir look. The grain draws from a generator of this run's own seed
+    # (not the global RNG, which concurrent resident runs share), so a seeded run repeats exactly.
+    return postfx.noir(
         result,
+        rng=np.random.default_rng(args.seed),
         vignette=float(args.noir_vignette),
         halation=float(args.noir_halation),
         bloom_sigma=float(args.noir_bloom_sigma),
@@ -212,8 +136,66 @@ def main():
         filmic_gain=float(args.noir_gain),
     )
 
+def stylize_batch(images, args_list):
+    """
+    I stylize several images in one img2img call. All `args_list` entries must share the
+    same flags except --seed (each item keeps its own generator); images that end up with
+    different sizes after --max-side are run as separate sub-batches.
+    """
+    args = args_list[0]
+    # I keep portrait strength modest so faces stay recognizable.
+    if args.subject == "portrait" and args.strength > 0.28:
+        print("[warn] For portraits, --strength > 0.28 may cause identity drift.")
+
+    srcs = [fit_max_side(im.convert("RGB"), args.max_side) for im in images]
+    groups = {}
+    for i, src in enumerate(srcs):
+        groups.setdefault(src.size, []).append(i)
+
+    results = [None] * len(srcs)
+    stages.note("controlNet", CANNY_CONTROLNET if args.control == "canny" else None)
+    # Build (or reuse) pipeline, then run inference while I hold it.
+    with pipeline_cache.use(pipeline_key(args), lambda: build_pipeline(args)) as pipe:
+        for idx in groups.values():
+            n = len(idx)
+            common_kwargs = dict(
+                prompt=[args.prompt] * n,
+                negative_prompt=[args.negative_prompt] * n,
+                image=[srcs[i] for i in idx],
+                strength=args.strength,
+                guidance_scale=args.guidance,
+                num_inference_steps=args.steps,
+                generator=[torch.Generator(device=pipe.device).manual_seed(args_list[i].seed) for i in idx],
+                **step_hooks.pipe_kwargs(),
+            )
+            # Optional ControlNet input
+            if args.control == "canny":
+                out = pipe(control_image=[make_canny_cond(srcs[i]) for i in idx],
+                           controlnet_conditioning_scale=float(args.control_scale), **common_kwargs)
+            else:
+                out = pipe(**common_kwargs)
+            for i, img in zip(idx, out.images):
+                results[i] = img
+
+    return [_grade(img, a) for img, a in zip(results, args_list)]
+
+def stylize_image(inp: Image.Image, args) -> Image.Image:
+    # I run img2img + the noir grade on an already-loaded image and return the graded result.
+    return stylize_batch([inp], [args])[0]
+
+# ---- Main ----
+def main():
+    if "--serve" in sys.argv[1:]:
+        # I stay alive and take jobs over stdin/stdout (see worker_serve.py).
+        return worker_serve.serve(build_parser, stylize_image)
+    parser = build_parser()
+    args = parser.parse_args()
+
+    noir = stylize_image(Image.open(args.input), args)
+
     Path(os.path.dirname(args.output) or ".").mkdir(parents=True, exist_ok=True)
-    noir.save(args.output)
+    with stages.stage("save"):
+        noir.save(args.output)
     print(f"[ok] Saved: {args.output}")
 
 if __name__ == "__main__":
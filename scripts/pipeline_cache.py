@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# I keep diffusers pipelines alive for the life of the process, so repeat runs skip from_pretrained.
+# CLI runs build each pipeline once and exit; resident/worker runs reuse them across requests.
+# Building counts as the "model_load" stage and holding the pipeline as "denoise" (scripts/stages.py);
+# each use also counts as a "pipelineHits" or "pipelineBuilds" note.
+
+import threading, time
+from contextlib import contextmanager
+
+import stages
+
+_PIPES = {}          # key -> pipeline
+_LOCKS = {}          # key -> lock held while a pipeline is in use (pipelines are not thread-safe)
+_MODULES = {}        # (kind, repo, dtype) -> shared torch modules
+_LOAD_MS = {}        # key -> how long the first build took
+_GUARD = threading.RLock()
+
+
+def _lock_for(key):
+    with _GUARD:
+        lock = _LOCKS.get(key)
+        if lock is None:
+            lock = _LOCKS[key] = threading.Lock()
+        return lock
+
+
+def shared_modules(base: str, dtype):
+    # I load the SD base weights once and hand the same UNet/VAE/text encoder to every pipeline
+    # class built on top of them (img2img, ControlNet img2img, inpaint) instead of duplicating them.
+    key = ("base", base, str(dtype))
+    with _lock_for(key):
+        mods = _MODULES.get(key)
+        if mods is None:
+            from diffusers import StableDiffusionPipeline
+            t0 = time.time()
+            sd = StableDiffusionPipeline.from_pretrained(base, torch_dtype=dtype, safety_checker=None)
+            mods = {k: getattr(sd, k) for k in ("vae", "text_encoder", "tokenizer", "unet")}
+            _MODULES[key] = mods
+            _LOAD_MS[key] = int((time.time() - t0) * 1000)
+        return mods
+
+
+def controlnet(repo: str, dtype):
+    # I share ControlNet weights the same way; they are read-only during inference.
+    key = ("controlnet", repo, str(dtype))
+    with _lock_for(key):
+        cn = _MODULES.get(key)
+        if cn is None:
+            from diffusers import ControlNetModel
+            t0 = time.time()
+            cn = ControlNetModel.from_pretrained(repo, torch_dtype=dtype)
+            _MODULES[key] = cn
+            _LOAD_MS[key] = int((time.time() - t0) * 1000)
+        return cn
+
+
+@contextmanager
+def use(key, build):
+    # I build the pipeline on first use and hold its lock while the caller runs it.
+    lock = _lock_for(("pipe",) + tuple(key))
+    with lock:
+        pipe = _PIPES.get(key)
+        if pipe is None:
+            t0 = time.time()
+            with stages.stage("model_load"):
+                pipe = build()
+            _PIPES[key] = pipe
+            _LOAD_MS[key] = int((time.time() - t0) * 1000)
+            stages.count("pipelineBuilds")
+        else:
+            stages.count("pipelineHits")
+        with stages.stage("denoise"):
+            yield pipe
+
+
+def status() -> dict:
+    # I report what is resident and how long each piece took to load.
+    with _GUARD:
+        return {
+            "pipelines": [{"key": list(map(str, k)), "loadMs": _LOAD_MS.get(k)} for k in _PIPES],
+            "modules": [{"key": list(map(str, k)), "loadMs": _LOAD_MS.get(k)} for k in _MODULES],
+        }
+
+
+def clear() -> None:
+    # I drop everything so the next call rebuilds (handy after an OOM).
+    with _GUARD:
+        _PIPES.clear()
+        _MODULES.clear()
+        _LOAD_MS.clear()
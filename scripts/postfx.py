@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# I describe what each style does to a render after diffusion as a small graph of ops, and run
+# it. The ops live in grading.py:
+#   noir / v5 / cyberpunk   the grades: tone, bloom, glow, vignette and grain as fused float
+#                           passes over strips (luminance and the skin tests are shared helpers)
+#   sharpen                 PIL's unsharp mask (percent, threshold)
+#   saturation              scale HSV saturation through a table
+#   dither                  2×2 ordered dither against banding
+#
+# A graph is a list of Op(kind, params), applied in order. Before running it I plan it into
+# stages: each grade is a stage of its own, and adjacent 8-bit ops merge into one
+# grading.finish8 call, which (with numba) reads and writes the frame once for all of them.
+# A sharpen always opens a new stage: its blur reads neighbouring pixels, so the image before
+# it must be complete. Saturation and dither join the stage before them as long as they keep
+# finish8's order (sharpen, saturation, dither). The output is the same as running the ops one
+# by one, which is what the styles' scripts used to do.
+
+from typing import NamedTuple
+
+from PIL import Image
+
+import stages
+import grading
+
+
+class Op(NamedTuple):
+    kind: str
+    params: dict
+
+
+# kind -> fn(image, **params) -> image
+GRADES = {
+    "noir": lambda img, **kw: grading.grade_noir(img, finish=False, **kw),
+    "v5": lambda img, **kw: grading.grade_v5(img, finish=False, **kw),
+    "cyberpunk": grading.grade_cyberpunk,
+}
+
+# The 8-bit ops, in the order one finish8 call applies them.
+FINISHING = ("sharpen", "saturation", "dither")
+
+
+def plan(graph: list) -> list:
+    # I group the graph's ops into stages (lists of ops); see the header for the rules.
+    out = []
+    for op in graph:
+        if op.kind not in GRADES and op.kind not in FINISHING:
+            raise ValueError(f"unknown post-processing op {op.kind!r}")
+        last = out[-1] if out else None
+        if (op.kind in FINISHING and last and last[-1].kind in FINISHING
+                and FINISHING.index(op.kind) > FINISHING.index(last[-1].kind)):
+            last.append(op)
+        else:
+            out.append([op])
+    return out
+
+
+def _finish(img: Image.Image, ops: list) -> Image.Image:
+    kw = {}
+    for op in ops:
+        if op.kind == "sharpen":
+            kw["unsharp"] = (op.params["percent"], op.params["threshold"])
+        elif op.kind == "saturation":
+            kw["saturation"] = op.params["scale"]
+        else:
+            kw["dither"] = True
+    return grading.finish8(img, **kw)
+
+
+@stages.timed("grade")
+def run(img: Image.Image, graph: list) -> Image.Image:
+    for ops in plan(graph):
+        if ops[0].kind in GRADES:
+            img = GRADES[ops[0].kind](img, **ops[0].params)
+        else:
+            img = _finish(img, ops)
+    return img
+
+
+# ---------------- Styles ----------------
+
+def _sharpen(percent: int, threshold: int) -> Op:
+    return Op("sharpen", dict(percent=percent, threshold=threshold))
+
+def noir(img: Image.Image, **grade) -> Image.Image:
+    # `grade`: grade_noir's settings (vignette, halation, bloom, grain, filmic curve).
+    return run(img, [Op("noir", grade), _sharpen(110, 6)])
+
+def cinematic(img: Image.Image, saturation: float = 1.05, add_dither: bool = True, **grade) -> Image.Image:
+    # `grade`: grade_v5's settings (subject, tone_mix, bloom, contrast, skin_suppress).
+    # Cinematic has always sharpened once more after the dither; dropping it would change the look.
+    graph = [Op("v5", grade), _sharpen(115, 5), Op("saturation", dict(scale=saturation))]
+    if add_dither:
+        graph.append(Op("dither", {}))
+    return run(img, graph + [_sharpen(115, 5)])
+
+def cyberpunk(img: Image.Image, sharpen: bool = True, **grade) -> Image.Image:
+    # `grade`: grade_cyberpunk's settings; the grade-only CLI path skips the final sharpen.
+    return run(img, [Op("cyberpunk", grade)] + ([_sharpen(110, 6)] if sharpen else []))
+
+def anime(img: Image.Image) -> Image.Image:
+    # The render keeps its look; a light sharpen restores micro-contrast.
+    return run(img, [_sharpen(120, 8)])
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# I time the stages of a stylize run inside the scripts (resize, model_load, annotator,
+# denoise, inpaint, refine, grade, save) so the backend can publish them (backend/telemetry.py).
+# Next to the timings a run keeps a few facts about itself, e.g. which ControlNet it really
+# used and whether the pipeline and control map came from cache: `note(key, value)` sets one,
+# `count(key)` bumps a counter.
+#
+# `stage(name)` / `@timed(name)` cost nothing unless a recording is active on this thread:
+# - resident mode: the backend's runner wraps the call in `recording()`;
+# - worker mode: worker_serve does the same and sends the timings back with the reply;
+# - subprocess mode: with ARTIFY_STAGES_STDOUT=1 I record the whole process and print one
+#   `@@artify-stages {json}` line to stdout at exit, which the runner picks out of the logs.
+# Either way a recording is {"stages": {name: seconds}, "notes": {key: value}}.
+#
+# Times are exclusive: a stage nested inside another is subtracted from the outer one.
+
+import os, sys, json, time, atexit, threading
+from contextlib import contextmanager
+from functools import wraps
+
+MARKER = "@@artify-stages "
+
+_LOCAL = threading.local()
+
+
+@contextmanager
+def recording():
+    # I collect stage timings and notes for work done on this thread while the block runs.
+    prev = getattr(_LOCAL, "rec", None), getattr(_LOCAL, "stack", None)
+    rec = {"stages": {}, "notes": {}}
+    _LOCAL.rec, _LOCAL.stack = rec, []
+    try:
+        yield rec
+    finally:
+        _LOCAL.rec, _LOCAL.stack = prev
+
+
+@contextmanager
+def stage(name: str):
+    rec = getattr(_LOCAL, "rec", None)
+    if rec is None:
+        yield
+        return
+    stack = _LOCAL.stack
+    frame = [0.0]
+    stack.append(frame)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        stack.pop()
+        if stack:
+            stack[-1][0] += elapsed
+        times = rec["stages"]
+        times[name] = times.get(name, 0.0) + max(0.0, elapsed - frame[0])
+
+
+def timed(name: str):
+    def deco(fn):
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return inner
+    return deco
+
+
+def note(key: str, value) -> None:
+    # Values must be JSON-friendly: they travel over the worker pipe and the stdout marker.
+    rec = getattr(_LOCAL, "rec", None)
+    if rec is not None:
+        rec["notes"][key] = value
+
+
+def count(key: str, n: int = 1) -> None:
+    rec = getattr(_LOCAL, "rec", None)
+    if rec is not None:
+        rec["notes"][key] = rec["notes"].get(key, 0) + n
+
+
+def _print_marker(rec, started):
+    # `started` is wall-clock time, so the runner can tell how long the process took to get here.
+    sys.__stdout__.write(MARKER + json.dumps({"started": started, **rec}) + "\n")
+    sys.__stdout__.flush()
+
+
+if os.environ.get("ARTIFY_STAGES_STDOUT") == "1" and threading.current_thread() is threading.main_thread():
+    # A one-shot CLI run: record everything on the main thread until exit.
+    _LOCAL.rec, _LOCAL.stack = {"stages": {}, "notes": {}}, []
+    atexit.register(_print_marker, _LOCAL.rec, time.time())
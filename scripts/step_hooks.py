@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# I let whoever runs a stylizer watch its denoising loop, and stop it.
+#
+# Scripts splat `**step_hooks.pipe_kwargs()` into their diffusers pipeline calls. When nobody
+# is listening that's an empty dict and the call is exactly what it was; when a reporter or a
+# stop check is active (resident mode: the backend thread; worker mode: worker_serve) it adds a
+# `callback_on_step_end` that reports every step and, every N steps, a cheap preview, and
+# raises `Interrupted` as soon as the stop check says so.
+#
+# The preview is a linear projection of the 4 SD1.5 latent channels straight to RGB — no VAE
+# decode, so it costs well under a millisecond and comes out at latent size (1/8 of the image).
+
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image
+
+# Latent channel → RGB weights for SD1.x latents (the common "cheap approximation" factors).
+SD15_LATENT_RGB = np.array([
+    [0.298, 0.207, 0.208],
+    [0.187, 0.286, 0.173],
+    [-0.158, 0.189, 0.264],
+    [-0.184, -0.271, -0.473],
+], dtype=np.float32)
+
+_LOCAL = threading.local()
+
+
+class Interrupted(BaseException):
+    # A BaseException on purpose: the scripts wrap their stages in `except Exception` fallbacks
+    # (cyberpunk carries on without its inpaint stage), and a stop must not be mistaken for those.
+    pass
+
+
+def latents_to_preview(latents) -> Image.Image:
+    # I take the first item of a (B, 4, h, w) latent batch (torch tensor or numpy array).
+    lat = latents[0]
+    if hasattr(lat, "detach"):
+        lat = lat.detach().float().cpu().numpy()
+    rgb = np.asarray(lat, dtype=np.float32).transpose(1, 2, 0) @ SD15_LATENT_RGB
+    rgb = np.clip((rgb + 1.0) * 127.5, 0, 255).astype(np.uint8)
+    return Image.fromarray(rgb, "RGB")
+
+
+@contextmanager
+def reporting(report, preview_every: int = 5):
+    """
+    I route step events from pipeline calls made on this thread to `report(event)`, where
+    event = {"step": i (1-based), "steps": total, "preview": PIL image or None}.
+    """
+    prev = getattr(_LOCAL, "state", None)
+    _LOCAL.state = (report, max(0, int(preview_every)))
+    try:
+        yield
+    finally:
+        _LOCAL.state = prev
+
+
+@contextmanager
+def stopping(should_stop):
+    # I make pipeline calls on this thread raise Interrupted at the next step once should_stop() is true.
+    prev = getattr(_LOCAL, "stop", None)
+    _LOCAL.stop = should_stop
+    try:
+        yield
+    finally:
+        _LOCAL.stop = prev
+
+
+def _on_step_end(pipe, step, timestep, callback_kwargs):
+    should_stop = getattr(_LOCAL, "stop", None)
+    if should_stop is not None and should_stop():
+        raise Interrupted()
+    state = getattr(_LOCAL, "state", None)
+    if state is None:
+        return callback_kwargs
+    report, every = state
+    steps = getattr(pipe, "num_timesteps", None) or 0
+    done = step + 1
+    preview = None
+    latents = callback_kwargs.get("latents")
+    if every and latents is not None and (done % every == 0 or done == steps):
+        try:
+            preview = latents_to_preview(latents)
+        except Exception as e:
+            print(f"[warn] latent preview failed: {e}")
+    report({"step": done, "steps": steps, "preview": preview})
+    return callback_kwargs
+
+
+def pipe_kwargs() -> dict:
+    # I'm empty unless someone is listening, so plain CLI runs are untouched.
+    if getattr(_LOCAL, "state", None) is None and getattr(_LOCAL, "stop", None) is None:
+        return {}
+    return {"callback_on_step_end": _on_step_end, "callback_on_step_end_tensor_inputs": ["latents"]}
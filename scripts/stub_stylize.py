@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# I'm a stand-in stylizer for load tests on CPU-only machines: no torch, no model weights.
+# I go through everything a real script does (pipeline_cache, step callbacks, stop checks,
+# stage timings, worker mode) but "inference" is a sleep per denoising step while I hold a
+# block of memory, and the grade is the real cinematic one (postfx.cinematic).
+#
+# Timings scale with pixel count, relative to a 512×512 render:
+#   --load-ms     first-use pipeline build (once per process, like from_pretrained)
+#   --step-ms     one denoising step
+#   --mem-mb      working memory held while denoising
+#   --batch-step  extra cost of each additional image in a batched step (fraction of a step)
+
+import sys, time, argparse
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+import pipeline_cache
+import worker_serve
+import step_hooks
+import stages
+import postfx
+
+# ---- CLI ----
+def build_parser():
+    # I take the same flags the backend wrappers pass to every style, plus my cost knobs.
+    p = argparse.ArgumentParser("Photo → Stub (load testing)")
+    p.add_argument("-i", "--input", required=True, help="Input image path")
+    p.add_argument("-o", "--output", required=True, help="Output image path")
+    p.add_argument("--subject", choices=["portrait", "scene"], default="scene")
+    p.add_argument("--control", default="none")
+    p.add_argument("--strength", type=float, default=0.3)
+    p.add_argument("--guidance", type=float, default=6.0)
+    p.add_argument("--steps", type=int, default=25)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--max-side", type=int, default=768)
+    p.add_argument("--load-ms", type=float, default=2000.0)
+    p.add_argument("--step-ms", type=float, default=40.0)
+    p.add_argument("--mem-mb", type=int, default=256)
+    p.add_argument("--batch-step", type=float, default=0.35)
+    p.add_argument("--no-grade", action="store_true")
+    return p
+
+@stages.timed("resize")
+def resize_max_side(img: Image.Image, max_side: int) -> Image.Image:
+    # I keep aspect ratio and snap to /8 like the real scripts.
+    w, h = img.size
+    s = min(1.0, max_side / float(max(w, h)))
+    W, H = max(8, int(w * s) // 8 * 8), max(8, int(h * s) // 8 * 8)
+    return img.resize((W, H), Image.LANCZOS) if (W, H) != (w, h) else img
+
+class StubPipe:
+    # I mimic the bits of a diffusers pipeline that step_hooks looks at.
+    def __init__(self):
+        self.num_timesteps = 0
+
+    def __call__(self, images: List[Image.Image], steps: int, step_ms: float, mem_mb: int,
+                 batch_step: float, seeds: List[int]) -> List[Image.Image]:
+        w, h = images[0].size
+        scale = (w * h) / (512.0 * 512.0)
+        step_s = step_ms / 1000.0 * scale * (1.0 + batch_step * (len(images) - 1))
+        # Touching every page makes the memory real (resident), not just reserved.
+        hold = np.ones(max(0, mem_mb) * 2**20 // 4, dtype=np.float32) if mem_mb > 0 else None
+        hooks = step_hooks.pipe_kwargs()
+        self.num_timesteps = steps
+        rng = np.random.default_rng(seeds[0])
+        latents = rng.standard_normal((1, 4, max(1, h // 8), max(1, w // 8))).astype(np.float32)
+        for i in range(steps):
+            time.sleep(step_s)
+            if hooks:
+                hooks["callback_on_step_end"](self, i, 999 - i, {"latents": latents})
+        del hold
+        return [im.copy() for im in images]
+
+def _pipe_key(args):
+    return ("stub", args.load_ms)
+
+def _build(args):
+    time.sleep(args.load_ms / 1000.0)
+    return StubPipe()
+
+def stylize_batch(images: List[Image.Image], args_list) -> List[Image.Image]:
+    # I "render" several images in one call, the way batched resident runs share a pipeline.
+    args = args_list[0]
+    stages.note("controlNet", None)
+    srcs = [resize_max_side(im.convert("RGB"), args.max_side) for im in images]
+    groups = {}
+    for i, src in enumerate(srcs):
+        groups.setdefault(src.size, []).append(i)
+    outs = [None] * len(srcs)
+    with pipeline_cache.use(_pipe_key(args), lambda: _build(args)) as pipe:
+        for idx in groups.values():
+            rendered = pipe([srcs[i] for i in idx], args.steps, args.step_ms, args.mem_mb,
+                            args.batch_step, [args_list[i].seed for i in idx])
+            for i, img in zip(idx, rendered):
+                outs[i] = img
+    if args.no_grade:
+        return outs
+    return [postfx.cinematic(out, subject=a.subject) for out, a in zip(outs, args_list)]
+
+def stylize_image(src: Image.Image, args) -> Image.Image:
+    return stylize_batch([src], [args])[0]
+
+def main():
+    if "--serve" in sys.argv[1:]:
+        # I stay alive and take jobs over stdin/stdout (see worker_serve.py).
+        return worker_serve.serve(build_parser, stylize_image)
+    args = build_parser().parse_args()
+    out = stylize_image(Image.open(args.input), args)
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    with stages.stage("save"):
+        out.save(args.output)
+    print(f"[ok] Saved: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# I turn a stylizer script into a long-lived worker: `python scripts/<style>.py --serve`.
+# The worker keeps its pipelines loaded (pipeline_cache) and takes jobs over stdin/stdout.
+#
+# Framing: every message is a 4-byte big-endian length followed by that many bytes of UTF-8 JSON.
+# A message with "blobs": n is followed by n raw frames (same length prefix, raw bytes) —
+# that's how pixels travel, as raw RGB, with no PNG encode/decode and no temp files.
+# Requests:  {"op": "run", "id": ..., "argv": [...], "images": [[w, h], ...], "blobs": n}
+#                                                       run one job with the script's own CLI flags;
+#                                                       images[0] is the input, the rest style refs.
+#                                                       (Without "images", argv's -i/-o are file paths.)
+#                                                       With "progress": {"previewEvery": n} I also
+#                                                       stream step events before the reply.
+#            {"op": "ping", "id": ...}                 health check
+#            {"op": "warm", "id": ...}                 load what the script can load up front (annotators)
+#            {"op": "cancel", "id": ...}               stop run `id` at its next denoising step
+#            {"op": "shutdown"}                         exit cleanly
+# Replies:   {"id": ..., "ok": true|false, ...}; the first frame a worker sends is {"op": "ready"}.
+#            In-memory runs reply {"image": [w, h], "blobs": 1} followed by the RGB bytes.
+#            Run replies carry "stages": {name: seconds} and "notes": {key: value} (scripts/stages.py).
+#            Progress: {"id": ..., "op": "progress", "step": i, "steps": n, "preview": [w, h] | null}
+#            (+ 1 RGB blob when there is a preview), zero or more before the reply.
+#            A cancelled run replies {"ok": false, "cancelled": true}.
+# A reader thread takes frames off stdin while a job runs, so "cancel" can arrive mid-job.
+# stdout is reserved for frames, so I point print() at stderr while serving.
+
+import os, sys, json, queue, struct, time, threading, traceback
+from contextlib import nullcontext
+from PIL import Image
+
+import step_hooks
+import stages
+
+_HEADER = struct.Struct(">I")
+
+
+def write_frame(stream, obj) -> None:
+    data = json.dumps(obj).encode("utf-8")
+    stream.write(_HEADER.pack(len(data)))
+    stream.write(data)
+    stream.flush()
+
+
+def _read_exact(stream, n: int) -> bytes:
+    buf = b""
+    while len(buf) < n:
+        chunk = stream.read(n - len(buf))
+        if not chunk:
+            return b""
+        buf += chunk
+    return buf
+
+
+def _read_raw(stream):
+    head = _read_exact(stream, _HEADER.size)
+    if not head:
+        return None
+    (n,) = _HEADER.unpack(head)
+    body = _read_exact(stream, n)
+    if len(body) != n:
+        return None
+    return body
+
+
+def read_frame(stream):
+    # I return None on a clean EOF (the other side went away).
+    body = _read_raw(stream)
+    return None if body is None else json.loads(body.decode("utf-8"))
+
+
+def write_message(stream, obj, blobs=()) -> None:
+    # I send a JSON frame plus its raw blobs back to back, so nothing can interleave.
+    data = json.dumps(dict(obj, blobs=len(blobs)) if blobs else obj).encode("utf-8")
+    stream.write(_HEADER.pack(len(data)))
+    stream.write(data)
+    for blob in blobs:
+        stream.write(_HEADER.pack(len(blob)))
+        stream.write(blob)
+    stream.flush()
+
+
+def read_message(stream):
+    # I return (obj, blobs), or None on EOF; blobs are the raw frames announced by "blobs".
+    obj = read_frame(stream)
+    if obj is None:
+        return None
+    blobs = []
+    for _ in range(int(obj.get("blobs", 0))):
+        blob = _read_raw(stream)
+        if blob is None:
+            return None
+        blobs.append(blob)
+    return obj, blobs
+
+
+def _progress_reporter(stream, rid):
+    def report(event):
+        preview = event.get("preview")
+        frame = {"id": rid, "op": "progress", "step": event["step"], "steps": event["steps"],
+                 "preview": list(preview.size) if preview is not None else None}
+        write_message(stream, frame, (preview.tobytes(),) if preview is not None else ())
+    return report
+
+
+def _run_job(build_parser, stylize_image, req, blobs, frames_out=None, should_stop=None):
+    args = build_parser().parse_args(req["argv"])
+    t0 = time.time()
+    want = req.get("progress")
+    if want and frames_out is not None:
+        hooks = step_hooks.reporting(_progress_reporter(frames_out, req.get("id")), want.get("previewEvery", 5))
+    else:
+        hooks = nullcontext()
+    with hooks, (step_hooks.stopping(should_stop) if should_stop else nullcontext()), stages.recording() as rec:
+        reply, out_blobs = _stylize(stylize_image, args, req, blobs, t0)
+    reply.update(rec)
+    return reply, out_blobs
+
+
+def _stylize(stylize_image, args, req, blobs, t0):
+    if "images" not in req:
+        out = stylize_image(Image.open(args.input), args)
+        with stages.stage("save"):
+            out.save(args.output)
+        return {"output": args.output, "ms": int((time.time() - t0) * 1000)}, ()
+
+    # Pixels came in memory: raw RGB, shaped by the sizes in "images".
+    imgs = [Image.frombuffer("RGB", tuple(size), blob, "raw", "RGB", 0, 1)
+            for size, blob in zip(req["images"], blobs)]
+    if len(imgs) > 1:
+        out = stylize_image(imgs[0], args, style_imgs=imgs[1:])
+    else:
+        out = stylize_image(imgs[0], args)
+    out = out.convert("RGB")
+    return {"image": list(out.size), "ms": int((time.time() - t0) * 1000)}, (out.tobytes(),)
+
+
+def serve(build_parser, stylize_image, warm=None) -> None:
+    frames_out = sys.stdout.buffer
+    frames_in = sys.stdin.buffer
+    sys.stdout = sys.stderr
+
+    inbox = queue.Queue()
+    cancelled = set()
+
+    def _reader():
+        # "cancel" is handled right here; everything else waits its turn in the inbox.
+        while True:
+            msg = read_message(frames_in)
+            if msg is not None and msg[0].get("op") == "cancel":
+                cancelled.add(msg[0].get("id"))
+                continue
+            inbox.put(msg)
+            if msg is None or msg[0].get("op") == "shutdown":
+                return
+
+    threading.Thread(target=_reader, daemon=True).start()
+    write_frame(frames_out, {"op": "ready", "pid": os.getpid()})
+    while True:
+        msg = inbox.get()
+        if msg is None or msg[0].get("op") == "shutdown":
+            break
+        req, blobs = msg
+        rid = req.get("id")
+        op = req.get("op")
+        if op == "ping":
+            write_frame(frames_out, {"id": rid, "ok": True, "op": "pong"})
+            continue
+        if op == "warm":
+            try:
+                info = warm() if warm else {}
+                write_frame(frames_out, {"id": rid, "ok": True, **info})
+            except Exception as ex:
+                write_frame(frames_out, {"id": rid, "ok": False, "error": f"{type(ex).__name__}: {ex}"})
+            continue
+        if op != "run":
+            write_frame(frames_out, {"id": rid, "ok": False, "error": f"unknown op: {op}"})
+            continue
+        try:
+            reply, out_blobs = _run_job(build_parser, stylize_image, req, blobs, frames_out,
+                                        should_stop=lambda: rid in cancelled)
+            write_message(frames_out, {"id": rid, "ok": True, **reply}, out_blobs)
+        except step_hooks.Interrupted:
+            write_frame(frames_out, {"id": rid, "ok": False, "cancelled": True, "error": "cancelled"})
+        except SystemExit as ex:
+            # Fatal stage errors sys.exit() in the scripts; the worker itself keeps serving.
+            write_frame(frames_out, {"id": rid, "ok": False, "error": f"script exited with code {ex.code}"})
+        except Exception as ex:
+            traceback.print_exc()
+            write_frame(frames_out, {"id": rid, "ok": False, "error": f"{type(ex).__name__}: {ex}"})
+        finally:
+            cancelled.discard(rid)
@@ -11,13 +11,18 @@ export type Size = { w: number; h: number };
 export interface Metrics {
   durationMs: number;
   model: "sd15";
-  controlNet: "hed" | "depth" | "canny" | null;
+  controlNet: "hed" | "depth" | "canny" | "lineart" | null;
+  controlNetModel?: string | null;    // ControlNet repo the run actually used
   ipAdapter: boolean;
   steps: number;
   guidance: number;
   strength: number;
   seed?: number | null;         // <-- seed is OPTIONAL (fixes your TS error)
   size: Size;
+  cache?: "hit" | "miss" | "coalesced" | null;   // result cache outcome (seeded requests only)
+  stagesMs?: Record<string, number>;              // decode, model_load, denoise, grade, ... (ms)
+  pipelineCache?: "hit" | "miss" | null;          // pipelines were resident / had to be built
+  controlMapCache?: "hit" | "miss" | null;        // ControlNet map reused / computed
 }
 
 export interface StylizeRequest {
@@ -33,21 +38,27 @@ export interface StylizeRequest {
   seed?: number;                 // optional = backend will randomize
   styleImagesBase64?: string[];  // for Cyberpunk IP-Adapter refs
   extras?: Record<string, unknown>;
+  deadlineMs?: number;           // give up (504 DEADLINE_EXCEEDED) if not done by then
 }
 
 export interface StylizeResponse {
   mode: Mode;
-  resultBase64: string;
+  resultBase64: string;          // absent when requested with ?result=ref
+  resultId?: string;             // ?result=ref: GET resultUrl for the JPEG
+  resultUrl?: string;
   metrics: Metrics | null;
   warnings?: string[];
   traceId: string;
 }
 
-export async function stylize(payload: StylizeRequest): Promise<StylizeResponse> {
+// Pass an AbortSignal and abort it when the user starts a new run: the backend notices the
+// dropped connection and stops the old one instead of finishing it for nobody.
+export async function stylize(payload: StylizeRequest, signal?: AbortSignal): Promise<StylizeResponse> {
   const r = await fetch("/api/stylize", {
     method: "POST",
     headers: { "content-type": "application/json" },
     body: JSON.stringify(payload),
+    signal,
   });
   if (!r.ok) {
     const text = await r.text().catch(() => "");
@@ -56,6 +67,78 @@ export async function stylize(payload: StylizeRequest): Promise<StylizeResponse>
   return r.json();
 }
 
+// Same as stylize(), but sends the photo (and style refs) as multipart file parts instead of
+// base64 JSON: ~25% smaller upload and no data-URI round trip on either side.
+export type StylizeOptions = Omit<StylizeRequest, "imageBase64" | "styleImagesBase64">;
+
+export async function stylizeUpload(
+  image: Blob,
+  options: StylizeOptions,
+  styleImages: Blob[] = [],
+  signal?: AbortSignal,
+): Promise<StylizeResponse> {
+  const form = new FormData();
+  for (const [key, value] of Object.entries(options)) {
+    if (value === undefined || value === null) continue;
+    form.append(key, key === "extras" ? JSON.stringify(value) : String(value));
+  }
+  form.append("image", image);
+  for (const ref of styleImages) form.append("styleImages", ref);
+  const r = await fetch("/api/stylize/upload", { method: "POST", body: form, signal });
+  if (!r.ok) {
+    const text = await r.text().catch(() => "");
+    throw new Error(`Stylize failed (${r.status}): ${text}`);
+  }
+  return r.json();
+}
+
+// Same request as stylize(), but streamed as server-sent events so the UI can show step progress and
+// rough previews while the model runs. EventSource can't POST, so I read the SSE stream by hand.
+export interface StylizeProgress {
+  step: number;
+  steps: number;
+  previewBase64?: string;        // tiny latent preview (1/8 size), every few steps
+}
+
+export async function stylizeStream(
+  payload: StylizeRequest,
+  onProgress: (p: StylizeProgress) => void,
+  signal?: AbortSignal,
+): Promise<StylizeResponse> {
+  const r = await fetch("/api/stylize/stream", {
+    method: "POST",
+    headers: { "content-type": "application/json" },
+    body: JSON.stringify(payload),
+    signal,
+  });
+  if (!r.ok || !r.body) {
+    const text = await r.text().catch(() => "");
+    throw new Error(`Stylize failed (${r.status}): ${text}`);
+  }
+  const reader = r.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buf = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buf += value;
+    let cut: number;
+    while ((cut = buf.indexOf("\n\n")) >= 0) {
+      const block = buf.slice(0, cut);
+      buf = buf.slice(cut + 2);
+      let event = "message";
+      let data = "";
+      for (const line of block.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      if (event === "progress") onProgress(JSON.parse(data));
+      else if (event === "result") return JSON.parse(data);
+      else if (event === "error") throw new Error(`Stylize failed: ${JSON.parse(data).message}`);
+    }
+  }
+  throw new Error("Stylize stream ended without a result");
+}
+
 // Helper: read a File → data: URL (base64). Standard way via FileReader.  :contentReference[oaicite:7]{index=7}
 export async function fileToDataURI(file: File): Promise<string> {
   if (file.size > 10 * 1024 * 1024) {
@@ -22,3 +22,37 @@ def client():
     if app is None or TestClient is None:
         pytest.skip(f"Cannot import backend.server.app or TestClient: {IMPORT_ERROR}")
     return TestClient(app)
+
+
+@pytest.fixture(autouse=True)
+def fresh_result_cache(monkeypatch):
+    # I give every test an empty result cache so earlier runs can't answer for later ones.
+    from backend import cache
+    monkeypatch.setattr(cache, "RESULTS", cache.ResultCache(mem_bytes=64 * 1024 * 1024, disk_dir=None, disk_bytes=0))
+
+
+@pytest.fixture
+def fake_noir(monkeypatch):
+    # I swap the real noir wrapper for an instant one so no models are involved.
+    import types
+    from PIL import Image
+    import time
+    from backend import styles, progress, cancellation
+
+    def stylize(image, **kw):
+        if kw["extras"].get("fail"):
+            raise RuntimeError("boom")
+        # "sleep" makes a slow run that stops when cancelled, like the runner's modes do.
+        until = time.time() + kw["extras"].get("sleep", 0)
+        while time.time() < until:
+            token = cancellation.current()
+            if token:
+                token.check()
+            time.sleep(0.02)
+        # I report two steps, like a resident run would for a streaming client.
+        sink = progress.current()
+        if sink:
+            sink({"step": 1, "steps": 2, "preview": None})
+            sink({"step": 2, "steps": 2, "preview": Image.new("RGB", (4, 4))})
+        return Image.new("RGB", image.size, (1, 2, 3))
+    monkeypatch.setitem(styles.REGISTRY, "noir", types.SimpleNamespace(stylize=stylize))
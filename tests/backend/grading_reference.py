@@ -0,0 +1,305 @@
+# tests/backend/grading_reference.py
+# The colour grades as they were before scripts/grading.py computed them in place: plain
+# whole-frame numpy, one temporary per step. Tests check the optimised grades against these.
+
+import numpy as np
+from PIL import Image, ImageOps, ImageFilter
+
+# ---------------- Shared helpers ----------------
+
+def pil_to_numpy(img: Image.Image) -> np.ndarray:
+    return np.asarray(img).astype(np.float32)/255.0
+
+def numpy_to_pil(arr: np.ndarray) -> Image.Image:
+    arr = np.clip(arr, 0.0, 1.0)
+    return Image.fromarray((arr*255.0).astype(np.uint8))
+
+def to_np(img: Image.Image) -> np.ndarray:
+    return np.asarray(img).astype(np.float32) / 255.0
+
+def to_pil(arr: np.ndarray) -> Image.Image:
+    return Image.fromarray(np.clip(arr * 255.0, 0, 255).astype(np.uint8))
+
+def to_3c(x: np.ndarray) -> np.ndarray:
+    # I expand gray arrays to 3 channels.
+    if x.ndim == 2: return np.repeat(x[..., None], 3, axis=2)
+    if x.ndim == 3 and x.shape[2] == 1: return np.repeat(x, 3, axis=2)
+    return x
+
+def gaussian_blur_keepdims(x: np.ndarray, sigma: float) -> np.ndarray:
+    # I blur without changing shape.
+    import cv2
+    y = cv2.GaussianBlur(x, (0,0), sigma)
+    if y.ndim == 2: y = y[..., None]
+    return y.astype(np.float32)
+
+def luminance(arr: np.ndarray) -> np.ndarray:
+    return 0.2126*arr[...,0] + 0.7152*arr[...,1] + 0.0722*arr[...,2]
+
+def sigmoid(x, k=10.0, x0=0.5):
+    return 1.0/(1.0 + np.exp(-k*(x - x0)))
+
+def saturate_pil(pil: Image.Image, sat_scale: float) -> Image.Image:
+    # I nudge saturation at the end to keep colors lively.
+    if abs(sat_scale - 1.0) < 1e-3:
+        return pil
+    hsv = pil.convert("HSV")
+    h, s, v = hsv.split()
+    s_np = np.array(s, dtype=np.float32)
+    s_np = np.clip(s_np * sat_scale, 0, 255).astype(np.uint8)
+    hsv = Image.merge("HSV", (h, Image.fromarray(s_np), v))
+    return hsv.convert("RGB")
+
+# ---------------- Noir ----------------
+
+def grade_noir(pil_img: Image.Image,
+               vignette=0.18, halation=0.28,
+               bloom_sigma=3.0, bloom_thresh=0.70,
+               dither_std=0.002,
+               filmic_lift=0.02, filmic_gamma=0.96, filmic_gain=1.02) -> Image.Image:
+    # I do grayscale luma, local contrast, bloom/halation, vignette, and light grain.
+    import cv2, numpy as np
+    from PIL import ImageFilter
+
+    arr = pil_to_numpy(pil_img)                      # HxWx3
+    luma = (0.2126*arr[...,0] + 0.7152*arr[...,1] + 0.0722*arr[...,2]).astype(np.float32)  # HxW
+
+    # Local contrast on luma
+    blur = cv2.GaussianBlur(luma, (0,0), 1.2)
+    hp   = np.clip(luma - blur, 0.0, 1.0)
+    l2   = np.clip(luma + 0.65*hp, 0.0, 1.0)
+
+    # Bloom / halation
+    bright = np.clip(l2 - float(bloom_thresh), 0.0, 1.0)
+    halo   = cv2.GaussianBlur(bright, (0,0), float(bloom_sigma))
+    out2d  = np.clip(l2 + float(halation)*halo, 0.0, 1.0)
+
+    # Vignette
+    h, w = out2d.shape
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    r = np.sqrt(((xx - w/2)/(0.9*w))**2 + ((yy - h/2)/(0.9*h))**2)
+    vig = np.clip(1.0 - float(vignette)*(r**1.5), 0.0, 1.0)
+    out2d = np.clip(out2d * vig, 0.0, 1.0)
+
+    # Filmic curve (lift/gamma/gain)
+    def _filmic(x, lift=0.02, gamma=0.95, gain=1.04):
+        x = np.clip(x, 0, 1)
+        x = (x + lift) / (1.0 + lift)
+        x = np.power(x, gamma)
+        x = np.clip(x * gain, 0, 1)
+        return x
+
+    out2d = _filmic(out2d, lift=float(filmic_lift), gamma=float(filmic_gamma), gain=float(filmic_gain))
+
+    # Back to RGB + tiny grain
+    out = np.stack([out2d, out2d, out2d], axis=2)
+    if dither_std and dither_std > 0:
+        out = np.clip(out + np.random.normal(0, float(dither_std), out.shape).astype(np.float32), 0.0, 1.0)
+
+    pil = numpy_to_pil(out).filter(ImageFilter.UnsharpMask(radius=1, percent=110, threshold=6))
+    return pil
+
+# ---------------- Cinematic v5 (teal/orange) ----------------
+
+def grade_v5(
+    img: Image.Image,
+    subject: str = "scene",
+    tone_mix: float | None = None,
+    bloom: float | None = None,
+    contrast: float | None = None,
+    skin_suppress: float | None = None,
+    saturation: float = 1.05,
+    add_dither: bool = True,
+) -> Image.Image:
+    # I do the teal–orange grade in numpy, with different settings for scene vs portrait.
+    a = to_np(img)
+    base = a.copy()
+    h, w, _ = a.shape
+    lum = luminance(a)
+
+    if subject == "portrait":
+        tone_mix = 0.22 if tone_mix is None else tone_mix
+        bloom = 0.22 if bloom is None else bloom
+        contrast = 0.18 if contrast is None else contrast
+        skin_suppress = 0.80 if skin_suppress is None else skin_suppress
+        shadow_w = sigmoid(0.35 - lum, k=12.0, x0=0.0)
+        highlight_w = sigmoid(lum - 0.60, k=10.0, x0=0.0)
+    else:
+        tone_mix = 0.40 if tone_mix is None else tone_mix
+        bloom = 0.42 if bloom is None else bloom
+        contrast = 0.24 if contrast is None else contrast
+        skin_suppress = 0.85 if skin_suppress is None else skin_suppress
+        shadow_w = sigmoid(0.50 - lum, k=12.0, x0=0.0)
+        highlight_w = sigmoid(lum - 0.55, k=12.0, x0=0.0)
+
+    shadow_w = shadow_w[...,None].astype(np.float32)
+    highlight_w = highlight_w[...,None].astype(np.float32)
+
+    # I push teal in shadows and orange in highlights.
+    if subject == "scene":
+        teal_vec   = np.array([0.02, 0.58, 1.00], dtype=np.float32)
+        orange_vec = np.array([1.05, 0.70, 0.05], dtype=np.float32)
+    else:
+        teal_vec   = np.array([0.02, 0.55, 0.95], dtype=np.float32)
+        orange_vec = np.array([1.00, 0.62, 0.07], dtype=np.float32)
+
+    teal_field = teal_vec[None,None,:] * shadow_w
+    orange_field = orange_vec[None,None,:] * highlight_w
+    mask = np.clip(shadow_w + highlight_w, 0.0, 1.0)
+    a = np.clip(a*(1.0 - tone_mix*mask) + tone_mix*(teal_field + orange_field), 0.0, 1.0)
+
+    # I warm midtones for scenes.
+    if subject == "scene":
+        mid = np.clip((lum - 0.45)/0.20, 0.0, 1.0) * np.clip((0.65 - lum)/0.20, 0.0, 1.0)
+        mid = (mid * 0.06)[...,None]
+        a[...,0] += mid[...,0]
+        a[...,1] += (mid[...,0] * 0.5)
+
+    # I protect skin for portraits.
+    if subject == "portrait":
+        r, g, b = a[...,0], a[...,1], a[...,2]
+        skin = (r > g) & (r > b) & (r > 0.30) & (lum > 0.20) & (lum < 0.90)
+        if skin.any():
+            try:
+                from scipy.ndimage import uniform_filter
+                m = uniform_filter(skin.astype(np.float32), size=5)
+            except Exception:
+                m = skin.astype(np.float32)
+            m = m[...,None]
+            a = a*(1.0 - 0.40*m*skin_suppress) + base*(0.40*m*skin_suppress)
+            mid_skin = ((lum > 0.35) & (lum < 0.65))[...,None].astype(np.float32) * m
+            a[...,0] += 0.10 * mid_skin[...,0]
+            a[...,1] += 0.05 * mid_skin[...,0]
+
+    if contrast and contrast > 0.0:
+        a = np.clip((a - 0.5) * (1.0 + 1.8*contrast) + 0.5, 0.0, 1.0)
+
+    if bloom and bloom > 0.0:
+        # I add soft glow on bright regions.
+        try:
+            from scipy.ndimage import gaussian_filter
+            thr = np.clip((lum - 0.60)/0.40, 0.0, 1.0)[...,None]
+            glow = gaussian_filter(a*thr, sigma=(6.0,6.0,0.0))
+            a = np.clip(a + bloom*glow, 0.0, 1.0)
+        except Exception:
+            pass
+
+    out = to_pil(a).filter(ImageFilter.UnsharpMask(radius=1, percent=115, threshold=5))
+    out = saturate_pil(out, saturation)
+
+    if add_dither:
+        # I add tiny ordered dither to fight banding.
+        arr = to_np(out); h, w, _ = arr.shape
+        yy, xx = np.mgrid[0:h, 0:w]
+        bayer = ((xx & 1) + ((yy & 1) << 1)) / 4.0 - 0.375
+        arr += (1.0/255.0)*bayer[...,None]
+        out = to_pil(np.clip(arr, 0.0, 1.0))
+
+    return out
+
+# ---------------- Cyberpunk v3 ----------------
+
+def _thin_edges(e: np.ndarray, hi_q=0.95) -> np.ndarray:
+    # I keep only the thinnest, strongest edges for glow.
+    import cv2
+    t = float(np.quantile(e, hi_q))
+    e = (e >= t).astype(np.uint8)
+    k = cv2.getStructuringElement(cv2.MORPH_RECT, (3,3))
+    e = cv2.morphologyEx(e, cv2.MORPH_OPEN, k, iterations=1)
+    e = cv2.dilate(e, k, iterations=1)
+    e = cv2.GaussianBlur(e.astype(np.float32), (0,0), 1.2)
+    return e
+
+def grade_cyberpunk(
+    pil_img: Image.Image,
+    edges_for_glow: Image.Image|None,
+    bg_mask_for_edges: Image.Image|None = None,
+    neon: float = 0.30,
+    bloom: float = 0.34,
+    scanlines: float = 0.0,
+    protect_skin: bool = True,
+    tone_mix: float = 0.10,
+    glow_sigma: float = 2.0,
+    bloom_sigma: float = 5.0,
+    bloom_thresh: float = 0.75,
+    ca_px: int = 0,
+    edge_q: float = 0.985,
+    skin_suppress: float = 0.95,
+    add_dither: bool = True,
+) -> Image.Image:
+    # I push teal/magenta, add edge glow + bloom, and keep skin safe.
+    import cv2
+    arr = np.asarray(pil_img).astype(np.float32) / 255.0
+    h, w, _ = arr.shape
+
+    gray = np.mean(arr, axis=2, keepdims=True)
+    w_teal = np.clip(1.0 - 1.4*gray, 0.0, 1.0)
+    w_mag  = np.clip(1.4*gray - 0.2, 0.0, 1.0)
+    teal    = np.array([0.0,1.0,1.0], dtype=np.float32)[None,None,:]
+    magenta = np.array([1.0,0.0,0.9], dtype=np.float32)[None,None,:]
+    toned = np.clip(arr*(1.0 - tone_mix) + (w_teal*teal + w_mag*magenta)*tone_mix, 0.0, 1.0)
+
+    if edges_for_glow is not None:
+        e_img = edges_for_glow.resize((w, h), Image.LANCZOS).convert("L")
+        e = np.asarray(e_img).astype(np.float32)/255.0
+    else:
+        g = cv2.cvtColor((toned*255).astype(np.uint8), cv2.COLOR_RGB2GRAY)
+        e = cv2.Canny(g, 80, 160).astype(np.float32)/255.0
+
+    if bg_mask_for_edges is not None:
+        bg = ImageOps.invert(bg_mask_for_edges).resize((w,h), Image.NEAREST)
+        bg = np.asarray(bg).astype(np.float32)/255.0
+        e = e * (bg > 0.5).astype(np.float32)
+
+    e = _thin_edges(e, hi_q=edge_q)
+    e = gaussian_blur_keepdims(e, 1.2)
+
+    if protect_skin:
+        hsv = cv2.cvtColor((arr*255).astype(np.uint8), cv2.COLOR_RGB2HSV).astype(np.float32)
+        H, S, V = hsv[...,0], hsv[...,1]/255.0, hsv[...,2]/255.0
+        skin = ((H >= 0) & (H <= 50) & (S > 0.10) & (S < 0.68) & (V > 0.2) & (V < 0.95)).astype(np.float32)
+        skin = gaussian_blur_keepdims(skin, 3.0)
+        e = e * (1.0 - skin_suppress * skin)
+
+    y = (np.arange(h, dtype=np.float32) / max(h - 1, 1))[:, None]
+    grad_mag  = np.clip(1.2*y - 0.1, 0.0, 1.0)
+    grad_teal = 1.0 - grad_mag
+    glow_color = np.stack([
+        1.0*grad_mag + 0.0*grad_teal,
+        0.10*grad_mag + 1.0*grad_teal,
+        0.90*grad_mag + 1.0*grad_teal,
+    ], axis=2)
+    glow = gaussian_blur_keepdims(e * glow_color, glow_sigma)
+
+    lum = np.max(toned, axis=2, keepdims=True)
+    bloom_map = np.clip(lum - bloom_thresh, 0.0, 1.0)
+    bloom_map = gaussian_blur_keepdims(bloom_map, bloom_sigma)
+    bloom_rgb = to_3c(bloom_map)
+
+    def screen(a, b, k): return 1.0 - (1.0 - a) * (1.0 - np.clip(k,0,1)*np.clip(b,0,1))
+    out = screen(toned, glow,  neon)
+    out = screen(out,  bloom_rgb, bloom)
+
+    if scanlines > 0:
+        yy = np.arange(h, dtype=np.float32)[:, None]
+        lines = 0.5*(1.0 + np.sin(2.0*np.pi*yy/3.0))
+        mask = 1.0 - float(scanlines)*(1.0 - lines)
+        mask = np.broadcast_to(mask[:, :, None], (h, w, 1)).astype(np.float32)
+        out = np.clip(out * mask, 0.0, 1.0)
+
+    if ca_px > 0:
+        out_ca = out.copy()
+        out_ca[...,0] = np.roll(out[...,0], -ca_px, axis=1)
+        out_ca[...,2] = np.roll(out[...,2],  ca_px, axis=1)
+        out = out_ca
+
+    blur = cv2.GaussianBlur(out, (0,0), 0.8)
+    hp = np.clip(out - blur, 0.0, 1.0)
+    weight = np.clip(np.max(hp, axis=2, keepdims=True)*1.5, 0.0, 1.0)
+    out = np.clip(out + weight*0.30*(out - blur), 0.0, 1.0)
+
+    if add_dither:
+        noise = np.random.normal(0, 0.002, out.shape).astype(np.float32)
+        out = np.clip(out + noise, 0.0, 1.0)
+
+    return Image.fromarray((out*255).astype(np.uint8))
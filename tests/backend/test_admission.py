@@ -0,0 +1,40 @@
+# tests/backend/test_admission.py
+from concurrent.futures import Future
+
+import pytest
+
+from backend import admission
+from .test_jobs import _payload, _wait
+
+
+def test_full_style_is_refused_until_a_run_finishes():
+    gate = admission.Admission(per_style=1, window=5)
+    first = gate.admit("noir", "full", Future)
+    with pytest.raises(admission.QueueFull) as ex:
+        gate.admit("noir", "full", Future)
+    assert ex.value.retry_after_s == 45          # nothing measured yet: the default guess
+    gate.admit("anime", "full", Future)          # other styles have their own line
+    first.set_result(b"")
+    gate.admit("noir", "full", Future)
+    assert gate.stats == {"admitted": 3, "rejected": 1}
+
+
+def test_estimates_follow_recent_durations():
+    gate = admission.Admission(per_style=0, window=3)
+    for seconds in (2.0, 4.0, 100.0, 3.0):
+        gate.record("noir", "preview", seconds)
+    # Window 3 keeps (4, 100, 3): the median ignores the slow outlier.
+    assert gate.typical_s("noir", "preview") == 4.0
+    assert gate.eta_s("noir", "preview", queued_ahead=4, threads=2) == 12.0
+
+
+def test_api_answers_429_with_retry_after(client, fake_noir, monkeypatch):
+    monkeypatch.setattr(admission, "GATE", admission.Admission(per_style=1, window=5))
+    slow = client.post("/api/jobs", json=_payload(seed=None, extras={"sleep": 0.3}))
+    assert slow.status_code == 202 and slow.json()["etaMs"] > 0
+    r = client.post("/api/stylize", json=_payload(seed=None))
+    assert r.status_code == 429
+    assert r.json()["detail"]["code"] == "QUEUE_FULL"
+    assert int(r.headers["retry-after"]) >= 1
+    assert _wait(client, slow.json()["jobId"])["status"] == "done"
+    assert client.post("/api/stylize", json=_payload(seed=None)).status_code == 200
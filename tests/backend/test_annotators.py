@@ -0,0 +1,43 @@
+# tests/backend/test_annotators.py
+import sys
+import types
+
+import pytest
+
+from backend.utils.runner import load_script
+
+annotators = load_script("annotators")
+
+
+@pytest.fixture
+def fake_controlnet_aux(monkeypatch):
+    # I stand in for controlnet_aux.hed so no weights are downloaded.
+    loads = []
+
+    class HEDdetector:
+        @classmethod
+        def from_pretrained(cls, repo):
+            loads.append(repo)
+            return cls()
+
+    monkeypatch.setitem(sys.modules, "controlnet_aux", types.ModuleType("controlnet_aux"))
+    monkeypatch.setitem(sys.modules, "controlnet_aux.hed", types.SimpleNamespace(HEDdetector=HEDdetector))
+    monkeypatch.setattr(annotators, "_DETECTORS", {})
+    monkeypatch.setattr(annotators, "_LOAD_MS", {})
+    monkeypatch.setattr(annotators, "_ERRORS", {})
+    return loads
+
+
+def test_detector_loads_once(fake_controlnet_aux):
+    first = annotators.get("hed")
+    assert annotators.get("hed") is first
+    assert fake_controlnet_aux == [annotators.REPO]
+    st = annotators.status()["hed"]
+    assert st["loaded"] and st["loadMs"] is not None
+
+
+def test_preload_reports_failures_without_raising(fake_controlnet_aux, monkeypatch):
+    monkeypatch.setitem(sys.modules, "controlnet_aux.midas", None)   # import fails
+    out = annotators.preload(["hed", "midas"])
+    assert out["hed"]["loaded"] is True
+    assert out["midas"]["loaded"] is False and out["midas"]["error"]
@@ -0,0 +1,97 @@
+# tests/backend/test_cache.py
+import os
+import time
+import threading
+import types
+from concurrent.futures import Future
+
+import pytest
+from PIL import Image
+
+from backend import cache, styles
+from .test_jobs import _payload, _wait
+
+
+def test_key_depends_on_pixels_and_params():
+    a = Image.new("RGB", (8, 8), (1, 2, 3))
+    b = Image.new("RGB", (8, 8), (1, 2, 4))
+    p = {"style": "noir", "seed": 1}
+    assert cache.request_key(a, [], p) == cache.request_key(a.copy(), [], dict(p))
+    assert cache.request_key(a, [], p) != cache.request_key(b, [], p)
+    assert cache.request_key(a, [], p) != cache.request_key(a, [], {**p, "seed": 2})
+    assert cache.request_key(a, [], p) != cache.request_key(a, [b], p)
+
+
+def test_memory_tier_evicts_least_recently_used():
+    rc = cache.ResultCache(mem_bytes=10, disk_dir=None, disk_bytes=0)
+    rc.put("a", b"aaaa")
+    rc.put("b", b"bbbb")
+    assert rc.get("a") == b"aaaa"          # a is now most recent
+    rc.put("c", b"cccc")
+    assert rc.get("b") is None and rc.get("a") == b"aaaa" and rc.get("c") == b"cccc"
+
+
+def test_disk_tier_survives_restart_and_evicts(tmp_path):
+    rc = cache.ResultCache(mem_bytes=1024, disk_dir=str(tmp_path), disk_bytes=10)
+    rc.put("a", b"aaaa")
+    rc.put("b", b"bbbb")
+    now = time.time()
+    os.utime(tmp_path / "a.jpg", (now - 20, now - 20))
+    os.utime(tmp_path / "b.jpg", (now - 10, now - 10))
+    fresh = cache.ResultCache(mem_bytes=1024, disk_dir=str(tmp_path), disk_bytes=10)
+    assert fresh.get("a") == b"aaaa"
+    assert fresh.stats["disk_hits"] == 1    # reading a marks it as recently used
+    fresh.put("c", b"cccc")
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.jpg", "c.jpg"]
+
+
+def test_single_flight_shares_one_computation():
+    rc = cache.ResultCache(mem_bytes=1024, disk_dir=None, disk_bytes=0)
+    inner: Future = Future()
+    f1, s1 = rc.single_flight("k", lambda: inner)
+    f2, s2 = rc.single_flight("k", lambda: pytest.fail("second start"))
+    assert (s1, s2) == ("miss", "coalesced") and f1 is f2
+    inner.set_result(b"jpeg")
+    assert rc.get("k") == b"jpeg"
+
+
+@pytest.fixture
+def counting_noir(monkeypatch):
+    calls = []
+    gate = threading.Event()
+    gate.set()
+
+    def stylize(image, **kw):
+        gate.wait(5)
+        calls.append(kw["seed"])
+        return Image.new("RGB", image.size, (9, 9, 9))
+    monkeypatch.setitem(styles.REGISTRY, "noir", types.SimpleNamespace(stylize=stylize))
+    return calls, gate
+
+
+def test_repeated_seeded_request_hits_cache(client, counting_noir):
+    calls, _ = counting_noir
+    first = client.post("/api/stylize", json=_payload()).json()
+    second = client.post("/api/stylize", json=_payload()).json()
+    assert calls == [7]
+    assert first["metrics"]["cache"] == "miss"
+    assert second["metrics"]["cache"] == "hit" and second["warnings"]
+    assert second["resultBase64"] == first["resultBase64"]
+
+
+def test_unseeded_requests_are_not_cached(client, counting_noir):
+    calls, _ = counting_noir
+    for _ in range(2):
+        r = client.post("/api/stylize", json=_payload(seed=None)).json()
+        assert r["metrics"]["cache"] is None
+    assert len(calls) == 2
+
+
+def test_identical_jobs_in_flight_are_coalesced(client, counting_noir):
+    calls, gate = counting_noir
+    gate.clear()
+    ids = [client.post("/api/jobs", json=_payload()).json()["jobId"] for _ in range(2)]
+    gate.set()
+    bodies = [_wait(client, i) for i in ids]
+    assert calls == [7]
+    assert [b["result"]["metrics"]["cache"] for b in bodies] == ["miss", "coalesced"]
@@ -0,0 +1,52 @@
+# tests/backend/test_cancel.py
+import time
+
+from backend import cancellation, jobs
+from .test_jobs import _payload, _wait
+
+
+def _idle(timeout=3.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if sum(jobs.queue_status()["running"].values()) == 0:
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_token_is_shared_until_the_last_waiter_leaves():
+    token = cancellation.CancelToken(deadline=time.time() + 60)
+    assert token.join(None)           # a waiter without a deadline lifts it
+    assert token.deadline is None
+    assert not token.release() and token.reason() is None
+    assert token.release() and token.reason() == "cancelled"
+    assert not token.join()
+
+
+def test_deadline_returns_504_and_stops_the_run(client, fake_noir):
+    t0 = time.time()
+    r = client.post("/api/stylize", json=_payload(seed=None, deadlineMs=200, extras={"sleep": 5}))
+    assert r.status_code == 504
+    assert r.json()["detail"]["code"] == "DEADLINE_EXCEEDED"
+    assert time.time() - t0 < 2
+    assert _idle()
+
+
+def test_delete_job_cancels_its_run(client, fake_noir):
+    job_id = client.post("/api/jobs", json=_payload(seed=None, extras={"sleep": 5})).json()["jobId"]
+    r = client.delete(f"/api/jobs/{job_id}")
+    assert r.status_code == 200 and r.json()["status"] == "cancelled"
+    assert r.json()["error"]["code"] == "CANCELLED"
+    assert _idle()
+    assert client.delete(f"/api/jobs/{job_id}").status_code == 409
+    assert client.delete("/api/jobs/nope").status_code == 404
+
+
+def test_shared_run_survives_one_waiter_cancelling(client, fake_noir):
+    body = _payload(extras={"sleep": 0.3})
+    first = client.post("/api/jobs", json=body).json()["jobId"]
+    second = client.post("/api/jobs", json=body).json()["jobId"]
+    client.delete(f"/api/jobs/{first}")
+    done = _wait(client, second)
+    assert done["status"] == "done"
+    assert done["result"]["metrics"]["cache"] == "coalesced"
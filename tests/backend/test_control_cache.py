@@ -0,0 +1,77 @@
+# tests/backend/test_control_cache.py
+import pytest
+from PIL import Image
+
+from backend.utils.runner import load_script
+
+control_cache = load_script("control_cache")
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    control_cache.clear()
+    yield
+    control_cache.clear()
+
+
+def _counting_builder(calls):
+    def build(im):
+        calls.append(im.size)
+        return Image.new("RGB", (64, 64), (len(calls), 0, 0))
+    return build
+
+
+def test_preview_map_is_reused_for_full_render():
+    photo = Image.new("RGB", (300, 200), (10, 20, 30))
+    key = control_cache.source_key(photo)
+    calls = []
+    build = _counting_builder(calls)
+    preview = control_cache.cached_map("hed", photo.resize((150, 100)), build, detect_res=512, source=key)
+    full = control_cache.cached_map("hed", photo.resize((300, 200)), build, detect_res=512, source=key)
+    assert calls == [(150, 100)]
+    assert full.tobytes() == preview.tobytes()
+
+
+def test_kind_detect_res_and_exact_size_split_entries():
+    img = Image.new("RGB", (32, 32))
+    calls = []
+    build = _counting_builder(calls)
+    control_cache.cached_map("lineart_anime", img, build, detect_res=512)
+    control_cache.cached_map("lineart_anime", img, build, detect_res=768)
+    control_cache.cached_map("midas", img, build, detect_res=512)
+    key = control_cache.source_key(img)
+    control_cache.cached_map("canny", img, build, source=key, exact_size=True)
+    control_cache.cached_map("canny", img.resize((16, 16)), build, source=key, exact_size=True)
+    assert len(calls) == 5
+
+
+def test_failed_builds_are_not_cached(monkeypatch):
+    monkeypatch.setenv("ARTIFY_CONTROL_CACHE", "2")
+    img = Image.new("RGB", (8, 8))
+    assert control_cache.cached_map("hed", img, lambda im: None) is None
+    calls = []
+    control_cache.cached_map("hed", img, _counting_builder(calls))
+    assert calls == [(8, 8)]
+    assert control_cache.status()["entries"] == 1
+
+
+def test_cyberpunk_scene_preview_map_is_reused_for_full_render(monkeypatch):
+    pytest.importorskip("torch")
+    pytest.importorskip("diffusers")
+    cyberpunk = load_script("cyberpunk_stylize_v3")
+    calls = []
+
+    def midas(im):
+        calls.append(im.size)
+        return im.convert("L")
+
+    monkeypatch.setattr(cyberpunk.annotators, "get", lambda name: midas)
+    photo = Image.new("RGB", (1200, 900), (10, 20, 30))
+    key = control_cache.source_key(photo)
+    for side in (512, 896):                     # preview, then full: scenes use the photo itself
+        src = cyberpunk.resize_max_side(photo, side)
+        assert cyberpunk.build_control("depth", src, src, key) is not None
+    assert len(calls) == 1
+    inpainted = cyberpunk.resize_max_side(photo, 896).copy()   # a stage-1 image of its own
+    cyberpunk.build_control("depth", inpainted, src, key)
+    assert len(calls) == 2
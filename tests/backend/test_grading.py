@@ -0,0 +1,186 @@
+# tests/backend/test_grading.py
+import numpy as np
+import pytest
+from PIL import Image
+
+from backend.utils.runner import load_script
+from . import grading_reference as reference
+
+pytest.importorskip("cv2")
+pytest.importorskip("scipy")
+
+grading = load_script("grading")
+
+
+def _photo(w=240, h=180) -> Image.Image:
+    # Gradients, noise and a skin-toned block, so every branch of the grades has work to do.
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    a = np.stack([xx / w, yy / h, 0.5 + 0.5 * np.sin(xx / 37.0) * np.cos(yy / 23.0)], axis=2)
+    a = a * 0.75 + ((xx // 64 + yy // 64) % 2)[..., None] * 0.25
+    a += np.random.default_rng(0).normal(0, 0.05, a.shape)
+    a[h // 4:h // 2, w // 4:w // 2] = (0.80, 0.55, 0.45)
+    return Image.fromarray((np.clip(a, 0, 1) * 255).astype(np.uint8))
+
+
+def _assert_close(got: Image.Image, want: Image.Image):
+    # In-place float32 math can round a pixel to the next 8-bit level; nothing more.
+    d = np.abs(np.asarray(got).astype(int) - np.asarray(want).astype(int))
+    assert d.max() <= 1 and d.mean() < 1e-3
+
+
+@pytest.mark.parametrize("size", [(240, 180), (181, 263)])
+def test_inplace_grades_match_reference(size):
+    photo = _photo(*size)
+    exact = dict(bloom_quality="exact")
+    # Grain is random, so noir and cyberpunk are compared without it; v5's dither is ordered.
+    _assert_close(grading.grade_noir(photo, dither_std=0, **exact), reference.grade_noir(photo, dither_std=0))
+    for subject in ("scene", "portrait"):
+        _assert_close(grading.grade_v5(photo, subject=subject, **exact), reference.grade_v5(photo, subject=subject))
+    kw = dict(add_dither=False, scanlines=0.2, ca_px=2)
+    _assert_close(grading.grade_cyberpunk(photo, None, **kw, **exact), reference.grade_cyberpunk(photo, None, **kw))
+    edges = photo.convert("L").resize((64, 48))
+    _assert_close(grading.grade_cyberpunk(photo, edges, protect_skin=False, add_dither=False, **exact),
+                  reference.grade_cyberpunk(photo, edges, protect_skin=False, add_dither=False))
+
+
+@pytest.mark.parametrize("sigma", [2.3, 3.0, 5.0, 6.0, 12.0])
+def test_fast_bloom_stays_within_one_level_of_exact(sigma):
+    import cv2
+    rng = np.random.default_rng(1)
+    h, w = 97, 130
+    checker = ((np.arange(w)[None, :] // 3 + np.arange(h)[:, None] // 3) % 2).astype(np.float32)
+    sparks = (rng.random((h, w, 3)) > 0.995).astype(np.float32)
+    for x in (rng.random((h, w)).astype(np.float32), checker, sparks):
+        err = np.abs(grading.bloom_blur(x, sigma, "fast") - cv2.GaussianBlur(x, (0, 0), sigma))
+        assert err.max() < 1 / 255
+
+
+def test_fast_bloom_grades_stay_close_to_exact():
+    # Within a level before the final 8-bit sharpening; its threshold may flip a few pixels.
+    photo = _photo(181, 263)
+    for grade, args, kw in ((grading.grade_noir, (), dict(dither_std=0)),
+                            (grading.grade_v5, (), dict(subject="scene")),
+                            (grading.grade_cyberpunk, (None,), dict(add_dither=False))):
+        a = np.asarray(grade(photo, *args, bloom_quality="fast", **kw)).astype(int)
+        b = np.asarray(grade(photo, *args, bloom_quality="exact", **kw)).astype(int)
+        d = np.abs(a - b)
+        assert d.mean() < 0.02 and (d > 1).mean() < 0.01
+
+
+@pytest.mark.parametrize("quality", ["fast", "exact"])
+@pytest.mark.parametrize("strip_rows", [16, 37, 100])
+def test_strips_match_the_whole_frame(strip_rows, quality):
+    photo = _photo(181, 263)
+
+    def same(grade, *args, grain=False, **kw):
+        # With grain both runs get a generator of the same seed, as two runs of one --seed would.
+        seeded = lambda: dict(rng=np.random.default_rng(5)) if grain else {}
+        a = np.asarray(grade(photo, *args, strip_rows=strip_rows, bloom_quality=quality, **seeded(), **kw))
+        b = np.asarray(grade(photo, *args, strip_rows=0, bloom_quality=quality, **seeded(), **kw))
+        assert (a == b).all()
+
+    # Grain included: each strip fetches its own rows of the frame's grain.
+    same(grading.grade_noir, grain=True, dither_std=0.02)
+    same(grading.grade_v5, subject="scene")
+    same(grading.grade_v5, subject="portrait")
+    same(grading.grade_cyberpunk, None, grain=True, scanlines=0.2, ca_px=2)
+
+
+def test_bands_cover_every_row_once():
+    rows, bands = grading._bands(1000, 20, 300)
+    assert [(y0, y1) for y0, y1, _, _ in bands] == [(0, 250), (250, 500), (500, 750), (750, 1000)]
+    assert bands[1][2:] == (230, 520) and rows == 290
+    assert grading._bands(1000, 20, 0) == (1000, [(0, 1000, 0, 1000)])
+
+
+@pytest.mark.parametrize("w", [64, 33, 1])
+def test_bayer_table_matches_float_dither(w):
+    px = np.random.default_rng(2).integers(0, 256, (9, w, 3), dtype=np.uint8)
+    yy, xx = np.mgrid[0:9, 0:w]
+    a = px.astype(np.float32) / 255.0
+    a += (1.0 / 255.0) * (((xx & 1) + ((yy & 1) << 1)) / 4.0 - 0.375)[..., None]
+    want = (np.clip(a, 0.0, 1.0) * 255).astype(np.uint8)
+    grading._bayer_dither(px)
+    assert (px == want).all()
+
+
+def test_masks_are_shared_read_only_and_bounded(monkeypatch):
+    grading.clear_masks()
+    builds = []
+
+    def build():
+        builds.append(1)
+        return np.zeros((256, 1024), np.float32)        # 1 MB
+
+    a = grading._mask(("test", 1), build)
+    assert grading._mask(("test", 1), build) is a and len(builds) == 1
+    assert not a.flags.writeable
+    monkeypatch.setenv("ARTIFY_GRADE_MASK_MB", "1")
+    grading._mask(("test", 2), build)                    # over budget: ("test", 1) goes
+    grading._mask(("test", 1), build)
+    assert len(builds) == 3
+    grading.clear_masks()
+
+
+def test_grain_follows_the_run_generator_not_the_global_rng():
+    photo = _photo()
+    for grade, args in ((grading.grade_noir, ()), (grading.grade_cyberpunk, (None,))):
+        np.random.seed(1)
+        a = np.asarray(grade(photo, *args, rng=np.random.default_rng(7)))
+        assert not (a == np.asarray(grade(photo, *args, rng=np.random.default_rng(8)))).all()
+        assert np.random.randint(1 << 30) == np.random.RandomState(1).randint(1 << 30)   # untouched
+        np.random.seed(2)                               # another run's seeding changes nothing
+        b = np.asarray(grade(photo, *args, rng=np.random.default_rng(7)))
+        assert (a == b).all()
+
+
+def test_arena_reuses_buffers_and_keeps_few_sizes():
+    arena = grading.Arena(max_sizes=1)
+    buf = arena.get("x", (8, 8, 3))
+    assert arena.get("x", (8, 8, 3)) is buf
+    assert arena.get("x", (8, 8)) is not buf            # other shape, other buffer
+    arena.get("x", (4, 4, 3))
+    arena.trim()
+    assert arena.nbytes() == 4 * 4 * 3 * 4               # only the newest size is kept
+    assert arena.get("x", (8, 8, 3)) is not buf
+
+
+def test_graded_images_do_not_share_arena_memory():
+    photo = _photo()
+    first = grading.grade_cyberpunk(photo, None, add_dither=False)
+    before = np.asarray(first).copy()
+    grading.grade_cyberpunk(photo.transpose(Image.FLIP_LEFT_RIGHT), None, add_dither=False)
+    assert (np.asarray(first) == before).all()
+
+
+def test_numba_kernels_match_numpy(monkeypatch):
+    pytest.importorskip("numba")
+    photo = _photo(181, 263)
+    # Noir and cyberpunk with grain on: both paths draw the same grain from the same seed.
+    seeded = lambda: dict(rng=np.random.default_rng(4))
+    cases = ((grading.grade_noir, (), dict(dither_std=0.02), seeded),
+             (grading.grade_v5, (), dict(subject="scene"), dict),
+             (grading.grade_v5, (), dict(subject="portrait", add_dither=False), dict),
+             (grading.grade_cyberpunk, (None,), dict(scanlines=0.2, ca_px=2), seeded),
+             (grading.grade_cyberpunk, (photo.convert("L"),), dict(add_dither=False, protect_skin=False), dict))
+    for grade, args, kw, rng in cases:
+        monkeypatch.setenv("ARTIFY_GRADE_NUMBA", "0")
+        want = grade(photo, *args, strip_rows=100, **rng(), **kw)
+        monkeypatch.setenv("ARTIFY_GRADE_NUMBA", "1")
+        _assert_close(grade(photo, *args, strip_rows=100, **rng(), **kw), want)
+
+
+def test_numba_grades_run_concurrently(monkeypatch):
+    # No lock around the kernels: grading threads launch them side by side.
+    pytest.importorskip("numba")
+    import threading
+    monkeypatch.setenv("ARTIFY_GRADE_NUMBA", "1")
+    photo = _photo(181, 263)
+    grade = lambda: np.asarray(grading.grade_noir(photo, strip_rows=50, rng=np.random.default_rng(6)))
+    want, outs = grade(), []
+    threads = [threading.Thread(target=lambda: outs.extend(grade() for _ in range(3))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(30)
+    assert len(outs) == 12 and all((o == want).all() for o in outs)
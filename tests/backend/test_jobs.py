@@ -0,0 +1,59 @@
+# tests/backend/test_jobs.py
+import time
+
+from .test_utils import make_data_uri
+
+
+def _payload(**over):
+    payload = {
+        "mode": "preview",
+        "style": "noir",
+        "subject": "scene",
+        "imageBase64": make_data_uri(32, 32),
+        "control": "auto",
+        "seed": 7,
+        "extras": {},
+    }
+    payload.update(over)
+    return payload
+
+
+def _wait(client, job_id, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        body = client.get(f"/api/jobs/{job_id}").json()
+        if body["status"] in ("done", "error"):
+            return body
+        time.sleep(0.02)
+    raise AssertionError("job did not finish")
+
+
+def test_job_roundtrip(client, fake_noir):
+    r = client.post("/api/jobs", json=_payload())
+    assert r.status_code == 202, r.text
+    body = _wait(client, r.json()["jobId"])
+    assert body["status"] == "done"
+    assert body["result"]["resultBase64"].startswith("data:image/jpeg")
+    assert body["result"]["traceId"] == r.json()["traceId"]
+
+
+def test_job_error_is_reported(client, fake_noir):
+    r = client.post("/api/jobs", json=_payload(extras={"fail": True}))
+    body = _wait(client, r.json()["jobId"])
+    assert body["status"] == "error"
+    assert body["error"]["code"] == "PIPELINE_ERROR"
+
+
+def test_job_bad_image_rejected_up_front(client, fake_noir):
+    r = client.post("/api/jobs", json=_payload(imageBase64="data:image/jpeg;base64,NOPE"))
+    assert r.status_code == 400
+
+
+def test_unknown_job_404(client):
+    assert client.get("/api/jobs/does-not-exist").status_code == 404
+
+
+def test_sync_stylize_still_works(client, fake_noir):
+    r = client.post("/api/stylize", json=_payload())
+    assert r.status_code == 200, r.text
+    assert r.json()["metrics"]["size"] == {"w": 32, "h": 32}
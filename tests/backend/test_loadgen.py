@@ -0,0 +1,52 @@
+# tests/backend/test_loadgen.py
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+from backend import styles
+from backend.styles import stub
+from .test_jobs import _payload
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+@pytest.fixture
+def stub_style(monkeypatch):
+    # I register the stub the way ARTIFY_STUB_STYLE=1 does, with costs small enough for a test.
+    monkeypatch.setitem(styles.REGISTRY, "stub", stub)
+    monkeypatch.setenv("ARTIFY_EXEC_MODE", "resident")
+    monkeypatch.setenv("ARTIFY_STUB_LOAD_MS", "50")
+    monkeypatch.setenv("ARTIFY_STUB_STEP_MS", "1")
+    monkeypatch.setenv("ARTIFY_STUB_MEM_MB", "4")
+
+
+def test_stub_style_takes_the_full_server_path(client, stub_style):
+    r = client.post("/api/stylize", json=_payload(style="stub", seed=None, steps=3))
+    assert r.status_code == 200, r.text
+    m = r.json()["metrics"]
+    assert {"decode", "resize", "denoise", "grade", "encode"} <= set(m["stagesMs"])
+    assert m["controlNet"] is None and m["pipelineCache"] in ("hit", "miss")
+
+
+def test_stub_style_is_unknown_unless_enabled(client):
+    assert "stub" not in styles.REGISTRY
+    r = client.post("/api/stylize", json=_payload(style="stub", seed=None))
+    assert r.status_code == 422
+
+
+def test_loadgen_summary_percentiles():
+    spec = importlib.util.spec_from_file_location("loadgen", ROOT / "dev" / "loadgen.py")
+    loadgen = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(loadgen)
+
+    assert loadgen.percentile([1, 2, 3, 4], 50) == 2
+    assert loadgen.percentile(list(range(1, 101)), 99) == 99
+    results = [{"style": "stub", "mode": "preview", "status": 200, "latency": i / 10, "durationMs": 100 * i}
+               for i in range(1, 11)]
+    results.append({"style": "stub", "mode": "full", "status": 429, "latency": 0.01})
+    report = loadgen.summarize(results, wall_s=5.0)
+    assert report["stub/preview"]["p50Ms"] == 500 and report["stub/preview"]["p99Ms"] == 1000
+    assert report["stub/preview"]["throughputPerS"] == 2.0
+    assert report["stub/full"] == {"sent": 1, "ok": 0, "errors": {"429": 1}, "cache": {}}
+    assert report["all"]["sent"] == 11
@@ -0,0 +1,71 @@
+# tests/backend/test_postfx.py
+import numpy as np
+import pytest
+from PIL import Image
+
+from backend.utils.runner import load_script
+from .test_grading import _photo
+
+pytest.importorskip("cv2")
+pytest.importorskip("scipy")
+
+grading = load_script("grading")
+postfx = load_script("postfx")
+
+
+def _same(a: Image.Image, b: Image.Image) -> bool:
+    return (np.asarray(a) == np.asarray(b)).all()
+
+
+@pytest.mark.parametrize("numba", ["0", "1"])
+def test_styles_finish_as_their_scripts_always_did(monkeypatch, numba):
+    # The old script code: each grade (with its own finishing) followed by the script's sharpen,
+    # whether the planned stages run fused (numba) or op by op.
+    if numba == "1":
+        pytest.importorskip("numba")
+    monkeypatch.setenv("ARTIFY_GRADE_NUMBA", numba)
+    photo = _photo()
+    assert _same(postfx.noir(photo, rng=np.random.default_rng(3)),
+                 grading.grade_noir(photo, rng=np.random.default_rng(3)))
+    for subject in ("scene", "portrait"):
+        assert _same(postfx.cinematic(photo, subject=subject),
+                     grading.sharpen(grading.grade_v5(photo, subject=subject), 115, 5))
+    kw = dict(edges_for_glow=None, add_dither=False, ca_px=1)
+    assert _same(postfx.cyberpunk(photo, **kw), grading.sharpen(grading.grade_cyberpunk(photo, **kw), 110, 6))
+    assert _same(postfx.cyberpunk(photo, sharpen=False, **kw), grading.grade_cyberpunk(photo, **kw))
+    assert _same(postfx.anime(photo), grading.sharpen(photo, 120, 8))
+
+
+def test_plan_fuses_adjacent_finishing_ops():
+    Op = postfx.Op
+    sharpen = Op("sharpen", dict(percent=115, threshold=5))
+    graph = [Op("v5", {}), sharpen, Op("saturation", dict(scale=1.05)), Op("dither", {}), sharpen]
+    assert [[op.kind for op in ops] for ops in postfx.plan(graph)] == \
+        [["v5"], ["sharpen", "saturation", "dither"], ["sharpen"]]
+    # Out of finish8's order, the ops stay apart.
+    assert len(postfx.plan([Op("dither", {}), Op("saturation", dict(scale=1.2))])) == 2
+    with pytest.raises(ValueError):
+        postfx.plan([Op("blur", {})])
+
+
+def test_fused_finishing_matches_pil_for_every_colour(monkeypatch):
+    pytest.importorskip("numba")
+    monkeypatch.setenv("ARTIFY_GRADE_NUMBA", "1")
+    # All 2^24 colours through the fused saturation (PIL's HSV round trip), plus dither.
+    v = np.arange(256, dtype=np.uint8)
+    cube = Image.fromarray(np.stack(np.meshgrid(v, v, v, indexing="ij"), -1).reshape(4096, 4096, 3))
+    assert _same(grading.finish8(cube, saturation=1.05, dither=True),
+                 grading.ordered_dither(grading.saturate_pil(cube, 1.05)))
+    # The unsharp table against PIL's unsharp mask, on sharp edges and noise.
+    noise = Image.fromarray(np.random.default_rng(0).integers(0, 256, (67, 91, 3), dtype=np.uint8))
+    for img in (noise, _photo()):
+        for percent, threshold in ((115, 5), (110, 6), (120, 8)):
+            assert _same(grading.finish8(img, (percent, threshold)), grading.sharpen(img, percent, threshold))
+
+
+def test_skin_mask_finds_skin_on_a_blue_background():
+    a = np.zeros((60, 80, 3), np.uint8)
+    a[...] = (40, 70, 160)
+    a[20:40, 20:50] = (205, 140, 115)
+    m = np.asarray(grading.skin_mask(Image.fromarray(a)))
+    assert m.shape == (60, 80) and m[26:34, 28:42].min() > 200 and m[:, 60:].max() == 0
@@ -0,0 +1,42 @@
+# tests/backend/test_results.py
+import io
+import json
+
+from PIL import Image
+
+from .test_jobs import _payload
+
+
+def test_default_response_is_json_with_data_uri(client, fake_noir):
+    r = client.post("/api/stylize", json=_payload())
+    assert r.headers["content-type"].startswith("application/json")
+    assert r.json()["resultBase64"].startswith("data:image/jpeg")
+
+
+def test_accept_jpeg_returns_bytes_with_metric_headers(client, fake_noir):
+    r = client.post("/api/stylize", json=_payload(), headers={"Accept": "image/jpeg"})
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "image/jpeg"
+    assert Image.open(io.BytesIO(r.content)).size == (32, 32)
+    assert json.loads(r.headers["x-metrics"])["size"] == {"w": 32, "h": 32}
+    assert r.headers["x-trace-id"]
+
+
+def test_accept_webp_transcodes(client, fake_noir):
+    r = client.post("/api/stylize", json=_payload(), headers={"Accept": "image/webp, application/json;q=0.5"})
+    assert r.headers["content-type"] == "image/webp"
+    assert Image.open(io.BytesIO(r.content)).format == "WEBP"
+
+
+def test_result_by_reference_with_etag(client, fake_noir):
+    body = client.post("/api/stylize?result=ref", json=_payload()).json()
+    assert body["resultBase64"] is None and body["resultUrl"].endswith(body["resultId"])
+    r = client.get(body["resultUrl"])
+    assert r.status_code == 200 and r.headers["content-type"] == "image/jpeg"
+    assert "immutable" in r.headers["cache-control"]
+    again = client.get(body["resultUrl"], headers={"If-None-Match": r.headers["etag"]})
+    assert again.status_code == 304
+
+
+def test_unknown_result_is_404(client):
+    assert client.get("/api/results/0123456789abcdef").status_code == 404
@@ -0,0 +1,256 @@
+# tests/backend/test_runner.py
+import os
+import shutil
+import textwrap
+import threading
+import time
+import pytest
+from PIL import Image
+
+from backend import cancellation, telemetry
+from backend.utils import runner, workers
+
+FAKE_SCRIPT = textwrap.dedent('''
+    import argparse, os, time
+    from PIL import Image, ImageOps
+
+    CALLS = []
+    BATCHES = []
+
+    def build_parser():
+        p = argparse.ArgumentParser()
+        p.add_argument("-i", "--input", required=True)
+        p.add_argument("-o", "--output", required=True)
+        p.add_argument("--steps", type=int, default=1)
+        p.add_argument("--seed", type=int, default=0)
+        p.add_argument("--crash", action="store_true")
+        p.add_argument("--slow", type=int, default=0)
+        return p
+
+    class FakePipe:
+        num_timesteps = 2
+
+    def stylize_image(src, args):
+        if args.crash:
+            os._exit(3)
+        CALLS.append(args.steps)
+        # I step through a pretend denoising loop the way diffusers calls the step callback.
+        import numpy as np, step_hooks
+        hooks = step_hooks.pipe_kwargs()
+        for i in range(args.slow or FakePipe.num_timesteps):
+            time.sleep(0.05 if args.slow else 0)
+            if hooks:
+                hooks["callback_on_step_end"](FakePipe, i, 999 - i, {"latents": np.zeros((1, 4, 3, 5), np.float32)})
+        import stages
+        stages.note("controlNet", "lllyasviel/sd-controlnet-canny")
+        with stages.stage("grade"):
+            return ImageOps.invert(src.convert("RGB"))
+
+    def stylize_batch(images, args_list):
+        BATCHES.append(sorted(a.seed for a in args_list))
+        return [stylize_image(im, a) for im, a in zip(images, args_list)]
+
+    if __name__ == "__main__":
+        import sys
+        if "--serve" in sys.argv[1:]:
+            import worker_serve
+            worker_serve.serve(build_parser, stylize_image)
+        else:
+            a = build_parser().parse_args()
+            stylize_image(Image.open(a.input), a).save(a.output)
+''')
+
+
+@pytest.fixture
+def fake_script(tmp_path, monkeypatch):
+    scripts = tmp_path / "scripts"
+    scripts.mkdir()
+    path = scripts / "fake_stylize.py"
+    path.write_text(FAKE_SCRIPT, encoding="utf-8")
+    for helper in ("worker_serve.py", "step_hooks.py", "stages.py"):
+        shutil.copy(os.path.join(runner.SCRIPTS_DIR, helper), scripts)
+    monkeypatch.setattr(runner, "SCRIPTS_DIR", str(scripts))
+    monkeypatch.setattr(runner, "RUNTIME_DIR", str(tmp_path / "runtime"))
+    yield str(path)
+    workers.shutdown_all()
+
+
+@pytest.mark.parametrize("mode", ["subprocess", "resident", "worker"])
+def test_run_script_modes_agree(fake_script, monkeypatch, mode):
+    monkeypatch.setenv("ARTIFY_EXEC_MODE", mode)
+    out = runner.run_script(fake_script, "fake", Image.new("RGB", (16, 8), (10, 20, 30)), ["--steps", "3"])
+    assert out.size == (16, 8)
+    assert out.getpixel((0, 0)) == (245, 235, 225)
+
+
+def test_resident_mode_imports_script_once(fake_script, monkeypatch):
+    monkeypatch.setenv("ARTIFY_EXEC_MODE", "resident")
+    img = Image.new("RGB", (8, 8))
+    runner.run_script(fake_script, "fake", img, ["--steps", "1"])
+    runner.run_script(fake_script, "fake", img, ["--steps", "2"])
+    assert runner.load_script(fake_script).CALLS[-2:] == [1, 2]
+
+
+def test_resident_mode_turns_exit_into_runtime_error(fake_script, monkeypatch):
+    monkeypatch.setenv("ARTIFY_EXEC_MODE", "resident")
+    with pytest.raises(RuntimeError):
+        runner.run_script(fake_script, "fake", Image.new("RGB", (8, 8)), ["--unknown-flag"])
+
+
+def test_worker_mode_reuses_and_recycles_workers(fake_script, monkeypatch):
+    monkeypatch.setenv("ARTIFY_EXEC_MODE", "worker")
+    monkeypatch.setenv("ARTIFY_WORKER_MAX_JOBS", "2")
+    img = Image.new("RGB", (8, 8))
+    pool = workers.get_pool(fake_script, "fake")
+    live = []
+    for _ in range(3):
+        runner.run_script(fake_script, "fake", img, [])
+        live.append([w["pid"] for w in pool.status()["workers"]])
+    # One warm worker serves two jobs, is recycled, and a fresh one takes the third.
+    assert len(live[0]) == 1
+    assert live[1] == []
+    assert len(live[2]) == 1 and live[2] != live[0]
+
+
+def test_worker_crash_is_reported_and_replaced(fake_script, monkeypatch):
+    monkeypatch.setenv("ARTIFY_EXEC_MODE", "worker")
+    img = Image.new("RGB", (8, 8))
+    with pytest.raises(RuntimeError):
+        runner.run_script(fake_script, "fake", img, ["--crash"])
+    out = runner.run_script(fake_script, "fake", img, [])
+    assert out.size == (8, 8)
+
+
+def test_resident_mode_batches_compatible_runs(fake_script, monkeypatch):
+    monkeypatch.setenv("ARTIFY_EXEC_MODE", "resident")
+    monkeypatch.setenv("ARTIFY_BATCH_WINDOW_MS", "300")
+    outs = {}
+
+    def call(seed, steps):
+        img = Image.new("RGB", (4, 4), (seed, seed, seed))
+        outs[seed] = runner.run_script(fake_script, "fake", img, ["--steps", steps, "--seed", str(seed)])
+
+    threads = [threading.Thread(target=call, args=(s, st)) for s, st in ((1, "2"), (2, "2"), (3, "2"), (4, "5"))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    # Same flags but the seed share one call; different --steps is a different batch.
+    assert sorted(runner.load_script(fake_script).BATCHES[-2:]) == [[1, 2, 3], [4]]
+    assert {s: o.getpixel((0, 0))[0] for s, o in outs.items()} == {1: 254, 2: 253, 3: 252, 4: 251}
+
+
+def test_every_batch_member_gets_progress_stages_and_its_own_cancel(fake_script, monkeypatch):
+    from backend import progress
+    monkeypatch.setenv("ARTIFY_EXEC_MODE", "resident")
+    monkeypatch.setenv("ARTIFY_BATCH_WINDOW_MS", "300")
+    events = {s: [] for s in (1, 2, 3)}
+    traces = {s: telemetry.Trace("noir", "preview", "scene") for s in (1, 2, 3)}
+    tokens = {s: cancellation.CancelToken() for s in (1, 2, 3)}
+    outs, ended = {}, {}
+    t0 = time.time()
+
+    def call(seed):
+        with progress.reporting(events[seed].append), telemetry.tracing(traces[seed]), \
+                cancellation.watching(tokens[seed]):
+            try:
+                outs[seed] = runner.run_script(fake_script, "fake", Image.new("RGB", (4, 4)),
+                                               ["--slow", "10", "--seed", str(seed)])
+            except cancellation.Cancelled as e:
+                outs[seed] = e
+        ended[seed] = time.time() - t0
+
+    threads = [threading.Thread(target=call, args=(s,)) for s in (1, 2, 3)]
+    for t in threads:
+        t.start()
+        time.sleep(0.02)        # seed 1 opens the batch and leads it
+    # Follower seed 2 walks away while the batch (3 x 0.5 s of steps) is running.
+    threading.Timer(0.5, tokens[2].release).start()
+    for t in threads:
+        t.join(5)
+    assert runner.load_script(fake_script).BATCHES[-1] == [1, 2, 3]
+    assert isinstance(outs[2], cancellation.Cancelled) and ended[2] < 1.0 < min(ended[1], ended[3])
+    assert outs[1].size == outs[3].size == (4, 4)
+    # Followers see the batch's steps and stages, not just the run that leads it.
+    assert len(events[1]) == len(events[3]) == 30 and 0 < len(events[2]) < 30
+    assert "grade" in traces[1].stages and "grade" in traces[3].stages
+
+
+def test_worker_mode_moves_pixels_without_touching_disk(fake_script, monkeypatch):
+    monkeypatch.setenv("ARTIFY_EXEC_MODE", "worker")
+    img = Image.new("RGB", (33, 17), (1, 2, 3))
+    out = runner.run_script(fake_script, "fake", img, [])
+    assert out.size == (33, 17) and out.getpixel((32, 16)) == (254, 253, 252)
+    assert not os.path.exists(runner.RUNTIME_DIR)
+
+
+@pytest.mark.parametrize("mode", ["resident", "worker"])
+def test_progress_reaches_the_calling_threads_sink(fake_script, monkeypatch, mode):
+    from backend import progress
+    monkeypatch.setenv("ARTIFY_EXEC_MODE", mode)
+    monkeypatch.setenv("ARTIFY_PREVIEW_EVERY", "2")
+    events = []
+    with progress.reporting(events.append):
+        runner.run_script(fake_script, "fake", Image.new("RGB", (8, 8)), [])
+    assert [(e["step"], e["steps"]) for e in events] == [(1, 2), (2, 2)]
+    # Only every 2nd step carries a preview, at latent size, mid-grey for zero latents.
+    assert events[0]["preview"] is None
+    assert events[1]["preview"].size == (5, 3) and events[1]["preview"].getpixel((0, 0)) == (127, 127, 127)
+    # Without a sink the pipelines get no callback at all.
+    runner.run_script(fake_script, "fake", Image.new("RGB", (8, 8)), [])
+    assert len(events) == 2
+
+
+@pytest.mark.parametrize("mode", ["subprocess", "resident", "worker"])
+def test_cancel_token_stops_a_running_script(fake_script, monkeypatch, mode):
+    monkeypatch.setenv("ARTIFY_EXEC_MODE", mode)
+    img = Image.new("RGB", (8, 8))
+    token = cancellation.CancelToken()
+    threading.Timer(0.5, token.release).start()
+    t0 = time.time()
+    # --slow 200 would take 10 s to finish on its own.
+    with cancellation.watching(token), pytest.raises(cancellation.Cancelled) as ex:
+        runner.run_script(fake_script, "fake", img, ["--slow", "200"])
+    assert ex.value.reason == "cancelled"
+    assert time.time() - t0 < 4
+    if mode == "worker":
+        # The worker stopped at a step boundary and stays warm for the next job.
+        pid = workers.status_all()["fake"]["workers"][0]["pid"]
+        runner.run_script(fake_script, "fake", img, [])
+        assert workers.status_all()["fake"]["workers"][0]["pid"] == pid
+
+
+def test_cancel_reaches_a_worker_that_is_streaming_progress(fake_script, monkeypatch):
+    from backend import progress
+    monkeypatch.setenv("ARTIFY_EXEC_MODE", "worker")
+    events = []
+    # A progress frame every 50 ms keeps the pipe busy; the token must still be seen.
+    with progress.reporting(events.append), \
+            cancellation.watching(cancellation.CancelToken(deadline=time.time() + 0.5)), \
+            pytest.raises(cancellation.Cancelled) as ex:
+        runner.run_script(fake_script, "fake", Image.new("RGB", (8, 8)), ["--slow", "200"])
+    assert ex.value.reason == "deadline"
+    assert 0 < len(events) < 100
+
+
+def test_deadline_stops_a_resident_run(fake_script, monkeypatch):
+    monkeypatch.setenv("ARTIFY_EXEC_MODE", "resident")
+    with cancellation.watching(cancellation.CancelToken(deadline=time.time() + 0.2)), \
+            pytest.raises(cancellation.Cancelled) as ex:
+        runner.run_script(fake_script, "fake", Image.new("RGB", (8, 8)), ["--slow", "200"])
+    assert ex.value.reason == "deadline"
+
+
+@pytest.mark.parametrize("mode,expected", [
+    ("subprocess", {"spool_write", "spawn", "grade"}),
+    ("resident", {"grade"}),
+    ("worker", {"spawn", "grade"}),
+])
+def test_script_stages_reach_the_trace(fake_script, monkeypatch, mode, expected):
+    monkeypatch.setenv("ARTIFY_EXEC_MODE", mode)
+    trace = telemetry.Trace("noir", "preview", "scene")
+    with telemetry.tracing(trace):
+        runner.run_script(fake_script, "fake", Image.new("RGB", (8, 8)), [])
+    assert set(trace.stages) == expected
+    assert all(seconds >= 0 for seconds in trace.stages.values())
+    assert trace.notes == {"controlNet": "lllyasviel/sd-controlnet-canny"}
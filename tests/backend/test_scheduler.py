@@ -0,0 +1,63 @@
+# tests/backend/test_scheduler.py
+import threading
+import time
+
+from backend.scheduler import PriorityScheduler
+
+
+def _blocked(sched, cls):
+    # I occupy one thread until the returned event is set.
+    gate = threading.Event()
+    sched.submit(cls, gate.wait, 5)
+    return gate
+
+
+def _wait_running(sched, cls, n=1):
+    deadline = time.time() + 2
+    while sched.status()["running"][cls] < n and time.time() < deadline:
+        time.sleep(0.005)
+
+
+def test_preview_jumps_ahead_of_queued_full():
+    sched = PriorityScheduler(threads=1, slots={"preview": 1, "full": 1}, aging_s=60)
+    gate = _blocked(sched, "full")
+    _wait_running(sched, "full")
+    order = []
+    futs = [sched.submit("full", order.append, "full"),
+            sched.submit("preview", order.append, "preview")]
+    gate.set()
+    for f in futs:
+        f.result(timeout=2)
+    assert order == ["preview", "full"]
+
+
+def test_aging_lets_old_full_job_go_first():
+    sched = PriorityScheduler(threads=1, slots={"preview": 1, "full": 1}, aging_s=0.05)
+    gate = _blocked(sched, "full")
+    _wait_running(sched, "full")
+    order = []
+    futs = [sched.submit("full", order.append, "full")]
+    time.sleep(0.2)     # well past one aging period
+    futs.append(sched.submit("preview", order.append, "preview"))
+    gate.set()
+    for f in futs:
+        f.result(timeout=2)
+    assert order == ["full", "preview"]
+
+
+def test_full_slots_leave_room_for_previews():
+    sched = PriorityScheduler(threads=2, slots={"preview": 2, "full": 1}, aging_s=60)
+    gate = _blocked(sched, "full")
+    _wait_running(sched, "full")
+    queued_full = sched.submit("full", lambda: "full")
+    # The second full job must wait for the full slot; a preview still runs immediately.
+    assert sched.submit("preview", lambda: "preview").result(timeout=2) == "preview"
+    assert not queued_full.done()
+    gate.set()
+    assert queued_full.result(timeout=2) == "full"
+
+
+def test_errors_reach_the_future():
+    sched = PriorityScheduler(threads=1, slots={"preview": 1, "full": 1}, aging_s=60)
+    fut = sched.submit("preview", lambda: 1 / 0)
+    assert isinstance(fut.exception(timeout=2), ZeroDivisionError)
@@ -0,0 +1,36 @@
+# tests/backend/test_spool.py
+import os
+import time
+
+from backend.utils.spool import Spool
+
+
+def _write(path, n, age_s=0):
+    with open(path, "wb") as f:
+        f.write(b"x" * n)
+    t = time.time() - age_s
+    os.utime(path, (t, t))
+
+
+def test_scratch_files_are_deleted_after_the_run(tmp_path):
+    sp = Spool(str(tmp_path), quota_bytes=1 << 20, ttl_s=3600)
+    with sp.scratch("noir") as sc:
+        p = sc.path("in")
+        _write(p, 10)
+        assert os.path.basename(p).startswith("noir_in_")
+        assert sp.status()["inUse"] == 1
+    assert not os.path.exists(p)
+    assert sp.status()["inUse"] == 0
+
+
+def test_sweep_enforces_ttl_and_quota_but_spares_live_runs(tmp_path):
+    sp = Spool(str(tmp_path), quota_bytes=25, ttl_s=60)
+    _write(tmp_path / "old_in_1.png", 5, age_s=120)       # expired
+    _write(tmp_path / "a_out_2.png", 10, age_s=30)        # oldest of the fresh ones → over quota
+    _write(tmp_path / "b_out_3.png", 10, age_s=20)
+    with sp.scratch("live") as sc:
+        live = sc.path("in")
+        _write(live, 10, age_s=500)                       # old but in use
+        st = sp.sweep()
+        assert sorted(os.listdir(tmp_path)) == sorted(["b_out_3.png", os.path.basename(live)])
+        assert st["deletedFiles"] == 2 and st["bytes"] == 20
@@ -0,0 +1,41 @@
+# tests/backend/test_stream.py
+import json
+
+from .test_jobs import _payload
+
+
+def _events(r):
+    out = []
+    for block in r.text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        out.append((lines["event"], json.loads(lines["data"])))
+    return out
+
+
+def test_stream_sends_progress_then_result(client, fake_noir):
+    r = client.post("/api/stylize/stream", json=_payload(seed=None))
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/event-stream")
+    events = _events(r)
+    assert [name for name, _ in events] == ["accepted", "progress", "progress", "result"]
+    assert events[1][1] == {"step": 1, "steps": 2}
+    assert events[2][1]["previewBase64"].startswith("data:image/jpeg")
+    assert events[3][1]["resultBase64"].startswith("data:image/jpeg")
+    assert events[3][1]["traceId"] == events[0][1]["traceId"] == r.headers["x-trace-id"]
+
+
+def test_stream_cache_hit_skips_progress(client, fake_noir):
+    client.post("/api/stylize", json=_payload())
+    events = _events(client.post("/api/stylize/stream", json=_payload()))
+    assert [name for name, _ in events] == ["accepted", "result"]
+    assert events[1][1]["metrics"]["cache"] == "hit"
+
+
+def test_stream_reports_pipeline_errors_as_events(client, fake_noir):
+    events = _events(client.post("/api/stylize/stream", json=_payload(extras={"fail": True})))
+    assert events[-1] == ("error", {"code": "PIPELINE_ERROR", "message": "boom"})
+
+
+def test_stream_rejects_bad_input_before_streaming(client, fake_noir):
+    r = client.post("/api/stylize/stream", json=_payload(imageBase64="data:image/png;base64,AAAA"))
+    assert r.status_code == 400
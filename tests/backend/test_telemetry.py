@@ -0,0 +1,66 @@
+# tests/backend/test_telemetry.py
+import time
+
+from backend import telemetry
+from .test_jobs import _payload
+
+
+def test_histogram_renders_prometheus_text():
+    reg = telemetry.Registry()
+    h = reg.histogram("t_seconds", "Test.", ("stage",), buckets=(0.1, 1.0))
+    h.observe("decode", value=0.05)
+    h.observe("decode", value=0.5)
+    c = reg.counter("t_total", "Test.", ("outcome",))
+    c.inc("ok")
+    lines = reg.render().splitlines()
+    assert "# TYPE t_seconds histogram" in lines
+    assert 't_seconds_bucket{stage="decode",le="0.1"} 1' in lines
+    assert 't_seconds_bucket{stage="decode",le="1"} 2' in lines
+    assert 't_seconds_bucket{stage="decode",le="+Inf"} 2' in lines
+    assert 't_seconds_sum{stage="decode"} 0.55' in lines
+    assert 't_total{outcome="ok"} 1' in lines
+
+
+def test_nested_stages_are_exclusive():
+    trace = telemetry.Trace("noir", "full", "scene")
+    with trace.stage("denoise"):
+        time.sleep(0.02)
+        with trace.stage("annotator"):
+            time.sleep(0.05)
+    assert trace.stages["annotator"] >= 0.05
+    assert 0.02 <= trace.stages["denoise"] < 0.05
+
+
+def test_metrics_endpoint_counts_requests_and_stages(client, fake_noir):
+    labels = ("noir", "preview", "scene")
+    before = telemetry.STAGE_SECONDS.count("decode", *labels), telemetry.REQUESTS.value(*labels, "ok")
+    assert client.post("/api/stylize", json=_payload(seed=None)).status_code == 200
+    assert telemetry.STAGE_SECONDS.count("decode", *labels) == before[0] + 1
+    assert telemetry.REQUESTS.value(*labels, "ok") == before[1] + 1
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'artify_stage_seconds_count{stage="encode",style="noir",mode="preview",subject="scene"}' in r.text
+    assert 'artify_scheduler_runs{class="preview",state="queued"} 0' in r.text
+
+
+def test_response_metrics_report_what_the_run_did(client, fake_noir, monkeypatch):
+    from backend import styles
+    stylize = styles.REGISTRY["noir"].stylize
+
+    def noting(image, **kw):
+        # I report like a script would: the ControlNet auto picked, and a resident pipeline.
+        trace = telemetry.current()
+        trace.note("controlNet", "lllyasviel/control_v11p_sd15_softedge")
+        trace.note("pipelineHits", 1)
+        trace.add("denoise", 0.25)
+        return stylize(image, **kw)
+    monkeypatch.setattr(styles.REGISTRY["noir"], "stylize", noting)
+
+    m = client.post("/api/stylize", json=_payload(seed=None)).json()["metrics"]
+    assert m["controlNet"] == "hed"
+    assert m["controlNetModel"] == "lllyasviel/control_v11p_sd15_softedge"
+    assert m["pipelineCache"] == "hit" and m["controlMapCache"] is None
+    assert m["stagesMs"]["denoise"] == 250
+    assert {"decode", "encode"} <= set(m["stagesMs"])
@@ -0,0 +1,53 @@
+# tests/backend/test_upload.py
+import io
+
+from PIL import Image
+
+
+def _png(w=32, h=24):
+    buf = io.BytesIO()
+    Image.new("RGB", (w, h), (200, 10, 10)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+FORM = {"mode": "preview", "style": "noir", "subject": "scene", "seed": "7", "extras": "{}"}
+
+
+def test_upload_roundtrip(client, fake_noir):
+    r = client.post("/api/stylize/upload", data=FORM, files={"image": ("photo.png", _png(), "image/png")})
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["resultBase64"].startswith("data:image/jpeg")
+    assert body["metrics"]["size"] == {"w": 32, "h": 24}
+
+
+def test_upload_matches_json_cache_key(client, fake_noir):
+    # The same pixels sent either way are the same request.
+    import base64
+    data_uri = "data:image/png;base64," + base64.b64encode(_png()).decode()
+    first = client.post("/api/stylize", json={**FORM, "seed": 7, "extras": {}, "imageBase64": data_uri}).json()
+    second = client.post("/api/stylize/upload", data=FORM, files={"image": ("p.png", _png(), "image/png")}).json()
+    assert (first["metrics"]["cache"], second["metrics"]["cache"]) == ("miss", "hit")
+
+
+def test_upload_over_limit_is_413(client, fake_noir):
+    big = b"\0" * (10 * 1024 * 1024 + 1)
+    r = client.post("/api/stylize/upload", data=FORM, files={"image": ("big.png", big, "image/png")})
+    assert r.status_code == 413
+    assert r.json()["detail"]["code"] == "PAYLOAD_TOO_LARGE"
+
+
+def test_upload_missing_image_is_400(client, fake_noir):
+    r = client.post("/api/stylize/upload", data=FORM, files={"other": ("x.txt", b"x", "text/plain")})
+    assert r.status_code == 400
+
+
+def test_upload_bad_option_is_422(client, fake_noir):
+    r = client.post("/api/stylize/upload", data={**FORM, "style": "nope"},
+                    files={"image": ("photo.png", _png(), "image/png")})
+    assert r.status_code == 422
+
+
+def test_upload_requires_multipart(client):
+    r = client.post("/api/stylize/upload", json=FORM)
+    assert r.status_code == 400
@@ -0,0 +1,116 @@
+# tests/bench/conftest.py
+"""
+Micro-benchmarks for the CPU work every request pays for: the scripts' colour grades
+(scripts/grading.py) and the server's image utilities (backend/utils/images.py).
+
+Opt-in, like the heavy tests:
+  RUN_BENCH=1 python -m pytest -m bench tests/bench -q
+
+  BENCH_UPDATE=1     write what was measured to baselines.json instead of comparing
+  BENCH_TOLERANCE    allowed slowdown (time or peak memory) vs. baseline, default 0.5 = 50 %
+  BENCH_REPEAT       timed runs per case, the best one counts (default 5)
+
+Baselines are machine-specific: refresh them with BENCH_UPDATE=1 on the box that runs the check.
+Shared CI boxes are noisy (±40 % between runs is common), hence the loose default; on a quiet
+machine tighten BENCH_TOLERANCE.
+Peak memory is what tracemalloc sees (numpy buffers and Python objects, not PIL/OpenCV internals).
+The grades keep scratch buffers between calls (grading.Arena); those show up as "retained MB",
+not in the peak, which only counts what one more call allocates.
+"""
+import os
+import sys
+import json
+import time
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "scripts"))   # grading.py imports its sibling helpers
+
+BASELINES = Path(__file__).with_name("baselines.json")
+RESULTS = {}
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def _load_baselines() -> dict:
+    try:
+        return json.loads(BASELINES.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+class Bench:
+    def __init__(self, baselines: dict):
+        self.baselines = baselines
+        self.tolerance = _env_float("BENCH_TOLERANCE", 0.5)
+        self.repeat = max(1, int(_env_float("BENCH_REPEAT", 5)))
+        self.update = os.environ.get("BENCH_UPDATE") == "1"
+
+    def run(self, name: str, fn, megapixels: float, retained=None) -> dict:
+        """
+        I time `fn()` (best of BENCH_REPEAT after a warm-up), record it and check it against the baseline.
+        `retained()`, if given, returns the bytes `fn` keeps allocated between calls.
+        """
+        fn()    # warm-up: lazy imports, first-touch allocations
+        tracemalloc.start()
+        try:
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        best = float("inf")
+        for _ in range(self.repeat):
+            t0 = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - t0)
+
+        result = {"seconds": round(best, 5), "mpxPerS": round(megapixels / best, 2), "peakMB": round(peak / 2**20, 2)}
+        if retained is not None:
+            result["retainedMB"] = round(retained() / 2**20, 2)
+        RESULTS[name] = result
+        base = self.baselines.get(name)
+        if base and not self.update:
+            limit = 1.0 + self.tolerance
+            # A millisecond of slack keeps timer noise on the tiny cases from failing the run.
+            assert best <= base["seconds"] * limit + 0.001, (
+                f"{name}: {best * 1000:.1f} ms vs baseline {base['seconds'] * 1000:.1f} ms (> +{self.tolerance:.0%})")
+            assert result["peakMB"] <= max(base["peakMB"] * limit, base["peakMB"] + 1.0), (
+                f"{name}: peak {result['peakMB']} MB vs baseline {base['peakMB']} MB (> +{self.tolerance:.0%})")
+            if "retainedMB" in result and "retainedMB" in base:
+                assert result["retainedMB"] <= max(base["retainedMB"] * limit, base["retainedMB"] + 1.0), (
+                    f"{name}: retains {result['retainedMB']} MB vs baseline {base['retainedMB']} MB")
+        return result
+
+
+@pytest.fixture(scope="session")
+def bench():
+    return Bench(_load_baselines())
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if RESULTS and os.environ.get("BENCH_UPDATE") == "1":
+        merged = {**_load_baselines(), **RESULTS}
+        BASELINES.write_text(json.dumps(dict(sorted(merged.items())), indent=2) + "\n", encoding="utf-8")
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not RESULTS:
+        return
+    baselines = _load_baselines()
+    tr = terminalreporter
+    tr.section("benchmarks")
+    tr.write_line(f"{'case':<36}{'ms':>10}{'Mpx/s':>10}{'peak MB':>10}{'kept MB':>10}{'vs base':>10}")
+    for name, r in sorted(RESULTS.items()):
+        base = baselines.get(name)
+        ratio = f"{r['seconds'] / base['seconds']:.2f}x" if base else "-"
+        kept = f"{r['retainedMB']:.1f}" if "retainedMB" in r else "-"
+        tr.write_line(f"{name:<36}{r['seconds'] * 1000:>10.1f}{r['mpxPerS']:>10.2f}{r['peakMB']:>10.1f}{kept:>10}{ratio:>10}")
@@ -0,0 +1,76 @@
+# tests/bench/test_hot_paths.py
+import os
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+import grading
+from backend.utils import images
+
+pytestmark = [
+    pytest.mark.bench,
+    pytest.mark.skipif(os.getenv("RUN_BENCH") != "1", reason="Benchmarks run only with RUN_BENCH=1"),
+]
+
+# Long side of the image in px; 768 and 1280 are the preview and full render sizes.
+SIZES = (512, 768, 1280, 2048)
+
+
+def _photo(side: int) -> Image.Image:
+    # A 4:3 stand-in for a render: smooth gradients, some edges, and fine noise, always the same.
+    w, h = side, side * 3 // 4
+    rng = np.random.default_rng(side)
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    base = np.stack([xx / w, yy / h, 0.5 + 0.5 * np.sin(xx / 37.0) * np.cos(yy / 23.0)], axis=2)
+    blocks = ((xx // 64 + yy // 64) % 2)[..., None] * 0.25
+    arr = np.clip(base * 0.75 + blocks + rng.normal(0, 0.03, (h, w, 3)), 0, 1)
+    return Image.fromarray((arr * 255).astype(np.uint8)).filter(ImageFilter.GaussianBlur(0.6))
+
+
+def _mpx(img: Image.Image) -> float:
+    return img.size[0] * img.size[1] / 1e6
+
+
+def _grade(bench, name, fn, img):
+    # I start from an empty arena so "retained" is this case's scratch buffers only.
+    grading.release_arena()
+    bench.run(name, fn, _mpx(img), retained=lambda: grading.arena().nbytes())
+
+
+@pytest.mark.parametrize("side", SIZES)
+def test_grade_noir(bench, side):
+    img = _photo(side)
+    _grade(bench, f"grade_noir@{side}", lambda: grading.grade_noir(img), img)
+
+
+@pytest.mark.parametrize("subject", ["scene", "portrait"])
+@pytest.mark.parametrize("side", SIZES)
+def test_grade_v5(bench, side, subject):
+    img = _photo(side)
+    _grade(bench, f"grade_v5[{subject}]@{side}", lambda: grading.grade_v5(img, subject=subject), img)
+
+
+@pytest.mark.parametrize("side", SIZES)
+def test_grade_cyberpunk(bench, side):
+    img = _photo(side)
+    _grade(bench, f"grade_cyberpunk@{side}", lambda: grading.grade_cyberpunk(img, edges_for_glow=None, ca_px=1), img)
+
+
+@pytest.mark.parametrize("side", SIZES)
+def test_resize_max_side(bench, side):
+    # From a 12 MP phone photo down to the render size, as the server does for every upload.
+    src = _photo(4032)
+    bench.run(f"resize_max_side@{side}", lambda: images.resize_max_side(src, side), _mpx(src))
+
+
+@pytest.mark.parametrize("side", SIZES)
+def test_decode_data_uri(bench, side):
+    img = _photo(side)
+    uri = images.encode_pil_to_data_uri(img)
+    bench.run(f"decode_data_uri_to_pil@{side}", lambda: images.decode_data_uri_to_pil(uri), _mpx(img))
+
+
+@pytest.mark.parametrize("side", SIZES)
+def test_encode_data_uri(bench, side):
+    img = _photo(side)
+    bench.run(f"encode_pil_to_data_uri@{side}", lambda: images.encode_pil_to_data_uri(img), _mpx(img))